@@ -1,3 +1,17 @@
+# 語音降噪：STFT → 時間方向中值濾波 → 頻率加權 → Wiener 濾波 → ISTFT → noisereduce → 音量補償
+# - 批次模式（--batch）：以 librosa.load 讀入整段錄音在記憶體中處理，並畫出處理前後的頻譜圖
+# - 串流模式（預設）：以 soundfile 逐塊讀取與寫入，記憶體用量只與區塊大小有關，可處理任意長度的錄音
+#   STFT 幀跨區塊連續切出，中值濾波保留前後各一幀，ISTFT 以重疊相加累積尚未完成的樣本，
+#   noisereduce 依 reduce_noise 本身的分塊方式（NR_CHUNK_SIZE / NR_PADDING）處理，結果與批次模式在浮點誤差內相同
+#   音量補償需要整段的 RMS，因此先寫入暫存檔，再逐塊讀回套用增益
+#
+# 用法：
+#   python audio.py input.wav output.wav
+#   python audio.py input.wav output.wav --batch   整段載入並畫出頻譜圖
+import argparse
+import os
+import tempfile
+
 import numpy as np
 import soundfile as sf
 import librosa
@@ -8,16 +22,21 @@ import noisereduce as nr
 from scipy.signal import wiener
 
 filename = "C:/voice/johnvoice3.wav"
-y, sr = librosa.load(filename, sr=None)
+output_filename = "C:/voice/johnvoice_filtered_final3.wav"
 
 n_fft = 2048
 hop_length = 512
-D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
-magnitude, phase = np.abs(D), np.angle(D)
 
-filtered_magnitude = np.apply_along_axis(
-    lambda x: signal.medfilt(x, kernel_size=3), axis=1, arr=magnitude
-)
+# 串流模式每次讀取的樣本數
+BLOCK_SIZE = 65536
+
+# noisereduce 的分塊樣本數與每塊前後的上下文樣本數（與 reduce_noise 的預設值相同，批次與串流結果才會一致）
+NR_CHUNK_SIZE = 600000
+NR_PADDING = 30000
+NR_PROP_DECREASE = 0.8
+
+# 音量補償的最大增益
+MAX_GAIN = 1.5
 
 
 def frequency_weighting(
@@ -29,52 +48,314 @@ def frequency_weighting(
     return low_weights * low_scale + high_weights * high_scale
 
 
-freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
-weights = frequency_weighting(freqs)
+# 頻率加權後對每一幀的頻譜做 Wiener 濾波（各幀獨立，批次與串流共用）
+def weight_and_wiener(magnitude, weights):
+    magnitude = magnitude * weights[:, np.newaxis]
+    for i in range(magnitude.shape[1]):
+        magnitude[:, i] = wiener(magnitude[:, i], mysize=5)
+    return magnitude
 
-filtered_magnitude = filtered_magnitude * weights[:, np.newaxis]
 
-for i in range(filtered_magnitude.shape[1]):
-    filtered_magnitude[:, i] = wiener(filtered_magnitude[:, i], mysize=5)
+# 音量補償：讓處理後的 RMS 接近原始錄音，最多放大 MAX_GAIN 倍
+def compensation_gain(rms_original, rms_filtered):
+    return min(MAX_GAIN, rms_original / (rms_filtered + 1e-8))
 
-filtered_D = filtered_magnitude * np.exp(1j * phase)
 
-filtered_y = librosa.istft(filtered_D, hop_length=hop_length)
+# 批次模式：整段錄音在記憶體中處理，回傳 (處理後的音訊, 原始振幅譜, 處理後的振幅譜)
+def denoise_batch(y, sr):
+    D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+    magnitude, phase = np.abs(D), np.angle(D)
 
-filtered_y = nr.reduce_noise(y=filtered_y, sr=sr, stationary=False, prop_decrease=0.8)
+    filtered_magnitude = np.apply_along_axis(
+        lambda x: signal.medfilt(x, kernel_size=3), axis=1, arr=magnitude
+    )
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    filtered_magnitude = weight_and_wiener(
+        filtered_magnitude, frequency_weighting(freqs)
+    )
 
-rms_original = np.sqrt(np.mean(y**2))
-rms_filtered = np.sqrt(np.mean(filtered_y**2))
-gain = min(1.5, rms_original / (rms_filtered + 1e-8))
-filtered_y = filtered_y * gain
+    filtered_D = filtered_magnitude * np.exp(1j * phase)
+    filtered_y = librosa.istft(filtered_D, hop_length=hop_length)
+    filtered_y = nr.reduce_noise(
+        y=filtered_y, sr=sr, stationary=False, prop_decrease=NR_PROP_DECREASE
+    )
 
-output_filename = "C:/voice/johnvoice_filtered_final3.wav"
-sf.write(output_filename, filtered_y, sr)
-print(f"Filtered speech saved as {output_filename}")
-
-plt.figure(figsize=(12, 5))
-
-plt.subplot(1, 2, 1)
-librosa.display.specshow(
-    librosa.amplitude_to_db(magnitude, ref=np.max),
-    sr=sr,
-    hop_length=hop_length,
-    y_axis="log",
-    x_axis="time",
-)
-plt.title("Original Spectrogram")
-plt.colorbar(format="%+2.0f dB")
-
-plt.subplot(1, 2, 2)
-librosa.display.specshow(
-    librosa.amplitude_to_db(filtered_magnitude, ref=np.max),
-    sr=sr,
-    hop_length=hop_length,
-    y_axis="log",
-    x_axis="time",
-)
-plt.title("Filtered Spectrogram")
-plt.colorbar(format="%+2.0f dB")
-
-plt.subplots_adjust(wspace=0.3)
-plt.show()
+    rms_original = np.sqrt(np.mean(y**2))
+    rms_filtered = np.sqrt(np.mean(filtered_y**2))
+    gain = compensation_gain(rms_original, rms_filtered)
+    return filtered_y * gain, magnitude, filtered_magnitude
+
+
+# 串流 STFT：跨區塊連續切出與 librosa.stft(center=True) 相同的幀
+class StreamingSTFT:
+    def __init__(self):
+        # center=True 時訊號開頭與結尾各補 n_fft // 2 個零
+        self._buffer = np.zeros(n_fft // 2, dtype=np.float32)
+
+    def feed(self, samples):
+        self._buffer = np.concatenate([self._buffer, samples])
+        if len(self._buffer) < n_fft:
+            return np.zeros((1 + n_fft // 2, 0), dtype=np.complex64)
+        count = 1 + (len(self._buffer) - n_fft) // hop_length
+        used = n_fft + (count - 1) * hop_length
+        D = librosa.stft(
+            self._buffer[:used], n_fft=n_fft, hop_length=hop_length, center=False
+        )
+        self._buffer = self._buffer[count * hop_length :]
+        return D
+
+    def finish(self):
+        return self.feed(np.zeros(n_fft // 2, dtype=np.float32))
+
+
+# 三個相鄰幀的中值（等同每個頻率在時間方向做 kernel_size=3 的 medfilt）
+def median3(magnitude):
+    return np.median(
+        np.stack([magnitude[:, :-2], magnitude[:, 1:-1], magnitude[:, 2:]]), axis=0
+    )
+
+
+# 串流的頻譜濾波：中值濾波需要下一幀，因此每一幀延遲到下一幀到達後才輸出
+class StreamingSpectralFilter:
+    def __init__(self, sr):
+        self.weights = frequency_weighting(
+            librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+        )
+        bins = 1 + n_fft // 2
+        # 等待下一幀的幀，以及其前一幀與自身的振幅（第一幀之前補零，與 medfilt 相同）
+        self._held = np.zeros((bins, 0), dtype=np.complex64)
+        self._magnitude = np.zeros((bins, 1), dtype=np.float32)
+
+    def _filter(self, filtered_magnitude, frames):
+        filtered_magnitude = weight_and_wiener(filtered_magnitude, self.weights)
+        return filtered_magnitude * np.exp(1j * np.angle(frames))
+
+    def feed(self, D):
+        frames = np.concatenate([self._held, D], axis=1)
+        magnitude = np.concatenate([self._magnitude, np.abs(D)], axis=1)
+        if frames.shape[1] < 2:
+            self._held, self._magnitude = frames, magnitude
+            return np.zeros((len(self.weights), 0), dtype=np.complex128)
+        self._held, self._magnitude = frames[:, -1:], magnitude[:, -2:]
+        return self._filter(median3(magnitude), frames[:, :-1])
+
+    # 最後一幀之後補零
+    def finish(self):
+        magnitude = np.concatenate(
+            [self._magnitude, np.zeros((len(self.weights), 1))], axis=1
+        )
+        if self._held.shape[1] == 0:
+            return np.zeros((len(self.weights), 0), dtype=np.complex128)
+        return self._filter(median3(magnitude), self._held)
+
+
+# 串流 ISTFT：以重疊相加累積各幀，之後的幀不會再影響的樣本即可輸出（與 librosa.istft 相同的視窗平方和正規化）
+class StreamingISTFT:
+    def __init__(self):
+        self.window = signal.get_window("hann", n_fft, fftbins=True)
+        # 重疊相加的累積值與視窗平方和；_signal[0] 對應補零後訊號的位置 _start
+        self._signal = np.zeros(0)
+        self._norm = np.zeros(0)
+        self._start = 0
+        self._frames = 0
+        # center=True 時開頭要捨棄的樣本數
+        self._trim = n_fft // 2
+
+    def feed(self, D):
+        if D.shape[1] == 0:
+            return np.zeros(0)
+        frames = self.window[:, np.newaxis] * np.fft.irfft(D, n=n_fft, axis=0)
+        end = (self._frames + D.shape[1] - 1) * hop_length + n_fft - self._start
+        grow = end - len(self._signal)
+        self._signal = np.concatenate([self._signal, np.zeros(grow)])
+        self._norm = np.concatenate([self._norm, np.zeros(grow)])
+        for i in range(D.shape[1]):
+            position = (self._frames + i) * hop_length - self._start
+            self._signal[position : position + n_fft] += frames[:, i]
+            self._norm[position : position + n_fft] += self.window**2
+        self._frames += D.shape[1]
+        return self._emit(self._frames * hop_length)
+
+    # 輸出補零後位置 stop 之前的樣本
+    def _emit(self, stop):
+        count = stop - self._start
+        samples, norm = self._signal[:count], self._norm[:count]
+        nonzero = norm > np.finfo(np.float32).tiny
+        samples[nonzero] /= norm[nonzero]
+        self._signal, self._norm = self._signal[count:], self._norm[count:]
+        self._start = stop
+        drop = min(self._trim, len(samples))
+        self._trim -= drop
+        return samples[drop:]
+
+    # librosa.istft 的輸出長度為 hop_length * (幀數 - 1)
+    def finish(self):
+        stop = n_fft // 2 + hop_length * (self._frames - 1)
+        return self._emit(stop) if stop > self._start else np.zeros(0)
+
+
+# 串流的 noisereduce：與 reduce_noise 相同，每塊 NR_CHUNK_SIZE 個樣本並帶前後 NR_PADDING 個樣本的上下文
+# （訊號範圍外補零）；整段不超過一塊時與 reduce_noise 相同，以整段加上前後補零處理
+class StreamingNoiseReduce:
+    def __init__(self, sr):
+        self.sr = sr
+        # _buffer[0] 對應訊號的位置 _offset（開頭為補零）
+        self._buffer = np.zeros(NR_PADDING)
+        self._offset = -NR_PADDING
+        self._chunk = 0
+        self._total = 0
+
+    def _reduce(self, start, end):
+        window = self._buffer[
+            start - NR_PADDING - self._offset : end + NR_PADDING - self._offset
+        ]
+        window = np.pad(window, (0, end - start + 2 * NR_PADDING - len(window)))
+        filtered = nr.reduce_noise(
+            y=window,
+            sr=self.sr,
+            stationary=False,
+            prop_decrease=NR_PROP_DECREASE,
+            chunk_size=len(window),
+            padding=0,
+        )
+        self._buffer = self._buffer[end - NR_PADDING - self._offset :]
+        self._offset = end - NR_PADDING
+        self._chunk += 1
+        return filtered[NR_PADDING : NR_PADDING + min(end, self._total) - start]
+
+    def feed(self, samples):
+        self._buffer = np.concatenate([self._buffer, samples])
+        self._total += len(samples)
+        output = [np.zeros(0)]
+        while self._total >= (self._chunk + 1) * NR_CHUNK_SIZE + NR_PADDING:
+            start = self._chunk * NR_CHUNK_SIZE
+            output.append(self._reduce(start, start + NR_CHUNK_SIZE))
+        return np.concatenate(output)
+
+    def finish(self):
+        if self._total <= NR_CHUNK_SIZE:
+            return self._reduce(0, self._total) if self._total else np.zeros(0)
+        output = [np.zeros(0)]
+        while self._chunk * NR_CHUNK_SIZE < self._total:
+            start = self._chunk * NR_CHUNK_SIZE
+            output.append(self._reduce(start, start + NR_CHUNK_SIZE))
+        return np.concatenate(output)
+
+
+# 串流降噪器：feed 輸入一段單聲道樣本，回傳已完成處理（尚未套用音量補償）的樣本
+class StreamingDenoiser:
+    def __init__(self, sr):
+        self.stft = StreamingSTFT()
+        self.spectral = StreamingSpectralFilter(sr)
+        self.istft = StreamingISTFT()
+        self.noise = StreamingNoiseReduce(sr)
+
+    def feed(self, samples):
+        frames = self.spectral.feed(self.stft.feed(samples))
+        return self.noise.feed(self.istft.feed(frames))
+
+    def finish(self):
+        frames = self.spectral.feed(self.stft.finish())
+        frames = np.concatenate([frames, self.spectral.finish()], axis=1)
+        samples = np.concatenate([self.istft.feed(frames), self.istft.finish()])
+        return np.concatenate([self.noise.feed(samples), self.noise.finish()])
+
+
+# 串流模式：逐塊讀取 input_path（多聲道取平均，與 librosa.load 相同）降噪後寫入 output_path
+# 第一次寫入暫存檔並累積 RMS，第二次逐塊讀回套用音量補償；回傳取樣率
+def denoise_file(input_path, output_path, block_size=BLOCK_SIZE):
+    sr = sf.info(input_path).samplerate
+    denoiser = StreamingDenoiser(sr)
+    energy = {"original": 0.0, "filtered": 0.0}
+    count = {"original": 0, "filtered": 0}
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(suffix=".wav", dir=directory)
+    os.close(fd)
+    try:
+        with sf.SoundFile(
+            temp_path, "w", sr, 1, subtype="DOUBLE", format="RF64"
+        ) as temp:
+
+            def write(samples):
+                energy["filtered"] += float(np.sum(samples**2))
+                count["filtered"] += len(samples)
+                temp.write(samples)
+
+            for block in sf.blocks(
+                input_path, blocksize=block_size, dtype="float32", always_2d=True
+            ):
+                y = block.mean(axis=1, dtype=np.float32)
+                energy["original"] += float(np.sum(y.astype(np.float64) ** 2))
+                count["original"] += len(y)
+                write(denoiser.feed(y))
+            write(denoiser.finish())
+
+        rms_original = np.sqrt(energy["original"] / max(count["original"], 1))
+        rms_filtered = np.sqrt(energy["filtered"] / max(count["filtered"], 1))
+        gain = compensation_gain(rms_original, rms_filtered)
+        with sf.SoundFile(output_path, "w", sr, 1) as output:
+            for block in sf.blocks(temp_path, blocksize=block_size):
+                output.write(block * gain)
+    finally:
+        os.remove(temp_path)
+    return sr
+
+
+# 畫出處理前後的頻譜圖
+def plot_spectrograms(magnitude, filtered_magnitude, sr):
+    plt.figure(figsize=(12, 5))
+
+    plt.subplot(1, 2, 1)
+    librosa.display.specshow(
+        librosa.amplitude_to_db(magnitude, ref=np.max),
+        sr=sr,
+        hop_length=hop_length,
+        y_axis="log",
+        x_axis="time",
+    )
+    plt.title("Original Spectrogram")
+    plt.colorbar(format="%+2.0f dB")
+
+    plt.subplot(1, 2, 2)
+    librosa.display.specshow(
+        librosa.amplitude_to_db(filtered_magnitude, ref=np.max),
+        sr=sr,
+        hop_length=hop_length,
+        y_axis="log",
+        x_axis="time",
+    )
+    plt.title("Filtered Spectrogram")
+    plt.colorbar(format="%+2.0f dB")
+
+    plt.subplots_adjust(wspace=0.3)
+    plt.show()
+
+
+# 解析命令列參數
+def parse_args():
+    parser = argparse.ArgumentParser(description="語音降噪")
+    parser.add_argument("input", nargs="?", default=filename, help="輸入的 WAV 檔")
+    parser.add_argument(
+        "output", nargs="?", default=output_filename, help="輸出的 WAV 檔"
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="整段載入記憶體處理並畫出頻譜圖"
+    )
+    parser.add_argument(
+        "--block-size", type=int, default=BLOCK_SIZE, help="串流模式每次讀取的樣本數"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.batch:
+        y, sr = librosa.load(args.input, sr=None)
+        filtered_y, magnitude, filtered_magnitude = denoise_batch(y, sr)
+        sf.write(args.output, filtered_y, sr)
+        print(f"Filtered speech saved as {args.output}")
+        plot_spectrograms(magnitude, filtered_magnitude, sr)
+    else:
+        denoise_file(args.input, args.output, args.block_size)
+        print(f"Filtered speech saved as {args.output}")
@@ -0,0 +1,100 @@
+# 比較 main.py（同步）與 main_async.py（非同步）兩個版本在並行請求下的每秒請求數
+# 使用 httpx 的 ASGITransport 在同一個行程內直接呼叫 ASGI app，不經過網路
+# 用法：python bench_async.py --requests 2000 --concurrency 1 8 32 --seed 10000
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+
+# 解析命令列參數
+def parse_args():
+    parser = argparse.ArgumentParser(description="同步 / 非同步版本的並行壓力測試")
+    parser.add_argument(
+        "--requests", type=int, default=1000, help="每個情境送出的請求數"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 8, 32], help="並行請求數"
+    )
+    parser.add_argument("--seed", type=int, default=10_000, help="預先寫入的使用者筆數")
+    parser.add_argument(
+        "--variants", nargs="+", default=["main", "main_async"], help="要測試的版本"
+    )
+    return parser.parse_args()
+
+
+# 各端點的請求內容；upload_csv 使用小型 CSV 以測量排入工作的成本
+def endpoint_requests():
+    csv_body = "Name,Age\n" + "".join(f"Bench{i},{20 + i % 50}\n" for i in range(100))
+    return {
+        "POST /user": lambda c, i: c.post("/user", json={"name": f"U{i}", "age": 30}),
+        "GET /users": lambda c, i: c.get("/users", params={"limit": 100}),
+        "GET /average_age": lambda c, i: c.get("/average_age"),
+        "POST /upload_csv": lambda c, i: c.post(
+            "/upload_csv", files={"file": ("bench.csv", csv_body, "text/csv")}
+        ),
+    }
+
+
+# 以固定並行數送出 total 個請求，回傳每秒請求數與錯誤數
+async def run_load(client, send, total, concurrency):
+    counter = iter(range(total))
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            response = await send(client, i)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"requests_per_second": round(total / elapsed, 1), "errors": errors}
+
+
+# 依序對每個版本、每個端點與每個並行數執行壓力測試並輸出 JSON 結果
+async def main(args):
+    import httpx
+    import importlib
+
+    results = {}
+    for variant in args.variants:
+        module = importlib.import_module(variant)
+        transport = httpx.ASGITransport(app=module.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            results[variant] = {}
+            for endpoint, send in endpoint_requests().items():
+                results[variant][endpoint] = {}
+                for concurrency in args.concurrency:
+                    stats = await run_load(client, send, args.requests, concurrency)
+                    results[variant][endpoint][concurrency] = stats
+        # 等待本版本排入的匯入工作完成，避免影響下一個版本的結果
+        module.import_executor.submit(lambda: None).result()
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+# 建立獨立的暫存資料庫並預先寫入使用者資料
+def seed_database(rows):
+    import main as sync_main
+    from sqlalchemy import insert
+
+    batch = [{"name": f"Seed{i}", "age": 18 + i % 60} for i in range(rows)]
+    with sync_main.engine.begin() as conn:
+        if batch:
+            conn.execute(insert(sync_main.UserTable), batch)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # 壓力測試使用暫存資料庫，不影響正式的 users.db
+    workdir = tempfile.mkdtemp(prefix="bench_async_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    seed_database(args.seed)
+    asyncio.run(main(args))
@@ -0,0 +1,204 @@
+# 文章正文擷取的微基準測試：比較原本的 BeautifulSoup html.parser 整頁解析與 html_extract 的各後端
+# 各方式都走訪正文區塊的文件樹轉成區塊文字，再以 crawler.clean_content 截斷（與爬蟲相同）
+# 對每個後端輸出每頁平均 / p50 解析毫秒數、相對原本做法的加速倍數，並檢查擷取結果與原本相同；
+# 串流解析另外輸出平均解析到頁面的多少比例就停止；--workers 指定時比較單一行程與行程池的每秒頁數
+#
+# 用法：
+#   python bench_extract.py save --dir technews_pages --max-articles 50   下載 TechNews 文章頁存檔
+#   python bench_extract.py run technews_pages/*.html --workers 4
+#   python bench_extract.py run                                           沒有存檔時使用合成的文章頁
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+
+import crawler
+import html_extract
+
+# 每個後端對每頁重複解析的次數
+DEFAULT_REPEAT = 20
+
+# 串流解析每次餵入的位元組數（模擬網路分塊）
+STREAM_CHUNK = 16 * 1024
+
+
+# 解析命令列參數
+def parse_args():
+    parser = argparse.ArgumentParser(description="文章正文擷取的微基準測試")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    save = commands.add_parser("save", help="下載 TechNews 文章頁存檔")
+    save.add_argument("--dir", default="technews_pages", help="存檔資料夾")
+    save.add_argument("--max-articles", type=int, default=50, help="下載的文章數")
+
+    run = commands.add_parser("run", help="測量各後端的解析時間")
+    run.add_argument("paths", nargs="*", help="存檔的 HTML 檔案（預設使用合成頁面）")
+    run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每頁重複次數")
+    run.add_argument("--workers", type=int, default=0, help="比較行程池的行程數")
+    run.add_argument("--output", help="結果 JSON 的輸出檔案（預設輸出到螢幕）")
+    return parser.parse_args()
+
+
+# 下載列表頁上的文章頁並存成 HTML 檔案
+def save_pages(directory, max_articles):
+    articles = crawler.crawl_documents(max_articles=max_articles)
+    pages = crawler.fetch_pages([article.url for article in articles])
+    os.makedirs(directory, exist_ok=True)
+    saved = 0
+    for i, html in enumerate(pages):
+        if html:
+            path = os.path.join(directory, f"article_{i:04d}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(html)
+            saved += 1
+    print(f"已存檔 {saved} 頁到 {directory}")
+
+
+# 合成的 TechNews 風格文章頁：導覽列、大段內嵌腳本、正文、側欄、留言與頁尾，約 100 KB
+def synthetic_page():
+    nav = "".join(f'<li><a href="/category/{i}/">分類 {i}</a></li>' for i in range(80))
+    script = "<script>" + "window.dataLayer.push({'k': 'v'});" * 800 + "</script>"
+    paragraphs = "".join(
+        f"<p>第 {i} 段：半導體產業的最新消息，<a href='/tag/{i}/'>標籤 {i}</a>"
+        f"與<strong>重點</strong>說明。</p>"
+        for i in range(40)
+    )
+    sidebar = "".join(
+        f'<div class="widget"><h3>熱門 {i}</h3><p>側欄內容 {i}</p></div>'
+        for i in range(150)
+    )
+    comments = "".join(
+        f'<div class="comment"><p>留言 {i}：這篇文章很有幫助。</p></div>'
+        for i in range(400)
+    )
+    return (
+        f"<html><head><title>文章</title>{script}</head><body><nav><ul>{nav}</ul></nav>"
+        f'<article><h1 class="entry-title">標題</h1>'
+        f'<div class="entry-content">{paragraphs}</div></article>'
+        f'<aside>{sidebar}</aside><section id="comments">{comments}</section>'
+        f"<footer>{script}</footer></body></html>"
+    )
+
+
+# 原本的做法：以 html.parser 建立整份文件樹後選取正文
+def baseline(html):
+    content = BeautifulSoup(html, "html.parser").select_one(
+        crawler.ARTICLE_CONTENT_SELECTOR
+    )
+    return crawler.clean_content(html_extract.bs4_blocks(content) if content else None)
+
+
+# 串流解析：依網路分塊餵入，正文區塊結束即停止，回傳 (正文, 解析的位元組比例)
+def stream_extract(data):
+    stream = html_extract.ContentStream(crawler.ARTICLE_CONTENT_SELECTOR)
+    fed = 0
+    for start in range(0, len(data), STREAM_CHUNK):
+        fed = min(start + STREAM_CHUNK, len(data))
+        if stream.feed(data[start : start + STREAM_CHUNK]):
+            break
+    stream.close()
+    return crawler.clean_content(stream.blocks), fed / len(data)
+
+
+# 可用的擷取方式：名稱 -> 以 HTML 字串與位元組為輸入、回傳正文的函式
+def extractors():
+    selector = crawler.ARTICLE_CONTENT_SELECTOR
+    methods = {
+        "bs4 html.parser（原本）": lambda html, data: baseline(html),
+        "bs4 SoupStrainer": lambda html, data: crawler.clean_content(
+            html_extract.extract_blocks(html, selector, "bs4")
+        ),
+    }
+    if html_extract.etree is not None:
+        methods["lxml"] = lambda html, data: crawler.clean_content(
+            html_extract.extract_blocks(html, selector, "lxml")
+        )
+        methods["lxml 串流"] = lambda html, data: stream_extract(data)[0]
+    if html_extract.LexborHTMLParser is not None:
+        methods["selectolax"] = lambda html, data: crawler.clean_content(
+            html_extract.extract_blocks(html, selector, "selectolax")
+        )
+    return methods
+
+
+# 以單一行程與行程池解析所有頁面，回傳各自的每秒頁數
+def measure_pool(pages, repeat, workers):
+    work = [html for html, _ in pages] * repeat
+    start = time.perf_counter()
+    for html in work:
+        crawler.parse_article_content(html)
+    serial = time.perf_counter() - start
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(crawler.parse_article_content, work[:workers]))  # 先啟動行程
+        start = time.perf_counter()
+        list(executor.map(crawler.parse_article_content, work, chunksize=16))
+        pooled = time.perf_counter() - start
+    return {
+        "backend": html_extract.EXTRACT_BACKEND,
+        "workers": workers,
+        "serial_pages_per_second": round(len(work) / serial, 1),
+        "pool_pages_per_second": round(len(work) / pooled, 1),
+    }
+
+
+# 測量各擷取方式的每頁解析時間並與原本的做法比較
+def run(args):
+    if args.paths:
+        pages = []
+        for path in args.paths:
+            with open(path, encoding="utf-8") as f:
+                html = f.read()
+            pages.append((html, html.encode("utf-8")))
+    else:
+        html = synthetic_page()
+        pages = [(html, html.encode("utf-8"))]
+    expected = [baseline(html) for html, _ in pages]
+
+    results = {}
+    for name, extract in extractors().items():
+        timings, mismatches = [], 0
+        for (html, data), want in zip(pages, expected):
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = extract(html, data)
+                timings.append(time.perf_counter() - start)
+            mismatches += text != want
+        results[name] = {
+            "mean_ms": round(statistics.mean(timings) * 1000, 3),
+            "p50_ms": round(statistics.median(timings) * 1000, 3),
+            "mismatches": mismatches,
+        }
+    base = results["bs4 html.parser（原本）"]["mean_ms"]
+    for result in results.values():
+        result["speedup"] = round(base / result["mean_ms"], 1)
+    if html_extract.etree is not None:
+        fractions = [stream_extract(data)[1] for _, data in pages]
+        results["lxml 串流"]["parsed_fraction"] = round(statistics.mean(fractions), 3)
+
+    report = {
+        "pages": len(pages),
+        "mean_page_kb": round(
+            statistics.mean(len(data) for _, data in pages) / 1024, 1
+        ),
+        "results": results,
+    }
+    if args.workers:
+        report["process_pool"] = measure_pool(pages, args.repeat, args.workers)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "save":
+        save_pages(args.dir, args.max_articles)
+    else:
+        run(args)
@@ -0,0 +1,392 @@
+# main.py 使用者服務的延遲與負載測試
+# 對不同資料量（預設 1 萬 / 100 萬 / 1000 萬筆）的 SQLite 資料庫，以固定並行數對各端點送出請求，
+# 並以 JSON 輸出 p50 / p95 / p99 延遲、每秒請求數與峰值記憶體（RSS）
+#
+# 用法：
+#   python bench_main.py run --sizes 10000 1000000 --concurrency 1 16 --output bench.json
+#   python bench_main.py run --transport uvicorn --app main_async
+#   python bench_main.py run --baseline bench_baseline.json   與基準比較，退步時以結束碼 1 離開
+#   python bench_main.py compare bench.json bench_baseline.json
+#
+# 每個資料量在獨立的子行程中執行，確保 DATABASE_URL 與峰值記憶體互不影響；
+# 種子資料庫（seed_{size}.db）存放在 --workdir 並重複使用，不必每次重新寫入；
+# 測試會寫入資料（POST /user、POST /upload_csv），因此每次執行都複製一份種子資料庫（bench_{size}.db）來測量，
+# 種子資料庫本身維持剛好 size 筆，不同次執行與 --baseline 比較的資料量相同
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+
+# 預設的資料量與並行數
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+DEFAULT_CONCURRENCY = [1, 16, 64]
+
+# 種子資料每批寫入的列數
+SEED_BATCH = 100_000
+
+# 判定退步的門檻：p95 延遲增加或每秒請求數下降超過此比例
+DEFAULT_THRESHOLD = 0.10
+
+
+# 各端點的請求產生器；size 用於產生隨機的分頁游標，讓 GET /users 不會總是命中快取
+def endpoint_requests(size):
+    csv_body = "Name,Age\n" + "".join(f"Bench{i},{20 + i % 50}\n" for i in range(1000))
+    return {
+        "POST /user": lambda c, i: c.post(
+            "/user", json={"name": f"Bench{i}", "age": 30}
+        ),
+        "GET /users": lambda c, i: c.get(
+            "/users", params={"limit": 100, "after_id": random.randrange(max(size, 1))}
+        ),
+        "GET /average_age": lambda c, i: c.get("/average_age"),
+        "POST /upload_csv": lambda c, i: c.post(
+            "/upload_csv", files={"file": ("bench.csv", csv_body, "text/csv")}
+        ),
+    }
+
+
+# 以 statistics.quantiles 計算延遲百分位數（毫秒）
+def latency_summary(latencies):
+    if len(latencies) < 2:
+        value = round(latencies[0] * 1000, 3) if latencies else None
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    q = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": round(q[49] * 1000, 3),
+        "p95_ms": round(q[94] * 1000, 3),
+        "p99_ms": round(q[98] * 1000, 3),
+    }
+
+
+# 目前行程（in-process）或已結束子行程（uvicorn）的峰值 RSS，單位 MB
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    maxrss = resource.getrusage(who).ru_maxrss
+    # Linux 以 KiB 回報，macOS 以 byte 回報
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# 以固定並行數送出 total 個請求，記錄每個請求的延遲
+async def run_load(client, send, total, concurrency):
+    counter = iter(range(total))
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await send(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": total,
+        "errors": errors,
+        "requests_per_second": round(total / elapsed, 1),
+        **latency_summary(latencies),
+    }
+
+
+# 確保種子資料庫有 size 筆使用者；不足的部分以 executemany 分批補齊
+def seed_database(engine, size):
+    with engine.begin() as conn:
+        current = conn.exec_driver_sql("SELECT COUNT(*) FROM users").scalar()
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for start in range(current, size, SEED_BATCH):
+            stop = min(start + SEED_BATCH, size)
+            cursor.executemany(
+                "INSERT INTO users (name, age) VALUES (?, ?)",
+                ((f"Seed{i}", 18 + i % 60) for i in range(start, stop)),
+            )
+            raw.commit()
+    finally:
+        raw.close()
+
+
+# 找一個可用的本機連接埠給 uvicorn 使用
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# 啟動本機 uvicorn 並等待可以連線，回傳 (子行程, base_url)
+def start_uvicorn(app_module):
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            f"{app_module}:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=os.environ.copy(),
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("uvicorn 啟動逾時")
+
+
+# 子行程：建立（或補齊）DATABASE_URL 指向的種子資料庫，並以 JSON 印出寫入秒數
+def run_seed(args):
+    import main
+
+    seed_start = time.perf_counter()
+    seed_database(main.engine, args.size)
+    main.engine.dispose()
+    print(json.dumps({"seed_seconds": round(time.perf_counter() - seed_start, 2)}))
+
+
+# 以 SQLite 的線上備份複製種子資料庫（包含尚未寫回主檔的 WAL 內容），覆蓋上次執行留下的測試資料庫
+def copy_database(source_path, target_path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(target_path + suffix):
+            os.remove(target_path + suffix)
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+# 子行程：對單一資料量執行所有端點與並行數的測試，並將結果以 JSON 印出
+async def run_size(args):
+    import httpx
+    import importlib
+
+    import main
+
+    server = None
+    if args.transport == "uvicorn":
+        server, base_url = start_uvicorn(args.app)
+        client = httpx.AsyncClient(base_url=base_url, timeout=60)
+    else:
+        module = importlib.import_module(args.app)
+        transport = httpx.ASGITransport(app=module.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+    results = {}
+    try:
+        async with client:
+            for endpoint, send in endpoint_requests(args.size).items():
+                results[endpoint] = {}
+                for concurrency in args.concurrency:
+                    stats = await run_load(client, send, args.requests, concurrency)
+                    if server is None:
+                        stats["peak_rss_mb"] = peak_rss_mb()
+                    results[endpoint][str(concurrency)] = stats
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if server is None:
+        # 等待測試期間排入的匯入工作完成，避免殘留的背景執行緒
+        main.import_executor.shutdown(wait=True)
+        rss = peak_rss_mb()
+    else:
+        rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+    print(
+        json.dumps(
+            {
+                "peak_rss_mb": rss,
+                "endpoints": results,
+            }
+        )
+    )
+
+
+# 主行程：為每個資料量啟動子行程並彙整結果
+def run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    report = {
+        "app": args.app,
+        "transport": args.transport,
+        "requests": args.requests,
+        "cache": not args.no_cache,
+        "sizes": {},
+    }
+    for size in args.sizes:
+        print(f"資料量 {size:,} 筆準備種子資料庫...", file=sys.stderr)
+        seed_path = os.path.abspath(os.path.join(args.workdir, f"seed_{size}.db"))
+        seed = run_child(
+            [sys.executable, os.path.abspath(__file__), "_seed", "--size", str(size)],
+            {**os.environ, "DATABASE_URL": f"sqlite:///{seed_path}"},
+        )
+        db_path = os.path.abspath(os.path.join(args.workdir, f"bench_{size}.db"))
+        copy_database(seed_path, db_path)
+
+        env = os.environ.copy()
+        env["DATABASE_URL"] = f"sqlite:///{db_path}"
+        if args.no_cache:
+            env["RESPONSE_CACHE_TTL"] = "0"
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "_size",
+            "--size",
+            str(size),
+            "--app",
+            args.app,
+            "--transport",
+            args.transport,
+            "--requests",
+            str(args.requests),
+            "--concurrency",
+            *map(str, args.concurrency),
+        ]
+        print(f"資料量 {size:,} 筆測試中...", file=sys.stderr)
+        report["sizes"][str(size)] = {**seed, **run_child(command, env)}
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        return report_regressions(compare_reports(report, baseline, args.threshold))
+    return 0
+
+
+# 執行子行程並解析其最後一行輸出的 JSON
+def run_child(command, env):
+    output = subprocess.run(
+        command, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# 比較兩份報表，回傳退步的情境（p95 延遲變慢或每秒請求數下降超過 threshold）
+def compare_reports(current, baseline, threshold=DEFAULT_THRESHOLD):
+    regressions = []
+    for size, size_report in current["sizes"].items():
+        base_size = baseline.get("sizes", {}).get(size)
+        if base_size is None:
+            continue
+        for endpoint, by_concurrency in size_report["endpoints"].items():
+            for concurrency, stats in by_concurrency.items():
+                base = base_size["endpoints"].get(endpoint, {}).get(concurrency)
+                if base is None:
+                    continue
+                scenario = {
+                    "size": size,
+                    "endpoint": endpoint,
+                    "concurrency": concurrency,
+                }
+                if stats["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                    regressions.append(
+                        {
+                            **scenario,
+                            "metric": "p95_ms",
+                            "baseline": base["p95_ms"],
+                            "current": stats["p95_ms"],
+                        }
+                    )
+                if stats["requests_per_second"] < base["requests_per_second"] * (
+                    1 - threshold
+                ):
+                    regressions.append(
+                        {
+                            **scenario,
+                            "metric": "requests_per_second",
+                            "baseline": base["requests_per_second"],
+                            "current": stats["requests_per_second"],
+                        }
+                    )
+    return regressions
+
+
+# 輸出退步清單，有退步時回傳結束碼 1
+def report_regressions(regressions):
+    print(json.dumps({"regressions": regressions}, indent=2, ensure_ascii=False))
+    return 1 if regressions else 0
+
+
+def compare(args):
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    return report_regressions(compare_reports(current, baseline, args.threshold))
+
+
+# 解析命令列參數
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="使用者服務的延遲與負載測試")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="執行負載測試")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    run_parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY
+    )
+    run_parser.add_argument(
+        "--requests", type=int, default=500, help="每個情境的請求數"
+    )
+    run_parser.add_argument("--app", default="main", choices=["main", "main_async"])
+    run_parser.add_argument("--transport", default="asgi", choices=["asgi", "uvicorn"])
+    run_parser.add_argument("--workdir", default="./bench_data", help="種子資料庫目錄")
+    run_parser.add_argument(
+        "--no-cache", action="store_true", help="停用回應快取，測量實際的資料庫查詢"
+    )
+    run_parser.add_argument("--output", help="結果 JSON 的輸出路徑")
+    run_parser.add_argument("--baseline", help="要比較的基準結果 JSON")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="比較兩份結果")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.set_defaults(func=compare)
+
+    # 內部使用：在子行程中建立種子資料庫
+    seed_parser = subparsers.add_parser("_seed")
+    seed_parser.add_argument("--size", type=int, required=True)
+    seed_parser.set_defaults(func=run_seed)
+
+    # 內部使用：在子行程中執行單一資料量
+    size_parser = subparsers.add_parser("_size")
+    size_parser.add_argument("--size", type=int, required=True)
+    size_parser.add_argument("--app", default="main")
+    size_parser.add_argument("--transport", default="asgi")
+    size_parser.add_argument("--requests", type=int, default=500)
+    size_parser.add_argument("--concurrency", type=int, nargs="+", required=True)
+    size_parser.set_defaults(func=lambda args: asyncio.run(run_size(args)))
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(args.func(args) or 0)
@@ -0,0 +1,172 @@
+# rag_bot 向量索引類型的召回率與延遲比較
+# 以合成的分群向量（模擬文字嵌入）建立 flat / ivf / hnsw / ivfpq 索引，以 flat 的精確搜尋結果為基準，
+# 對每組搜尋參數（IVF 的 nprobe、HNSW 的 efSearch）輸出 recall@k、單筆查詢 p50 / p95 延遲、
+# 批次查詢的每秒查詢數、建立時間與索引大小（JSON）
+#
+# 用法：
+#   python bench_rag_index.py --vectors 1000000 --dim 384 --output bench_index.json
+#   python bench_rag_index.py --types ivf hnsw --nprobe 8 32 128 --ef-search 32 128
+#
+# 100 萬筆 384 維的向量約佔 1.5 GB 記憶體；OpenAI 的 1536 維向量請視記憶體調整 --vectors
+import argparse
+import json
+import statistics
+import time
+
+import faiss
+import numpy as np
+
+import rag_index
+
+# 產生合成向量時的分群數與每批產生的向量數
+DATA_CLUSTERS = 1000
+DATA_BATCH = 100_000
+
+
+# 解析命令列參數
+def parse_args():
+    parser = argparse.ArgumentParser(description="向量索引類型的召回率 / 延遲比較")
+    parser.add_argument("--vectors", type=int, default=1_000_000, help="索引的向量數")
+    parser.add_argument("--dim", type=int, default=384, help="向量維度")
+    parser.add_argument("--queries", type=int, default=1000, help="查詢數")
+    parser.add_argument("--k", type=int, default=10, help="每個查詢取回的片段數")
+    parser.add_argument(
+        "--types",
+        nargs="+",
+        default=["ivf", "hnsw", "ivfpq"],
+        choices=rag_index.INDEX_TYPES,
+        help="要比較的索引類型（flat 一律作為基準）",
+    )
+    parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="IVF 的 nprobe"
+    )
+    parser.add_argument(
+        "--ef-search",
+        type=int,
+        nargs="+",
+        default=[16, 32, 64, 128],
+        help="HNSW 的 efSearch",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="亂數種子")
+    parser.add_argument("--output", help="結果 JSON 的輸出檔案（預設輸出到螢幕）")
+    return parser.parse_args()
+
+
+# 產生分群的單位向量：先抽出群中心，每個向量為群中心加上雜訊，與文字嵌入一樣有明顯的主題聚集
+def synthetic_vectors(count, dim, rng):
+    centers = rng.standard_normal((DATA_CLUSTERS, dim), dtype="float32")
+    vectors = np.empty((count, dim), dtype="float32")
+    for start in range(0, count, DATA_BATCH):
+        size = min(DATA_BATCH, count - start)
+        labels = rng.integers(0, DATA_CLUSTERS, size)
+        batch = centers[labels] + 0.5 * rng.standard_normal(
+            (size, dim), dtype="float32"
+        )
+        vectors[start : start + size] = batch
+    return normalize(vectors)
+
+
+# L2 正規化（與 OpenAI 嵌入一樣為單位向量）
+def normalize(vectors):
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+# recall@k：近似搜尋取回的結果中，屬於精確前 k 名的比例
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)]))
+
+
+# 測量單筆查詢的延遲（毫秒）與批次查詢的每秒查詢數，回傳結果與批次查詢的搜尋結果
+def measure_search(index, queries, k):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+    q = statistics.quantiles(latencies, n=100, method="inclusive")
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": round(q[49] * 1000, 3),
+        "p95_ms": round(q[94] * 1000, 3),
+        "queries_per_second": round(len(queries) / elapsed, 1),
+    }, found
+
+
+# 建立並填入索引，回傳索引與建立時間（訓練 + 加入向量）
+def build_index(vectors, settings):
+    start = time.perf_counter()
+    index = rag_index.create_index(vectors, settings)
+    trained = time.perf_counter()
+    index.add(vectors)
+    added = time.perf_counter()
+    return index, {
+        "train_seconds": round(trained - start, 2),
+        "add_seconds": round(added - trained, 2),
+        "index_mb": round(faiss.serialize_index(index).nbytes / 2**20, 1),
+    }
+
+
+# 各索引類型要掃過的搜尋參數
+def search_params(index_type, args):
+    if index_type in ("ivf", "ivfpq"):
+        return [{"nprobe": nprobe} for nprobe in args.nprobe]
+    if index_type == "hnsw":
+        return [{"ef_search": ef} for ef in args.ef_search]
+    return [{}]
+
+
+# 以 flat 為基準，依序建立各索引類型並掃過搜尋參數
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_vectors(args.vectors, args.dim, rng)
+    # 查詢為資料中的向量加上少量雜訊，模擬與片段相近但不相同的問題
+    picks = rng.choice(args.vectors, args.queries, replace=False)
+    noise = 0.05 * rng.standard_normal((args.queries, args.dim), dtype="float32")
+    queries = normalize(vectors[picks] + noise)
+
+    flat, build = build_index(vectors, rag_index.index_settings("flat"))
+    latency, truth = measure_search(flat, queries, args.k)
+    results = [{"type": "flat", **build, "recall": 1.0, **latency}]
+    del flat
+
+    for index_type in args.types:
+        if index_type == "flat":
+            continue
+        settings = rag_index.index_settings(index_type)
+        index, build = build_index(vectors, settings)
+        for params in search_params(index_type, args):
+            rag_index.tune_index(index, **params)
+            latency, found = measure_search(index, queries, args.k)
+            results.append(
+                {
+                    "type": rag_index.index_kind(index),
+                    "settings": settings,
+                    **params,
+                    **build,
+                    "recall": round(recall_at_k(found, truth), 4),
+                    **latency,
+                }
+            )
+        del index
+
+    report = {
+        "vectors": args.vectors,
+        "dim": args.dim,
+        "queries": args.queries,
+        "k": args.k,
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main(parse_args())
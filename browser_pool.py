@@ -0,0 +1,205 @@
+# Selenium 無頭瀏覽器池（selenium_rag_bot.py 使用）
+# - 最多 size 個長期存活的 headless Chrome，第一次需要時才啟動；以 with pool.driver() as driver 借出、用完歸還，
+#   不必每次爬取都重新啟動瀏覽器
+# - 以 WebDriverWait 等待指定的元素出現，取代固定秒數的 time.sleep
+# - 封鎖圖片、CSS 與字型，只下載 HTML 與 JS
+# - 瀏覽器當掉（WebDriverException）時關閉並丟棄，下次借出時重新啟動；render_many 中該頁記錄錯誤並回傳 None
+#
+# 用法：
+#   with BrowserPool(size=2) as pool:
+#       html = pool.render("https://technews.tw/", "h1.entry-title a")
+#       pages = pool.render_many(urls, "div.entry-content")
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+logger = logging.getLogger(__name__)
+
+# chromedriver 的路徑；未設定時由 Selenium Manager 自動尋找
+CHROMEDRIVER_PATH = os.environ.get("CHROMEDRIVER_PATH")
+
+# 瀏覽器池的大小、等待元素出現與整頁載入的逾時秒數
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 2))
+RENDER_TIMEOUT = 10.0
+PAGE_LOAD_TIMEOUT = 30.0
+
+# 封鎖的資源網址樣式（CSS、圖片與字型）
+BLOCKED_URLS = [
+    "*.css",
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.webp",
+    "*.svg",
+    "*.ico",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+]
+
+
+# Chrome 的啟動參數：無頭模式，DOM 載入完成即返回（其餘由 WebDriverWait 等待），並停用圖片
+def chrome_options(block_resources=True):
+    options = Options()
+    options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-dev-shm-usage")
+    options.page_load_strategy = "eager"
+    if block_resources:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2}
+        )
+    return options
+
+
+# 啟動一個 headless Chrome；CSS 與字型沒有對應的偏好設定，改以 DevTools 協定封鎖
+def start_chrome(driver_path=CHROMEDRIVER_PATH, block_resources=True):
+    service = Service(driver_path) if driver_path else Service()
+    driver = webdriver.Chrome(service=service, options=chrome_options(block_resources))
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    if block_resources:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+# 可在多個執行緒間共用的瀏覽器池；driver_factory 可替換成測試用的替身
+class BrowserPool:
+    def __init__(
+        self,
+        size=BROWSER_POOL_SIZE,
+        driver_factory=start_chrome,
+        timeout=RENDER_TIMEOUT,
+    ):
+        self.size = size
+        self.timeout = timeout
+        self._factory = driver_factory
+        self._idle = []
+        self._started = 0
+        self._closed = False
+        self._available = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # 取得閒置的瀏覽器；沒有閒置且未達上限時啟動新的，否則等待其他執行緒歸還
+    def _acquire(self):
+        with self._available:
+            while True:
+                if self._closed:
+                    raise RuntimeError("瀏覽器池已關閉")
+                if self._idle:
+                    return self._idle.pop()
+                if self._started < self.size:
+                    self._started += 1
+                    break
+                self._available.wait()
+        try:
+            return self._factory()
+        except BaseException:
+            with self._available:
+                self._started -= 1
+                self._available.notify()
+            raise
+
+    # 歸還瀏覽器；池已關閉時直接關閉瀏覽器
+    def _release(self, driver):
+        with self._available:
+            if not self._closed:
+                self._idle.append(driver)
+                self._available.notify()
+                return
+            self._started -= 1
+        quit_driver(driver)
+
+    # 丟棄當掉的瀏覽器，讓等待中的執行緒可以啟動新的
+    def _discard(self, driver):
+        with self._available:
+            self._started -= 1
+            self._available.notify()
+        quit_driver(driver)
+
+    # 借出一個瀏覽器；等待逾時不代表瀏覽器有問題，其他 WebDriverException 則丟棄該瀏覽器
+    @contextmanager
+    def driver(self):
+        driver = self._acquire()
+        try:
+            yield driver
+        except TimeoutException:
+            self._release(driver)
+            raise
+        except WebDriverException:
+            self._discard(driver)
+            raise
+        except BaseException:
+            self._release(driver)
+            raise
+        else:
+            self._release(driver)
+
+    # 載入網頁並等待 wait_selector 出現，回傳渲染後的 HTML；整頁載入逾時回傳 None
+    # 等不到元素時（例如該頁沒有文章）仍回傳目前的 HTML，由呼叫端判斷
+    def render(self, url, wait_selector=None, timeout=None):
+        with self.driver() as driver:
+            try:
+                driver.get(url)
+            except TimeoutException:
+                return None
+            if wait_selector:
+                try:
+                    WebDriverWait(driver, timeout or self.timeout).until(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, wait_selector))
+                    )
+                except TimeoutException:
+                    pass
+            return driver.page_source
+
+    # 以池中所有瀏覽器並行渲染多個網頁，依輸入順序回傳 HTML
+    # 單一網頁讓瀏覽器當掉時只記錄錯誤並回傳 None（該瀏覽器已被丟棄），不中斷其他網頁
+    def render_many(self, urls, wait_selector=None, timeout=None):
+        if not urls:
+            return []
+
+        def render_one(url):
+            try:
+                return self.render(url, wait_selector, timeout)
+            except WebDriverException as e:
+                logger.warning("渲染 %s 失敗：%s", url, e.msg or type(e).__name__)
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(self.size, len(urls))) as executor:
+            return list(executor.map(render_one, urls))
+
+    # 關閉所有閒置的瀏覽器；借出中的瀏覽器會在歸還時關閉
+    def close(self):
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+            self._available.notify_all()
+        for driver in idle:
+            quit_driver(driver)
+
+
+# 關閉瀏覽器，忽略已經當掉的瀏覽器關閉時的錯誤
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass
@@ -0,0 +1,216 @@
+# 爬蟲的持久化狀態（rag_bot.py 與 selenium_rag_bot.py 共用），存放在 SQLite
+# - 每個文章網址的標題、ETag / Last-Modified、正文、內容雜湊、SimHash 與抓取時間
+# - 重新爬取時送出 If-None-Match / If-Modified-Since，未變更的文章只需一個 304 回應，正文直接取自狀態庫
+# - 抓取失敗的文章留在待抓清單（frontier），下次爬取時即使已不在列表頁上也會重試
+# - drop_duplicates 以 SimHash 的漢明距離去除內容幾乎相同的文章（轉載、不同網址的同一篇文章），
+#   只保留最早出現的網址，重複的內容不會進入向量庫
+#
+# 用法：
+#   with CrawlState() as state:
+#       articles = crawler.crawl_documents(state=state)
+#       articles = state.drop_duplicates(articles)
+import hashlib
+import os
+import sqlite3
+import time
+import unicodedata
+from collections import namedtuple
+
+import numpy as np
+
+# 狀態庫的 SQLite 檔案
+CRAWL_STATE_PATH = os.environ.get("CRAWL_STATE_PATH", "./crawl_state.db")
+
+# 上次檢查後多少秒內不再重新請求（0 代表每次都送出條件式請求）
+REFRESH_AFTER = int(os.environ.get("CRAWL_REFRESH_AFTER", 0))
+
+# SimHash 的字元 n-gram 長度，以及視為近似重複的最大漢明距離（64 位元中不同的位元數）
+SHINGLE_SIZE = 4
+NEAR_DUPLICATE_BITS = 3
+
+# 每次爬取最多重試的待抓文章數
+MAX_PENDING = 100
+
+# 狀態庫中的一筆文章紀錄
+PageState = namedtuple(
+    "PageState",
+    [
+        "url",
+        "title",
+        "etag",
+        "last_modified",
+        "content",
+        "content_hash",
+        "simhash",
+        "checked_at",
+    ],
+)
+
+
+# 文章正文的雜湊值
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# 64 位元 SimHash：以正規化後（NFKC、小寫、移除空白）的字元 n-gram 為特徵，內容相近的文章只有少數位元不同
+def simhash(text):
+    text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+    if len(text) < SHINGLE_SIZE:
+        shingles = [text]
+    else:
+        shingles = [
+            text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)
+        ]
+    hashes = np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little"
+            )
+            for s in shingles
+        ],
+        dtype="uint64",
+    )
+    bits = (hashes[:, None] >> np.arange(64, dtype="uint64")) & np.uint64(1)
+    votes = bits.astype("int64").sum(axis=0) * 2 - len(hashes)
+    value = sum(1 << int(bit) for bit in np.flatnonzero(votes > 0))
+    # SQLite 的整數為有號 64 位元
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+# 以 SQLite 保存的爬蟲狀態；單一執行緒（爬蟲的事件迴圈）使用
+class CrawlState:
+    def __init__(self, path=CRAWL_STATE_PATH, refresh_after=REFRESH_AFTER):
+        self.refresh_after = refresh_after
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, title TEXT, etag TEXT, last_modified TEXT, "
+            "content TEXT, content_hash TEXT, simhash INTEGER, "
+            "first_seen REAL NOT NULL, fetched_at REAL, checked_at REAL)"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # 取得文章的狀態，沒有紀錄時回傳 None
+    def get(self, url):
+        row = self._conn.execute(
+            "SELECT url, title, etag, last_modified, content, content_hash, simhash, "
+            "checked_at FROM pages WHERE url = ?",
+            (url,),
+        ).fetchone()
+        return PageState(*row) if row else None
+
+    # 記錄列表頁上發現的文章 [(標題, 網址), ...]；已知的網址只更新標題
+    def discover(self, links):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO pages (url, title, first_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET title = excluded.title",
+                [(url, title, now) for title, url in links],
+            )
+
+    # 已發現但從未成功抓取的文章 [(標題, 網址), ...]，依發現順序
+    def pending(self, limit=MAX_PENDING):
+        rows = self._conn.execute(
+            "SELECT title, url FROM pages WHERE content IS NULL "
+            "ORDER BY first_seen, rowid LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [(title or "", url) for title, url in rows]
+
+    # 文章是否在 refresh_after 秒內檢查過，可以直接沿用狀態庫中的正文
+    def is_fresh(self, page):
+        return (
+            page is not None
+            and page.content is not None
+            and page.checked_at is not None
+            and time.time() - page.checked_at < self.refresh_after
+        )
+
+    # 條件式請求的標頭
+    def conditional_headers(self, page):
+        headers = {}
+        if page is not None and page.content is not None:
+            if page.etag:
+                headers["If-None-Match"] = page.etag
+            if page.last_modified:
+                headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    # 記錄成功抓取（200）的文章；正文沒有變更時不重新計算 SimHash
+    def record(self, url, content, etag=None, last_modified=None):
+        now = time.time()
+        digest = content_hash(content)
+        page = self.get(url)
+        fingerprint = (
+            page.simhash
+            if page is not None and page.content_hash == digest
+            else simhash(content)
+        )
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO pages (url, etag, last_modified, content, content_hash, "
+                "simhash, first_seen, fetched_at, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, "
+                "last_modified = excluded.last_modified, content = excluded.content, "
+                "content_hash = excluded.content_hash, simhash = excluded.simhash, "
+                "fetched_at = excluded.fetched_at, checked_at = excluded.checked_at",
+                (url, etag, last_modified, content, digest, fingerprint, now, now, now),
+            )
+
+    # 更新正文但保留 ETag / Last-Modified（例如以瀏覽器渲染補上靜態抓取解析不到的正文）
+    def set_content(self, url, content):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE pages SET content = ?, content_hash = ?, simhash = ? "
+                "WHERE url = ?",
+                (content, content_hash(content), simhash(content), url),
+            )
+
+    # 記錄未變更（304）的文章
+    def touch(self, url):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE pages SET checked_at = ? WHERE url = ?", (time.time(), url)
+            )
+
+    # 去除內容與先前出現的文章近似重複的 crawler.Article，保留最早發現的網址；沒有正文的文章原樣保留
+    def drop_duplicates(self, articles, max_bits=NEAR_DUPLICATE_BITS):
+        rows = {
+            url: (first_seen, digest, fingerprint)
+            for url, first_seen, digest, fingerprint in self._conn.execute(
+                "SELECT url, first_seen, content_hash, simhash FROM pages"
+            )
+        }
+        order = sorted(
+            range(len(articles)),
+            key=lambda i: (rows.get(articles[i].url, (float("inf"),))[0], i),
+        )
+        kept = np.zeros(len(articles), dtype="uint64")
+        keep = [False] * len(articles)
+        count = 0
+        for i in order:
+            article = articles[i]
+            if not article.content:
+                keep[i] = True
+                continue
+            _, digest, fingerprint = rows.get(article.url, (None, None, None))
+            if digest != content_hash(article.content) or fingerprint is None:
+                fingerprint = simhash(article.content)
+            value = np.int64(fingerprint).view("uint64")
+            if count and np.bitwise_count(kept[:count] ^ value).min() <= max_bits:
+                continue
+            kept[count] = value
+            count += 1
+            keep[i] = True
+        return [article for article, flag in zip(articles, keep) if flag]
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,341 @@
+# TechNews 文章的非同步爬蟲引擎（rag_bot.py 與 selenium_rag_bot.py 共用）
+# - 所有請求共用同一個 httpx.AsyncClient 連線池（keep-alive，不必每篇文章重新建立連線）
+# - 每個主機各自的並行上限，避免對同一個網站送出過多請求
+# - 逾時、連線錯誤與 429 / 5xx 會以指數退避重試，並遵守 Retry-After；
+#   重新導向迴圈、解碼錯誤或錯誤的 charset 等無法重試的錯誤只記錄並略過該網頁，不中斷整個爬取
+# - 依「下一頁」連結翻頁，文章內容在找到連結後立即並行抓取，不必等所有列表頁讀完
+# - 傳入 crawl_state.CrawlState 時以條件式請求重新爬取，未變更的文章只需一個 304 回應
+# - 正文以 html_extract 擷取：邊下載邊解析，正文區塊結束即停止；大量爬取時可改用行程池解析（parse_workers）
+#
+# 用法：
+#   from crawler import crawl_articles
+#   articles = crawl_articles(max_pages=10, max_articles=300)
+import asyncio
+import logging
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+import html_extract
+
+logger = logging.getLogger(__name__)
+
+# 爬取的起始頁面與請求標頭
+CRAWL_START_URL = "https://technews.tw/"
+USER_AGENT = "Mozilla/5.0"
+
+# 預設最多讀取的列表頁數與文章數
+CRAWL_MAX_PAGES = 5
+CRAWL_MAX_ARTICLES = 200
+
+# 每個主機同時進行的請求數上限，以及整個連線池的連線數上限
+PER_HOST_CONCURRENCY = 8
+MAX_CONNECTIONS = 64
+
+# 單一請求的逾時秒數、最多重試次數與退避的基準秒數（第 n 次重試等待 base * 2^n 秒加上隨機抖動）
+REQUEST_TIMEOUT = 10.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+
+# 單次重試等待的上限秒數（包含伺服器要求的 Retry-After）
+MAX_RETRY_DELAY = 30.0
+
+# 需要重試的 HTTP 狀態碼
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# 每篇文章保留的最多字數（只防止異常的超長頁面；切片由 rag_chunker 依 token 數處理）
+ARTICLE_MAX_CHARS = 50_000
+
+# 解析文章頁的行程數（0 代表不使用行程池，改為邊下載邊解析）
+PARSE_WORKERS = int(os.environ.get("CRAWL_PARSE_WORKERS", 0))
+
+# 正文區塊結束後最多再讀取（不解析）的位元組數，讀完回應才能重複使用連線；超過時直接關閉連線
+STREAM_DRAIN_BYTES = 64 * 1024
+
+# 列表頁的文章連結與下一頁連結的 CSS 選擇器（WordPress 預設的分頁樣式）
+ARTICLE_LINK_SELECTOR = "h1.entry-title a"
+NEXT_PAGE_SELECTOR = 'link[rel="next"], a.next.page-numbers, a[rel="next"]'
+ARTICLE_CONTENT_SELECTOR = "div.entry-content"
+
+
+# 爬取到的文章：網址、標題與正文；text 為交給向量庫的「標題\n正文」
+class Article(namedtuple("Article", ["url", "title", "content"])):
+    __slots__ = ()
+
+    @property
+    def text(self):
+        return self.title + "\n" + self.content
+
+
+# 解析列表頁：回傳 ([(標題, 文章網址), ...], 下一頁網址或 None)，相對網址會轉成絕對網址
+def parse_article_links(html, base_url):
+    links = [
+        (title, urljoin(base_url, href))
+        for title, href in html_extract.extract_links(html, ARTICLE_LINK_SELECTOR)
+        if href
+    ]
+    next_links = html_extract.extract_links(html, NEXT_PAGE_SELECTOR)
+    next_url = urljoin(base_url, next_links[0][1]) if next_links else None
+    return links, next_url
+
+
+# 截斷 html_extract 產生的區塊文字（保留段落與標題，每個區塊一行），找不到正文（None）時回傳空字串
+def clean_content(blocks):
+    if blocks is None:
+        return ""
+    return blocks[:ARTICLE_MAX_CHARS]
+
+
+# 解析文章頁的正文，找不到正文時回傳空字串
+def parse_article_content(html):
+    return clean_content(html_extract.extract_blocks(html, ARTICLE_CONTENT_SELECTOR))
+
+
+# 共用連線池的非同步爬蟲；transport 可替換成 httpx.MockTransport 等本機替身，方便測試
+# state 為 crawl_state.CrawlState 時記錄每篇文章的抓取狀態，並以條件式請求重新爬取
+class Crawler:
+    def __init__(
+        self,
+        per_host=PER_HOST_CONCURRENCY,
+        timeout=REQUEST_TIMEOUT,
+        retries=MAX_RETRIES,
+        backoff=BACKOFF_BASE,
+        transport=None,
+        state=None,
+        parse_workers=PARSE_WORKERS,
+    ):
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.state = state
+        self._parse_pool = (
+            ProcessPoolExecutor(max_workers=parse_workers) if parse_workers else None
+        )
+        self._host_limits = {}
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+            ),
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+
+    # 每個主機各自的 semaphore，限制同時進行的請求數
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    # 第 attempt 次重試前的等待秒數；有 Retry-After（秒數）時以其為準
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        delay = self.backoff * 2**attempt + random.uniform(0, self.backoff)
+        return min(delay, MAX_RETRY_DELAY)
+
+    # 送出 GET 請求並以 reader 讀取回應內容（預設讀取整份文字），回傳 (回應, 內容)；304（未變更）時內容為 None
+    # 重試用盡或遇到不可重試的錯誤時回傳 None
+    async def request(self, url, headers=None, reader=None):
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                async with self._host_limit(url):
+                    async with self.client.stream(
+                        "GET", url, headers=headers
+                    ) as response:
+                        if response.status_code == 304:
+                            return response, None
+                        if response.status_code not in RETRY_STATUS:
+                            response.raise_for_status()
+                            return response, await (reader or read_text)(response)
+            except (httpx.TimeoutException, httpx.TransportError):
+                pass
+            except httpx.HTTPStatusError:
+                return None  # 404 等用戶端錯誤重試也不會成功
+            except (httpx.RequestError, LookupError, ValueError) as e:
+                # 重新導向過多、內容解碼失敗、未知的 charset 等：重試也不會成功
+                logger.warning("抓取 %s 失敗：%s: %s", url, type(e).__name__, e)
+                return None
+            if attempt < self.retries:
+                await asyncio.sleep(self._retry_delay(attempt, response))
+        return None
+
+    # 取得網頁內容；重試用盡或遇到不可重試的錯誤時回傳 None
+    async def fetch(self, url):
+        result = await self.request(url)
+        return result[1] if result is not None else None
+
+    # 讀取文章頁並取出正文
+    # - 使用行程池時：讀取完整的 HTML 後交給行程池解析，解析不佔用事件迴圈
+    # - 否則（需要 lxml）：邊下載邊解析，正文區塊結束後不再解析，剩餘的回應只讀取不解析
+    # - 兩者皆否：讀取完整的 HTML 後在執行緒中解析，避免阻塞其他請求
+    async def read_content(self, response):
+        if self._parse_pool is not None:
+            html = await read_text(response)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._parse_pool, parse_article_content, html
+            )
+        if html_extract.etree is None:
+            html = await read_text(response)
+            return await asyncio.to_thread(parse_article_content, html)
+
+        stream = html_extract.ContentStream(
+            ARTICLE_CONTENT_SELECTOR, response.charset_encoding or "utf-8"
+        )
+        drained = 0
+        async for chunk in response.aiter_bytes():
+            if not stream.done:
+                stream.feed(chunk)
+                continue
+            drained += len(chunk)
+            if drained > STREAM_DRAIN_BYTES:
+                break  # 剩餘內容太多，直接關閉連線
+        stream.close()
+        return clean_content(stream.blocks)
+
+    # 抓取單篇文章的正文，抓取失敗時回傳 None（空字串代表網頁有載入但找不到正文）
+    # 有狀態庫時：剛檢查過或回應 304 的文章沿用狀態庫中的正文，不必下載與解析
+    async def fetch_content(self, url):
+        page = self.state.get(url) if self.state else None
+        if self.state and self.state.is_fresh(page):
+            return page.content
+        headers = self.state.conditional_headers(page) if self.state else None
+        result = await self.request(url, headers, self.read_content)
+        if result is None:
+            return None
+        response, content = result
+        if response.status_code == 304:
+            self.state.touch(url)
+            return page.content
+        if self.state:
+            self.state.record(
+                url,
+                content,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+        return content
+
+    # 抓取單篇文章的正文，抓取失敗時回傳空字串
+    async def fetch_article(self, url):
+        return await self.fetch_content(url) or ""
+
+    # 並行抓取多篇文章，依輸入順序回傳「標題\n正文」
+    async def fetch_articles(self, links):
+        contents = await asyncio.gather(*(self.fetch_article(url) for _, url in links))
+        return [title + "\n" + content for (title, _), content in zip(links, contents)]
+
+    # 從 start_url 開始依下一頁連結翻頁，最多讀取 max_pages 頁與 max_articles 篇文章
+    # 每讀完一頁就先把該頁的文章排入抓取，列表頁與文章頁的請求可以重疊進行
+    # 有狀態庫時記錄發現的文章，並重試先前抓取失敗的文章
+    async def crawl(
+        self,
+        start_url=CRAWL_START_URL,
+        max_pages=CRAWL_MAX_PAGES,
+        max_articles=CRAWL_MAX_ARTICLES,
+    ):
+        links, tasks, seen = [], [], set()
+        url = start_url
+        for _ in range(max_pages):
+            if url is None or len(links) >= max_articles:
+                break
+            html = await self.fetch(url)
+            if html is None:
+                break
+            page_links, url = parse_article_links(html, url)
+            if self.state:
+                self.state.discover(page_links)
+            for title, href in page_links:
+                if href in seen or len(links) >= max_articles:
+                    continue
+                seen.add(href)
+                links.append((title, href))
+                tasks.append(asyncio.create_task(self.fetch_article(href)))
+        if self.state:
+            for title, href in self.state.pending():
+                if href in seen or len(links) >= max_articles:
+                    continue
+                seen.add(href)
+                links.append((title, href))
+                tasks.append(asyncio.create_task(self.fetch_article(href)))
+        contents = await asyncio.gather(*tasks)
+        return [
+            Article(url, title, content)
+            for (title, url), content in zip(links, contents)
+        ]
+
+
+# 讀取完整的回應文字
+async def read_text(response):
+    await response.aread()
+    return response.text
+
+
+# 同步介面：爬取 TechNews 文章並回傳 Article 清單（含網址，供向量庫判斷新增或變更）
+def crawl_documents(
+    start_url=CRAWL_START_URL,
+    max_pages=CRAWL_MAX_PAGES,
+    max_articles=CRAWL_MAX_ARTICLES,
+    **crawler_options,
+):
+    async def run():
+        async with Crawler(**crawler_options) as crawler:
+            return await crawler.crawl(start_url, max_pages, max_articles)
+
+    return asyncio.run(run())
+
+
+# 同步介面：爬取 TechNews 文章並回傳「標題\n正文」清單
+def crawl_articles(
+    start_url=CRAWL_START_URL,
+    max_pages=CRAWL_MAX_PAGES,
+    max_articles=CRAWL_MAX_ARTICLES,
+    **crawler_options,
+):
+    articles = crawl_documents(start_url, max_pages, max_articles, **crawler_options)
+    return [article.text for article in articles]
+
+
+# 同步介面：並行抓取已知的文章連結 [(標題, 網址), ...]
+def fetch_articles(links, **crawler_options):
+    async def run():
+        async with Crawler(**crawler_options) as crawler:
+            return await crawler.fetch_articles(links)
+
+    return asyncio.run(run())
+
+
+# 同步介面：並行取得多個網頁的 HTML，依輸入順序回傳，失敗的網頁為 None
+def fetch_pages(urls, **crawler_options):
+    async def run():
+        async with Crawler(**crawler_options) as crawler:
+            return await asyncio.gather(*(crawler.fetch(url) for url in urls))
+
+    return asyncio.run(run())
+
+
+# 同步介面：並行抓取多篇文章的正文，依輸入順序回傳，抓取失敗的文章為 None
+def fetch_contents(urls, **crawler_options):
+    async def run():
+        async with Crawler(**crawler_options) as crawler:
+            return await asyncio.gather(*(crawler.fetch_content(url) for url in urls))
+
+    return asyncio.run(run())
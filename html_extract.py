@@ -0,0 +1,347 @@
+# 文章正文與連結的快速擷取引擎（crawler.py 使用）
+# - selectolax（lexbor，C 實作）解析整份 HTML，比 BeautifulSoup 的 html.parser 快一個數量級以上
+# - lxml 的 HTMLPullParser 可邊下載邊解析，正文區塊的結束標籤一出現就停止解析（ContentStream）
+# - 兩者都沒有安裝時退回 BeautifulSoup，並以 SoupStrainer 只建立正文區塊的節點
+# 三種後端擷取出的文字與 BeautifulSoup 的 get_text(strip=True) 相同：
+# 各文字節點去除前後空白後直接相接，略過註解與 script / style / template 的內容
+# - extract_blocks 直接走訪已解析的文件樹，轉成保留段落、標題與清單的文字（每個區塊一行），
+#   不必將正文區塊序列化成 HTML 再重新解析
+#
+# 用法：
+#   text = extract_text(html, "div.entry-content")
+#   blocks = extract_blocks(html, "div.entry-content")
+#   stream = ContentStream("div.entry-content")
+#   for chunk in chunks:
+#       if stream.feed(chunk):
+#           break
+#   stream.close()
+#   text, blocks = stream.text, stream.blocks
+import os
+import re
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # 選用套件
+    LexborHTMLParser = None
+
+try:
+    from lxml import etree
+except ImportError:  # 選用套件
+    etree = None
+
+# 擷取後端：selectolax / lxml / bs4，未設定時使用已安裝的最快後端
+EXTRACT_BACKEND = os.environ.get("HTML_EXTRACT_BACKEND") or (
+    "selectolax" if LexborHTMLParser else "lxml" if etree else "bs4"
+)
+
+# 內容不算正文的標籤
+SKIP_TAGS = ("script", "style", "template")
+
+# 區塊層級的標籤：開始或結束時換行；標題與清單項目在行首加上 Markdown 標記
+BLOCK_TAGS = {
+    "address",
+    "article",
+    "aside",
+    "blockquote",
+    "br",
+    "dd",
+    "div",
+    "dl",
+    "dt",
+    "figcaption",
+    "figure",
+    "footer",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "header",
+    "hr",
+    "li",
+    "ol",
+    "p",
+    "pre",
+    "section",
+    "table",
+    "td",
+    "th",
+    "tr",
+    "ul",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+# 串流與 lxml 後端支援的簡單選擇器：標籤名稱加上零或多個 class，例如 div.entry-content
+SIMPLE_SELECTOR = re.compile(r"^([a-zA-Z][a-zA-Z0-9]*)((?:\.[\w-]+)*)$")
+
+
+# 解析簡單選擇器，回傳 (標籤, {class, ...})；不支援的選擇器拋出 ValueError
+def parse_selector(selector):
+    match = SIMPLE_SELECTOR.match(selector.strip())
+    if not match:
+        raise ValueError(f"只支援「標籤.class」形式的選擇器：{selector}")
+    tag, classes = match.groups()
+    return tag.lower(), {name for name in classes.split(".") if name}
+
+
+# 元素是否符合簡單選擇器
+def matches(element, tag, classes):
+    if element.tag != tag:
+        return False
+    return classes <= set((element.get("class") or "").split())
+
+
+# 依 BeautifulSoup get_text(strip=True) 的規則串接 lxml 元素的文字
+def lxml_text(element):
+    parts = []
+
+    def walk(node):
+        if node.text:
+            parts.append(node.text)
+        for child in node:
+            # 註解與處理指令的 tag 不是字串，其 text 不是正文
+            if isinstance(child.tag, str) and child.tag not in SKIP_TAGS:
+                walk(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    walk(element)
+    return "".join(part.strip() for part in parts)
+
+
+# selectolax 後端：移除不算正文的標籤後取出文字
+def selectolax_text(html, selector):
+    node = LexborHTMLParser(html).css_first(selector)
+    if node is None:
+        return None
+    node.strip_tags(list(SKIP_TAGS))
+    return node.text(deep=True, separator="", strip=True)
+
+
+# lxml 後端：解析整份 HTML，依文件順序找出第一個符合的元素
+def lxml_extract(html, selector):
+    tag, classes = parse_selector(selector)
+    root = etree.fromstring(html, etree.HTMLParser())
+    if root is None:
+        return None
+    for element in root.iter(tag):
+        if matches(element, tag, classes):
+            return lxml_text(element)
+    return None
+
+
+# BeautifulSoup 後端：以 SoupStrainer 只建立符合的節點，不建立整份文件樹
+def bs4_extract(html, selector):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    tag, classes = parse_selector(selector)
+    strainer = SoupStrainer(
+        tag, class_=lambda value: value is not None and classes <= set(value.split())
+    )
+    soup = BeautifulSoup(html, "html.parser", parse_only=strainer)
+    element = soup.find(tag)
+    return element.get_text(strip=True) if element is not None else None
+
+
+BACKENDS = {"selectolax": selectolax_text, "lxml": lxml_extract, "bs4": bs4_extract}
+
+
+# 取出第一個符合 selector 的元素的文字，找不到時回傳 None
+def extract_text(html, selector, backend=None):
+    return BACKENDS[backend or EXTRACT_BACKEND](html, selector)
+
+
+# 以指定的後端解析 HTML，回傳第一個符合 selector 的元素（各後端自己的節點型別），找不到時回傳 None
+def find_element(html, selector, backend=None):
+    backend = backend or EXTRACT_BACKEND
+    if backend == "selectolax":
+        return LexborHTMLParser(html).css_first(selector)
+    if backend == "lxml":
+        tag, classes = parse_selector(selector)
+        root = etree.fromstring(html, etree.HTMLParser())
+        for element in root.iter(tag) if root is not None else ():
+            if matches(element, tag, classes):
+                return element
+        return None
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    tag, classes = parse_selector(selector)
+    strainer = SoupStrainer(
+        tag, class_=lambda value: value is not None and classes <= set(value.split())
+    )
+    return BeautifulSoup(html, "html.parser", parse_only=strainer).find(tag)
+
+
+# 依標籤的開始、結束與文字依序組成區塊文字：每個段落、標題或清單項目一行，區塊內的連續空白合併成一個空格
+class BlockBuilder:
+    def __init__(self):
+        self.blocks = []
+        self._parts = []
+        self._prefix = ""
+        self._skip = 0
+
+    def _flush(self):
+        text = " ".join("".join(self._parts).split())
+        if text:
+            self.blocks.append(self._prefix + text)
+        self._parts = []
+        self._prefix = ""
+
+    def start(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+            return
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in HEADING_TAGS:
+            self._prefix = "#" * int(tag[1]) + " "
+        elif tag == "li":
+            self._prefix = "- "
+
+    def end(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def data(self, text):
+        if not self._skip:
+            self._parts.append(text)
+
+    # 回傳區塊文字，每個區塊一行
+    def close(self):
+        self._flush()
+        return "\n".join(self.blocks)
+
+
+# 走訪 lxml 元素（不含元素之後的 tail 文字）組成區塊文字
+def lxml_blocks(element):
+    builder = BlockBuilder()
+
+    def walk(node):
+        builder.start(node.tag)
+        if node.text:
+            builder.data(node.text)
+        for child in node:
+            # 註解與處理指令的 tag 不是字串，其 text 不是正文，但 tail 仍是正文
+            if isinstance(child.tag, str):
+                walk(child)
+            if child.tail:
+                builder.data(child.tail)
+        builder.end(node.tag)
+
+    walk(element)
+    return builder.close()
+
+
+# 走訪 selectolax 節點組成區塊文字；子節點中的文字節點為 -text，註解為 -comment
+def selectolax_blocks(node):
+    builder = BlockBuilder()
+
+    def walk(node):
+        builder.start(node.tag)
+        child = node.child
+        while child is not None:
+            if child.is_text_node:
+                builder.data(child.text_content)
+            elif child.is_element_node:
+                walk(child)
+            child = child.next
+        builder.end(node.tag)
+
+    walk(node)
+    return builder.close()
+
+
+# 走訪 BeautifulSoup 元素組成區塊文字；註解等特殊字串不是正文
+def bs4_blocks(element):
+    from bs4 import NavigableString, Tag
+
+    builder = BlockBuilder()
+
+    def walk(node):
+        builder.start(node.name)
+        for child in node.children:
+            if isinstance(child, Tag):
+                walk(child)
+            elif type(child) is NavigableString:
+                builder.data(child)
+        builder.end(node.name)
+
+    walk(element)
+    return builder.close()
+
+
+BLOCK_WALKERS = {
+    "selectolax": selectolax_blocks,
+    "lxml": lxml_blocks,
+    "bs4": bs4_blocks,
+}
+
+
+# 取出第一個符合 selector 的元素的區塊文字（每個區塊一行），找不到時回傳 None
+def extract_blocks(html, selector, backend=None):
+    backend = backend or EXTRACT_BACKEND
+    element = find_element(html, selector, backend)
+    return BLOCK_WALKERS[backend](element) if element is not None else None
+
+
+# 取出所有符合 selector 的元素的 (文字, 屬性值)；selectolax 不可用時以 BeautifulSoup 解析
+def extract_links(html, selector, attribute="href"):
+    if LexborHTMLParser is not None:
+        return [
+            (
+                node.text(deep=True, separator="", strip=True),
+                node.attributes.get(attribute),
+            )
+            for node in LexborHTMLParser(html).css(selector)
+        ]
+    from bs4 import BeautifulSoup
+
+    return [
+        (node.get_text(strip=True), node.get(attribute))
+        for node in BeautifulSoup(html, "html.parser").select(selector)
+    ]
+
+
+# 邊下載邊解析的正文擷取器（需要 lxml）：feed 回傳 True 代表正文區塊已結束，不必再讀取其餘的 HTML
+# 正文只在讀取 text 或 blocks 時才從已解析的正文區塊元素取出
+class ContentStream:
+    def __init__(self, selector, encoding="utf-8"):
+        self.tag, self.classes = parse_selector(selector)
+        self._parser = etree.HTMLPullParser(events=("start", "end"), encoding=encoding)
+        self._element = None
+        self.done = False
+
+    # 正文文字（與 extract_text 相同）；文件結束仍找不到完整的正文區塊時為已解析到的部分或 None
+    @property
+    def text(self):
+        return lxml_text(self._element) if self._element is not None else None
+
+    # 正文的區塊文字（與 extract_blocks 相同），找不到正文區塊時為 None
+    @property
+    def blocks(self):
+        return lxml_blocks(self._element) if self._element is not None else None
+
+    def feed(self, chunk):
+        if self.done:
+            return True
+        self._parser.feed(chunk)
+        for event, element in self._parser.read_events():
+            if self._element is None:
+                if event == "start" and matches(element, self.tag, self.classes):
+                    self._element = element
+            elif event == "end" and element is self._element:
+                self.done = True
+                return True
+        return False
+
+    # 結束解析；正文區塊已結束時不必再解析
+    def close(self):
+        if not self.done:
+            try:
+                self._parser.close()
+            except etree.XMLSyntaxError:
+                pass
+            self.done = True
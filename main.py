@@ -1,30 +1,222 @@
 # 匯入 FastAPI 框架、檔案上傳與錯誤處理相關模組
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Depends
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import itertools
+import json
+import zlib
+
+# 匯入背景匯入工作所需的標準函式庫（執行緒池與行程池、暫存檔、zip、計時）
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import queue
+import shutil
+import sqlite3
+import time
+import uuid
+import zipfile
 
 # 匯入資料驗證模組 Pydantic，用來定義資料結構
 from pydantic import BaseModel
 
 # 匯入 SQLAlchemy 的資料庫建構工具
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import (
+    create_engine,
+    event,
+    Column,
+    Integer,
+    String,
+    Float,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
 
-# 匯入 pandas 處理 CSV 與 io 處理檔案流
+# 匯入 pandas 與 numpy 處理 CSV 與整欄驗證
+import numpy as np
 import pandas as pd
-import io
 
-# 設定 SQLite 資料庫路徑
-DATABASE_URL = "sqlite:///./users.db"
+# 匯入 API 回應快取
+from response_cache import (
+    ResponseCache,
+    MemoryCacheBackend,
+    RedisCacheBackend,
+    etag_matches,
+)
+
+# 匯入 users 水平分片的路由與合併工具
+from sharding import ShardSet
+
+# 匯入請求層級的效能指標與取樣分析器
+from metrics import (
+    MetricsRegistry,
+    MetricsMiddleware,
+    SamplingProfiler,
+    add_rows_read,
+    instrument_engine,
+)
+
+# 設定 SQLite 資料庫路徑，可由環境變數 DATABASE_URL 指定其他資料庫（例如壓力測試用）
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./users.db")
+
+# CSV 匯入時每一批次讀取與寫入的列數，決定匯入過程的記憶體上限
+CSV_CHUNK_SIZE = 50_000
+
+# 匯入時判斷檔案內重複的雜湊集合存放在暫存磁碟資料庫，此為其頁面快取上限（KiB）
+SEEN_ROWS_CACHE_KIB = 16 * 1024
+
+# 上傳的 CSV 先暫存到此資料夾，再交由背景工作匯入；被拒絕資料的報表也存放在此
+UPLOAD_SPOOL_DIR = "./upload_spool"
+
+# 匯入工作結束後保留被拒絕資料報表的秒數，逾期的報表在服務啟動與每個工作結束時刪除
+REJECTED_REPORT_RETENTION = int(
+    os.environ.get("REJECTED_REPORT_RETENTION", 7 * 24 * 3600)
+)
+
+# CSV 匯入時允許的年齡範圍
+AGE_MIN = 0
+AGE_MAX = 150
+
+# GET /users 每頁預設與最大的筆數
+USERS_PAGE_SIZE = 1000
+USERS_MAX_PAGE_SIZE = 10_000
+
+# 串流匯出時每次從資料庫游標取出的列數
+USERS_STREAM_BATCH = 1000
+
+# 欄式匯出（Parquet / Arrow / CSV）每個 record batch 的列數，以及各格式預設的壓縮方式
+EXPORT_BATCH_ROWS = 100_000
+EXPORT_COMPRESSION = {"parquet": "zstd", "arrow": "zstd", "csv": "gzip"}
+
+# 批次新增與批次刪除 API 單次請求允許的最大筆數
+USERS_BATCH_MAX_CREATE = 10_000
+USERS_BATCH_MAX_DELETE = 1000
+
+# 是否維護 age_stats 彙總表（每組的年齡總和與人數），開啟後 /average_age 只需讀取 O(組數) 筆資料
+AGE_STATS_MATERIALIZED = os.environ.get("AGE_STATS_MATERIALIZED", "0") == "1"
+
+# 是否啟用名稱唯一模式：users.name 建立唯一索引，所有寫入路徑改用 INSERT ... ON CONFLICT(name) DO UPDATE
+# 既有資料庫若已有重複名稱，需先執行 python users_cli.py dedup 進行去重
+UNIQUE_USER_NAMES = os.environ.get("UNIQUE_USER_NAMES", "0") == "1"
+
+# GET /users 與 GET /average_age 的回應快取設定：存活秒數、LRU 筆數上限與後端（memory 或 redis）
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 30))
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# 慢請求取樣分析：請求超過此毫秒數時輸出 folded stacks 到 PROFILE_DIR；0 代表停用
+PROFILE_SLOW_REQUEST_MS = float(os.environ.get("PROFILE_SLOW_REQUEST_MS", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
+
+# 背景匯入的工作執行緒數量；SQLite 同時只允許一個寫入者，預設使用單一執行緒
+IMPORT_WORKERS = 1
+
+# 多檔匯入時解析與驗證 CSV 的子行程數量，預設使用所有 CPU 核心
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+
+# 資料庫連線池大小與可額外建立的連線數，可由環境變數調整
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+
+# SQLite 連線參數組合：每條新連線建立時套用對應的 PRAGMA
+# performance 使用 WAL 讓讀取不再阻擋寫入，並以 mmap 與較大快取減少系統呼叫
+SQLITE_PROFILES = {
+    "default": {},
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # 負值代表以 KiB 為單位，即 64 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+
+# 使用的 SQLite 參數組合名稱，可由環境變數 SQLITE_PROFILE 切換
+SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "performance")
+
+# users 資料表的分片數量：大於 1 時依名稱雜湊將使用者分散到 USER_SHARD_URL 產生的多個 SQLite 檔案，
+# 每個分片有獨立的寫入鎖；匯入工作等其他資料表仍存放在 DATABASE_URL
+# 調整分片數量前需先執行 python users_cli.py rebalance --to N 搬移資料
+USER_SHARDS = int(os.environ.get("USER_SHARDS", 1))
+USER_SHARD_URL = os.environ.get(
+    "USER_SHARD_URL", "sqlite:///./users_shard{index}of{count}.db"
+)
+
+
+# 每條新的 SQLite 連線建立時套用選定的 PRAGMA 參數
+def apply_sqlite_profile(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PROFILES[SQLITE_PROFILE].items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
 
 # 建立資料庫引擎，SQLite 特別需要加入 check_same_thread=False
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# 本機 SQLite 檔案的連線不會被伺服器端中斷，不使用 pool_pre_ping，避免每次取出連線多一次 SELECT 1
+def make_engine(url):
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    event.listen(new_engine, "connect", apply_sqlite_profile)
+    return new_engine
+
+
+engine = make_engine(DATABASE_URL)
+
+# 效能指標：統計每個路由的延遲、資料庫查詢與讀寫列數，由 GET /metrics 輸出
+metrics_registry = MetricsRegistry()
+instrument_engine(engine, metrics_registry)
+
+# 選用的慢請求取樣分析器
+profiler = (
+    SamplingProfiler(PROFILE_SLOW_REQUEST_MS, PROFILE_DIR)
+    if PROFILE_SLOW_REQUEST_MS > 0
+    else None
+)
 
 # 建立資料庫 session 工具
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+
+# 提供給 FastAPI Depends 的 session 產生器，無論成功或例外都會關閉 session
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 # 建立資料表基礎類別
 Base = declarative_base()
 
 
+# 依設定建立回應快取；redis 後端需要另外安裝 redis 套件
+def create_response_cache():
+    if RESPONSE_CACHE_BACKEND == "redis":
+        import redis
+
+        backend = RedisCacheBackend(redis.Redis.from_url(REDIS_URL))
+    else:
+        backend = MemoryCacheBackend(max_entries=RESPONSE_CACHE_MAX_ENTRIES)
+    return ResponseCache(backend, ttl=RESPONSE_CACHE_TTL, namespace="users")
+
+
+# users 資料表的回應快取，所有寫入 users 的路徑在提交後都要呼叫 response_cache.bump()
+response_cache = create_response_cache()
+
+
 # 定義資料庫中的 UserTable 資料表結構
 class UserTable(Base):
     __tablename__ = "users"  # 資料表名稱為 users
@@ -33,11 +225,160 @@ class UserTable(Base):
     age = Column(Integer)  # 使用者年齡
 
 
+# 定義 CSV 背景匯入工作的資料表，與 users 存放在同一個 SQLite 資料庫，重啟後仍可續跑
+class ImportJob(Base):
+    __tablename__ = "import_jobs"  # 資料表名稱為 import_jobs
+    id = Column(String, primary_key=True)  # 工作編號（UUID）
+    filename = Column(String)  # 原始上傳檔名
+    spool_path = Column(String)  # 暫存檔路徑
+    status = Column(String, index=True)  # queued / running / done / failed
+    bytes_total = Column(Integer, default=0)  # 暫存檔總大小
+    bytes_processed = Column(Integer, default=0)  # 已解析的位元組數
+    rows_inserted = Column(Integer, default=0)  # 已寫入的列數
+    rows_rejected = Column(Integer, default=0)  # 驗證失敗的列數
+    error = Column(String, nullable=True)  # 失敗時的錯誤訊息
+    created_at = Column(Float)  # 建立時間（epoch 秒）
+    started_at = Column(Float, nullable=True)  # 開始執行時間
+    finished_at = Column(Float, nullable=True)  # 結束時間
+
+
+# 定義依名稱第一個字分組的年齡彙總表，由寫入路徑增量更新
+class AgeStats(Base):
+    __tablename__ = "age_stats"  # 資料表名稱為 age_stats
+    group_key = Column(String, primary_key=True)  # 名稱的第一個字
+    age_sum = Column(Integer, default=0)  # 該組年齡總和
+    user_count = Column(Integer, default=0)  # 該組人數
+
+
 # 建立資料表（如果尚未存在）
 Base.metadata.create_all(bind=engine)
 
-# 建立 FastAPI 應用實例
-app = FastAPI()
+
+# 建立 users 分片：每個分片檔案有獨立的引擎，只包含 users 與 age_stats 資料表
+# 未指定 url_template 時使用 USER_SHARD_URL
+def create_shard_set(count, url_template=None):
+    url_template = url_template or USER_SHARD_URL
+    engines = []
+    for index in range(count):
+        shard_engine = make_engine(url_template.format(index=index, count=count))
+        instrument_engine(shard_engine, metrics_registry)
+        Base.metadata.create_all(
+            bind=shard_engine, tables=[UserTable.__table__, AgeStats.__table__]
+        )
+        engines.append(shard_engine)
+    return ShardSet(engines)
+
+
+# 分片模式下的分片集合；未分片時為 None，所有 users 讀寫都使用 engine
+shards = create_shard_set(USER_SHARDS) if USER_SHARDS > 1 else None
+
+
+# 存放 users 資料的所有引擎（維護作業需要逐一處理）
+def user_engines():
+    return shards.engines if shards is not None else [engine]
+
+
+# 背景匯入工作使用的執行緒池
+import_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS)
+
+
+# 建立 users.name 的唯一索引（名稱唯一模式使用）；若已有重複名稱會拋出 IntegrityError
+# 同名使用者一定落在同一個分片，因此各分片的唯一索引即可保證全域唯一
+def ensure_unique_name_index(engines=None):
+    for user_engine in engines or user_engines():
+        with user_engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_users_name ON users (name)"
+            )
+
+
+# 一次性的去重與壓縮：每個名稱只保留 id 最大（最新）的一筆，建立唯一索引並重建彙總表
+# 回傳被刪除的筆數；vacuum=True 時一併以 VACUUM 回收磁碟空間
+def compact_users(vacuum=True):
+    users = UserTable.__table__
+    latest = select(func.max(users.c.id)).group_by(users.c.name)
+    deleted = 0
+    for user_engine in user_engines():
+        with user_engine.begin() as conn:
+            deleted += conn.execute(
+                users.delete().where(users.c.id.not_in(latest))
+            ).rowcount
+    ensure_unique_name_index()
+    rebuild_age_stats()
+    response_cache.bump()
+    if vacuum:
+        for user_engine in user_engines():
+            with user_engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT"
+            ) as conn:
+                conn.exec_driver_sql("VACUUM")
+    return deleted
+
+
+# 將 users 從 source_engines 重新分配到 target（ShardSet）中，調整分片數量時使用，回傳搬移的筆數
+# 目標的 users 資料表必須為空；搬移後分片內 id 重新編號，因此全域 id 與分頁游標都會改變
+# 確認目標的總筆數與搬移筆數相符後清空來源的 users，之後才能再搬回同一個來源（例如 N → 1）
+def rebalance_users(source_engines, target, batch_rows=None):
+    batch_rows = batch_rows or EXPORT_BATCH_ROWS
+    users = UserTable.__table__
+    for target_engine in target.engines:
+        with target_engine.connect() as conn:
+            if conn.execute(select(func.count()).select_from(users)).scalar():
+                raise ValueError("目標分片的 users 資料表必須為空")
+
+    def write(shard, shard_engine, items):
+        with shard_engine.begin() as conn:
+            conn.execute(insert(users), [row for _, row in items])
+
+    moved = 0
+    query = select(users.c.name, users.c.age).order_by(users.c.id)
+    for source_engine in source_engines:
+        with source_engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=batch_rows
+            ).execute(query)
+            for partition in result.partitions():
+                rows = [{"name": name, "age": age} for name, age in partition]
+                target.run(write, target.partition(rows, key=lambda row: row["name"]))
+                moved += len(rows)
+    stored = 0
+    for target_engine in target.engines:
+        with target_engine.connect() as conn:
+            stored += conn.execute(select(func.count()).select_from(users)).scalar()
+    if stored != moved:
+        raise RuntimeError(
+            f"目標分片有 {stored} 筆，與搬移的 {moved} 筆不符，來源資料未清空"
+        )
+    for source_engine in source_engines:
+        with source_engine.begin() as conn:
+            conn.execute(users.delete())
+            conn.execute(AgeStats.__table__.delete())
+    rebuild_age_stats(target.engines)
+    if UNIQUE_USER_NAMES:
+        ensure_unique_name_index(target.engines)
+    response_cache.bump()  # id 重新編號，舊的快取回應與 ETag 都不再正確
+    return moved
+
+
+# 應用程式啟動時，將上次未完成的匯入工作重新排入執行緒池
+@asynccontextmanager
+async def lifespan(app):
+    if UNIQUE_USER_NAMES:
+        ensure_unique_name_index()
+    if AGE_STATS_MATERIALIZED:
+        rebuild_age_stats()
+    prune_rejected_reports()
+    resume_import_jobs()
+    if profiler is not None:
+        profiler.start()
+    yield
+    if profiler is not None:
+        profiler.stop()
+
+
+# 建立 FastAPI 應用實例，並掛上效能指標 middleware
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, registry=metrics_registry, profiler=profiler)
 
 
 # 定義使用者模型，用於接收與驗證輸入資料（name, age）
@@ -46,86 +387,1255 @@ class User(BaseModel):
     age: int
 
 
+# 以 UPSERT 累加 age_stats 中各組的年齡總和與人數，deltas 為 (組別, 年齡總和, 人數)
+def bump_age_stats(conn, deltas):
+    rows = [
+        {"group_key": key, "age_sum": int(age_sum), "user_count": int(count)}
+        for key, age_sum, count in deltas
+        if age_sum or count
+    ]
+    if not rows:
+        return
+    stmt = sqlite_insert(AgeStats.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["group_key"],
+        set_={
+            "age_sum": AgeStats.__table__.c.age_sum + stmt.excluded.age_sum,
+            "user_count": AgeStats.__table__.c.user_count + stmt.excluded.user_count,
+        },
+    )
+    conn.execute(stmt, rows)
+
+
+# 以 users 資料表重新計算整份 age_stats（啟用彙總表或資料不一致時使用），分片模式下各分片各自計算
+def rebuild_age_stats(engines=None):
+    users = UserTable.__table__
+    group = func.substr(users.c.name, 1, 1)
+    for user_engine in engines or user_engines():
+        with user_engine.begin() as conn:
+            conn.execute(AgeStats.__table__.delete())
+            conn.execute(
+                AgeStats.__table__.insert().from_select(
+                    ["group_key", "age_sum", "user_count"],
+                    select(group, func.sum(users.c.age), func.count()).group_by(group),
+                )
+            )
+
+
+# 分段查詢多個名稱的 {名稱: 欄位值}，避免 IN (...) 超過 SQLite 的參數數量上限
+def lookup_by_name(conn, names, column, batch_size=500):
+    users = UserTable.__table__
+    names = list(names)
+    values = {}
+    for start in range(0, len(names), batch_size):
+        values.update(
+            conn.execute(
+                select(users.c.name, column).where(
+                    users.c.name.in_(names[start : start + batch_size])
+                )
+            ).all()
+        )
+    return values
+
+
+# 分段查詢多個名稱目前的年齡
+def existing_ages(conn, names):
+    return lookup_by_name(conn, names, UserTable.__table__.c.age)
+
+
+# 名稱唯一模式的寫入：以單一 INSERT ... ON CONFLICT(name) DO UPDATE（executemany）批次新增或更新
+# 不使用 RETURNING：SQLite 的 RETURNING 無法合併成 executemany，每列都會變成一個陳述式
+# rows 中相同名稱以最後一筆為準；回傳 {已存在名稱: 原本年齡}，需要 id 的呼叫端再以名稱查詢
+def upsert_users(conn, rows):
+    rows = list({row["name"]: row for row in rows}.values())  # 同名以最後一筆為準
+    if not rows:
+        return {}
+    old_ages = existing_ages(conn, (row["name"] for row in rows))
+
+    users = UserTable.__table__
+    stmt = sqlite_insert(users)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"], set_={"age": stmt.excluded.age}
+    )
+    conn.execute(stmt, rows)
+
+    if AGE_STATS_MATERIALIZED:
+        # 新名稱增加人數，既有名稱只調整年齡差值
+        deltas = {}
+        for row in rows:
+            key = row["name"][:1]
+            age_sum, count = deltas.get(key, (0, 0))
+            if row["name"] in old_ages:
+                deltas[key] = (age_sum + row["age"] - old_ages[row["name"]], count)
+            else:
+                deltas[key] = (age_sum + row["age"], count + 1)
+        bump_age_stats(conn, [(key, s, c) for key, (s, c) in deltas.items()])
+    return old_ages
+
+
 # 建立單筆使用者的 API：POST /user
+# 名稱唯一模式下，同名使用者已存在時改為更新年齡，重試請求不會產生重複資料
 @app.post("/user")
-def create_user(user: User):
-    db = SessionLocal()  # 建立資料庫 session
+def create_user(user: User, db: Session = Depends(get_db)):
+    if shards is not None:
+        # 分片模式：只寫入該名稱所屬的分片，不同分片的寫入互不阻擋
+        with shards.engine_for(user.name).begin() as conn:
+            ((_, status),) = insert_users_batch(conn, [user])
+        response_cache.bump()
+        message = "User updated" if status == "updated" else "User added"
+        return {"message": message, "user": user}
+
+    if UNIQUE_USER_NAMES:
+        old_ages = upsert_users(db.connection(), [user.model_dump()])
+        db.commit()
+        response_cache.bump()
+        message = "User updated" if user.name in old_ages else "User added"
+        return {"message": message, "user": user}
+
     db_user = UserTable(name=user.name, age=user.age)  # 建立 UserTable 實例
     db.add(db_user)  # 新增到資料庫 session
+    if AGE_STATS_MATERIALIZED:
+        # 與新增使用者在同一個交易內更新彙總表
+        bump_age_stats(db.connection(), [(user.name[:1], user.age, 1)])
     db.commit()  # 提交變更
-    db.close()  # 關閉 session
+    response_cache.bump()  # 讓使用者相關的快取失效
     return {"message": "User added", "user": user}  # 回傳訊息與新增的使用者資料
 
 
 # 刪除指定使用者名稱的 API：DELETE /user/{name}
 @app.delete("/user/{name}")
-def delete_user(name: str):
-    db = SessionLocal()
+def delete_user(name: str, db: Session = Depends(get_db)):
+    if shards is not None:
+        with shards.engine_for(name).begin() as conn:
+            deleted = delete_users_batch(conn, [name])[name]
+        response_cache.bump()
+        return {"message": f"Deleted {deleted} user(s) named {name}"}
+
+    if AGE_STATS_MATERIALIZED:
+        # 刪除前先取得被刪除者的年齡總和與人數，從彙總表中扣除
+        age_sum, count = (
+            db.query(func.coalesce(func.sum(UserTable.age), 0), func.count())
+            .filter(UserTable.name == name)
+            .one()
+        )
+        bump_age_stats(db.connection(), [(name[:1], -age_sum, -count)])
     # 根據名稱查詢並刪除使用者，回傳刪除筆數
     deleted = db.query(UserTable).filter(UserTable.name == name).delete()
     db.commit()
-    db.close()
+    response_cache.bump()
     return {"message": f"Deleted {deleted} user(s) named {name}"}  # 回傳刪除結果
 
 
-# 取得所有使用者的 API：GET /users
-@app.get("/users")
-def get_users():
-    db = SessionLocal()
-    users = db.query(UserTable).all()  # 查詢所有使用者
-    db.close()
+# 在同一個交易內以單一 INSERT（executemany）寫入多位使用者
+# 依輸入順序回傳每一筆的 (id, 狀態)；名稱唯一模式下狀態為 created 或 updated
+def insert_users_batch(conn, users):
+    rows = [{"name": user.name, "age": user.age} for user in users]
+    if not rows:
+        return []
+    if UNIQUE_USER_NAMES:
+        old_ages = upsert_users(conn, rows)
+        ids = lookup_by_name(
+            conn, (row["name"] for row in rows), UserTable.__table__.c.id
+        )
+        return [
+            (ids[row["name"]], "updated" if row["name"] in old_ages else "created")
+            for row in rows
+        ]
+    conn.execute(insert(UserTable), rows)
+    # SQLite 的 INSERT ... RETURNING 無法合併成 executemany（每列一個陳述式），因此改以一次查詢取回 id：
+    # 交易持有寫入鎖，這批資料依序取得 max(id) + 1 起的連續 rowid，即目前最大的 len(rows) 個 id
+    users = UserTable.__table__
+    ids = (
+        conn.execute(select(users.c.id).order_by(users.c.id.desc()).limit(len(rows)))
+        .scalars()
+        .all()[::-1]
+    )
+    if AGE_STATS_MATERIALIZED:
+        # 先在 Python 端依組別加總，再一次更新彙總表
+        deltas = {}
+        for row in rows:
+            age_sum, count = deltas.get(row["name"][:1], (0, 0))
+            deltas[row["name"][:1]] = (age_sum + row["age"], count + 1)
+        bump_age_stats(conn, [(key, s, c) for key, (s, c) in deltas.items()])
+    return [(user_id, "created") for user_id in ids]
+
+
+# 在同一個交易內以 WHERE name IN (...) 刪除多個名稱，回傳每個名稱被刪除的筆數
+# 名稱分段處理，避免 IN (...) 超過 SQLite 的參數數量上限
+def delete_users_batch(conn, names, batch_size=500):
+    names = list(dict.fromkeys(names))  # 去除重複名稱並保留順序
+    if not names:
+        return {}
+    users = UserTable.__table__
+    counts = []
+    for start in range(0, len(names), batch_size):
+        batch = names[start : start + batch_size]
+        # 先以一次分組查詢取得每個名稱的筆數與年齡總和
+        counts += conn.execute(
+            select(users.c.name, func.count(), func.sum(users.c.age))
+            .where(users.c.name.in_(batch))
+            .group_by(users.c.name)
+        ).all()
+        conn.execute(users.delete().where(users.c.name.in_(batch)))
+    if AGE_STATS_MATERIALIZED:
+        bump_age_stats(
+            conn, [(name[:1], -age_sum, -count) for name, count, age_sum in counts]
+        )
+    deleted = {name: count for name, count, _ in counts}
+    return {name: deleted.get(name, 0) for name in names}
+
+
+# 分片模式的批次新增：依名稱分組後各分片平行寫入自己的交易，依輸入順序回傳 (全域 id, 狀態)
+# 各分片獨立提交，因此某個分片失敗時其他分片的資料仍會保留
+def insert_users_sharded(users):
+    groups = shards.partition(users, key=lambda user: user.name)
+
+    def write(shard, shard_engine, items):
+        with shard_engine.begin() as conn:
+            return insert_users_batch(conn, [user for _, user in items])
+
+    results = [None] * len(users)
+    for shard, shard_results in shards.run(write, groups).items():
+        for (position, _), (local_id, status) in zip(groups[shard], shard_results):
+            results[position] = (shards.to_global(local_id, shard), status)
+    return results
+
+
+# 分片模式的批次刪除：依名稱分組後各分片平行刪除，回傳每個名稱被刪除的筆數
+def delete_users_sharded(names):
+    names = list(dict.fromkeys(names))
+
+    def delete(shard, shard_engine, items):
+        with shard_engine.begin() as conn:
+            return delete_users_batch(conn, [name for _, name in items])
+
+    deleted = {}
+    for shard_deleted in shards.run(delete, shards.partition(names)).values():
+        deleted.update(shard_deleted)
+    return {name: deleted[name] for name in names}
+
+
+# 檢查批次請求的筆數是否超過上限
+def check_batch_size(items, max_size):
+    if len(items) > max_size:
+        raise HTTPException(status_code=400, detail=f"批次筆數超過上限 {max_size}")
+
+
+# 將批次新增的結果整理成逐筆回報的格式
+def batch_create_response(results, users):
+    return {
+        "message": f"Added {len(results)} user(s)",
+        "results": [
+            {"index": i, "id": user_id, "name": user.name, "status": status}
+            for i, ((user_id, status), user) in enumerate(zip(results, users))
+        ],
+    }
+
+
+# 將批次刪除的結果整理成逐筆回報的格式
+def batch_delete_response(deleted):
+    return {
+        "message": f"Deleted {sum(deleted.values())} user(s)",
+        "results": [
+            {
+                "name": name,
+                "deleted": count,
+                "status": "deleted" if count else "not_found",
+            }
+            for name, count in deleted.items()
+        ],
+    }
+
+
+# 批次新增使用者的 API：POST /users/batch
+@app.post("/users/batch")
+def create_users_batch(users: List[User]):
+    check_batch_size(users, USERS_BATCH_MAX_CREATE)
+    if shards is not None:
+        results = insert_users_sharded(users)
+    else:
+        with engine.begin() as conn:
+            results = insert_users_batch(conn, users)
+    response_cache.bump()
+    return batch_create_response(results, users)
+
+
+# 批次刪除使用者的 API：DELETE /users/batch（請求內容為名稱陣列）
+@app.delete("/users/batch")
+def delete_users_batch_endpoint(names: List[str]):
+    check_batch_size(names, USERS_BATCH_MAX_DELETE)
+    if shards is not None:
+        deleted = delete_users_sharded(names)
+    else:
+        with engine.begin() as conn:
+            deleted = delete_users_batch(conn, names)
+    response_cache.bump()
+    return batch_delete_response(deleted)
+
+
+# 建立 users 的查詢條件：以主鍵 id 做 keyset 分頁，並可依名稱前綴篩選
+def build_users_query(after_id=None, name=None, limit=None):
+    users = UserTable.__table__
+    query = select(users.c.id, users.c.name, users.c.age).order_by(users.c.id)
+    if after_id is not None:
+        query = query.where(users.c.id > after_id)
+    if name:
+        # 以範圍條件取代 LIKE，讓 SQLite 可以使用 name 索引
+        query = query.where(users.c.name >= name, users.c.name < name + "\U0010ffff")
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+# 以伺服器端游標逐批讀取使用者，並輸出成 NDJSON（每行一筆 JSON）
+def stream_users_ndjson(query):
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=USERS_STREAM_BATCH
+        ).execute(query)
+        for partition in result.partitions():
+            add_rows_read(len(partition))
+            yield "".join(
+                json.dumps(
+                    {"id": user_id, "name": name, "age": age}, ensure_ascii=False
+                )
+                + "\n"
+                for user_id, name, age in partition
+            )
+
+
+# 以伺服器端游標逐批讀取單一分片的查詢結果，逐筆產生 (分片內 id, name, age)
+def iter_shard_rows(shard, query, batch_size):
+    with shards.engines[shard].connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=batch_size
+        ).execute(query)
+        for partition in result.partitions():
+            add_rows_read(len(partition))
+            yield from partition
+
+
+# 分片模式：合併各分片的串流查詢（依全域 id 排序），每次產生最多 batch_size 筆 UserRow
+def iter_sharded_users(after_id=None, name=None, limit=None, batch_size=None):
+    batch_size = batch_size or USERS_STREAM_BATCH
+    streams = {
+        shard: iter_shard_rows(
+            shard,
+            build_users_query(shards.local_after(after_id, shard), name, limit),
+            batch_size,
+        )
+        for shard in range(shards.count)
+    }
+    rows = itertools.islice(shards.merge_rows(streams), limit)
+    while batch := list(itertools.islice(rows, batch_size)):
+        yield batch
+
+
+# 分片模式的 NDJSON 串流輸出
+def stream_sharded_users_ndjson(after_id=None, name=None, limit=None):
+    for batch in iter_sharded_users(after_id, name, limit):
+        yield "".join(
+            json.dumps(row._asdict(), ensure_ascii=False) + "\n" for row in batch
+        )
+
+
+# 讀取一頁使用者；分片模式下各分片平行查詢前 limit 筆，再依全域 id 合併取前 limit 筆
+def fetch_users_page(after_id, name, limit):
+    if shards is None:
+        with engine.connect() as conn:
+            return conn.execute(build_users_query(after_id, name, limit)).all()
+
+    def fetch(shard, shard_engine, _):
+        query = build_users_query(shards.local_after(after_id, shard), name, limit)
+        with shard_engine.connect() as conn:
+            return conn.execute(query).all()
+
+    return list(itertools.islice(shards.merge_rows(shards.run(fetch)), limit))
+
+
+# 可寫入的暫存緩衝區：pyarrow writer 寫入的位元組先累積在此，每個 batch 之後取出送給用戶端
+class ExportSink:
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# 以 Core 查詢逐批讀取 users，每批直接轉成欄式資料 (ids, names, ages)，不建立 ORM 物件
+def iter_user_columns(batch_rows=None):
+    batch_rows = batch_rows or EXPORT_BATCH_ROWS
+    if shards is not None:
+        # 分片模式：依全域 id 合併各分片的串流，id 欄位輸出全域 id
+        for batch in iter_sharded_users(batch_size=batch_rows):
+            yield tuple(map(list, zip(*batch)))
+        return
+    users = UserTable.__table__
+    query = select(users.c.id, users.c.name, users.c.age).order_by(users.c.id)
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=batch_rows
+        ).execute(query)
+        for partition in result.partitions():
+            add_rows_read(len(partition))
+            yield tuple(map(list, zip(*partition)))
+
+
+# 將 users 資料表串流匯出成 parquet、arrow（IPC stream）或 csv，邊讀取邊壓縮邊輸出
+# compression 為 None 時使用 EXPORT_COMPRESSION 中的預設值，"none" 代表不壓縮
+def export_users_stream(fmt, compression=None):
+    compression = compression or EXPORT_COMPRESSION[fmt]
+    if fmt == "csv":
+        # gzip 串流壓縮：每批資料以 pandas 轉成 CSV 文字後送入壓縮器
+        compressor = zlib.compressobj(wbits=31) if compression == "gzip" else None
+        header = True
+        for ids, names, ages in iter_user_columns():
+            text = pd.DataFrame({"id": ids, "name": names, "age": ages}).to_csv(
+                index=False, header=header
+            )
+            header = False
+            data = text.encode("utf-8")
+            yield compressor.compress(data) if compressor else data
+        if header:
+            # 資料表為空時仍輸出標題列
+            data = b"id,name,age\n"
+            yield compressor.compress(data) if compressor else data
+        if compressor:
+            yield compressor.flush()
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("id", pa.int64()), ("name", pa.string()), ("age", pa.int64())])
+    codec = None if compression == "none" else compression
+    sink = ExportSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression=codec or "none")
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=codec)
+        writer = pa.ipc.new_stream(sink, schema, options=options)
+
+    for ids, names, ages in iter_user_columns():
+        batch = pa.record_batch(
+            [
+                pa.array(ids, pa.int64()),
+                pa.array(names, pa.string()),
+                pa.array(ages, pa.int64()),
+            ],
+            schema=schema,
+        )
+        # Parquet 每個 batch 寫成一個 row group；Arrow 每個 batch 寫成一個 IPC 訊息
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+# 將一頁使用者資料整理成 API 回傳格式；若本頁已滿，最後一筆的 id 即為下一頁的游標
+def users_page_response(rows, limit):
+    next_after_id = rows[-1].id if len(rows) == limit else None
     # 回傳使用者清單（只包含 name 與 age）
-    return {"users": [{"name": user.name, "age": user.age} for user in users]}
+    return {
+        "users": [{"name": row.name, "age": row.age} for row in rows],
+        "next_after_id": next_after_id,
+    }
 
 
-# 上傳 CSV 檔案並匯入使用者資料：POST /upload_csv
-@app.post("/upload_csv")
-def upload_csv(file: UploadFile = File(...)):
+# 取得使用者的 API：GET /users
+# 以 after_id 游標分頁（回傳 next_after_id 供下一頁使用）；stream=true 時以 NDJSON 串流輸出
+# 非串流的回應會被快取，並帶有 ETag；If-None-Match 相符時直接回傳 304，不查詢資料庫
+@app.get("/users")
+def get_users(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=USERS_MAX_PAGE_SIZE),
+    after_id: Optional[int] = None,
+    name: Optional[str] = None,
+    stream: bool = False,
+):
+    if stream:
+        # 串流模式預設不限制筆數，記憶體用量固定
+        if shards is not None:
+            return StreamingResponse(
+                stream_sharded_users_ndjson(after_id, name, limit),
+                media_type="application/x-ndjson",
+            )
+        query = build_users_query(after_id, name, limit)
+        return StreamingResponse(
+            stream_users_ndjson(query), media_type="application/x-ndjson"
+        )
+
+    limit = limit or USERS_PAGE_SIZE
+    key = response_cache.key(
+        "/users", {"limit": limit, "after_id": after_id, "name": name}
+    )
+    etag = response_cache.etag(key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    body = response_cache.get(key)
+    if body is None:
+        rows = fetch_users_page(after_id, name, limit)
+        add_rows_read(len(rows))
+        body = users_page_response(rows, limit)
+        response_cache.set(key, body)
+    return body
+
+
+# 檢查格式所需的套件與壓縮方式，並建立串流回應（同步與非同步版本共用）
+def export_users_response(fmt, compression):
+    allowed = {
+        "parquet": {"zstd", "snappy", "gzip", "none"},
+        "arrow": {"zstd", "lz4", "none"},
+        "csv": {"gzip", "none"},
+    }
+    if compression is not None and compression not in allowed[fmt]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{fmt} 不支援壓縮方式 {compression}，可用：{sorted(allowed[fmt])}",
+        )
+    if fmt != "csv":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail=f"匯出 {fmt} 需要安裝 pyarrow")
+
+    compression = compression or EXPORT_COMPRESSION[fmt]
+    media_type, filename = {
+        "parquet": ("application/vnd.apache.parquet", "users.parquet"),
+        "arrow": ("application/vnd.apache.arrow.stream", "users.arrows"),
+        "csv": ("text/csv", "users.csv"),
+    }[fmt]
+    if fmt == "csv" and compression == "gzip":
+        media_type, filename = "application/gzip", "users.csv.gz"
+    return StreamingResponse(
+        export_users_stream(fmt, compression),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# 以欄式格式匯出整個 users 資料表：GET /users/export?format=parquet|arrow|csv
+# 資料以 record batch 為單位邊讀邊寫，記憶體用量只與 EXPORT_BATCH_ROWS 有關
+@app.get("/users/export")
+def export_users(
+    format: str = Query("parquet", pattern="^(parquet|arrow|csv)$"),
+    compression: Optional[str] = None,
+):
+    return export_users_response(format, compression)
+
+
+# 只讀取 CSV 標題列，檢查是否包含 Name 與 Age 欄位，讀取後回到檔案開頭
+def check_csv_columns(fileobj):
+    columns = pd.read_csv(fileobj, nrows=0, encoding="utf-8").columns
+    if "Name" not in columns or "Age" not in columns:
+        raise HTTPException(
+            status_code=400, detail="CSV 欄位名稱錯誤，請確保包含 'Name' 和 'Age'"
+        )
+    fileobj.seek(0)
+
+
+# 匯入一份檔案時已出現過的有效資料 (姓名, 年齡) 雜湊集合，用於跨批次判斷檔案內重複
+# 存放在 SQLite 的私有暫存資料庫（檔名為空字串）：超過頁面快取的部分寫到磁碟，
+# 記憶體用量只受 SEEN_ROWS_CACHE_KIB 限制，與檔案大小無關；close 時暫存檔自動刪除
+class SeenRows:
+    def __init__(self):
+        self._conn = sqlite3.connect("")
+        self._conn.execute(f"PRAGMA cache_size = -{SEEN_ROWS_CACHE_KIB}")
+        self._conn.execute("CREATE TABLE seen (hash INTEGER PRIMARY KEY)")
+
+    # hashes 為彼此不重複的 uint64 陣列；回傳每個雜湊先前是否已出現，並將全部加入集合
+    def check_and_add(self, hashes):
+        values = json.dumps(hashes.view("int64").tolist())
+        with self._conn:
+            found = self._conn.execute(
+                "SELECT hash FROM seen WHERE hash IN (SELECT value FROM json_each(?))",
+                (values,),
+            ).fetchall()
+            self._conn.execute(
+                "INSERT OR IGNORE INTO seen SELECT value FROM json_each(?)", (values,)
+            )
+        return np.isin(hashes.view("int64"), np.array(found, dtype="int64"))
+
+    def close(self):
+        self._conn.close()
+
+
+# 以整欄運算驗證一批 CSV 資料，回傳 (有效資料, 被拒絕資料與原因)
+# 依序檢查：姓名空白、年齡空白、年齡不是整數、年齡超出範圍、檔案內重複（姓名與年齡皆相同）
+# seen 為 SeenRows，記錄先前批次的有效資料，本批次的有效資料也會加入
+# first_row 為本批次第一列在檔案中的資料列編號（從 1 開始），用於報表定位
+def validate_users_frame(chunk, seen, first_row):
+    raw_names = chunk["Name"].str.strip().fillna("")
+    raw_ages = chunk["Age"].str.strip().fillna("")
+    names = raw_names.to_numpy(dtype=object)
+    ages = pd.to_numeric(raw_ages, errors="coerce").to_numpy(
+        dtype="float64", na_value=np.nan
+    )
+
+    missing_name = names == ""
+    missing_age = raw_ages.to_numpy(dtype=object) == ""
+    not_integer = np.isnan(ages) | (np.mod(ages, 1) != 0)
+    out_of_range = (ages < AGE_MIN) | (ages > AGE_MAX)
+    reason = np.select(
+        [missing_name, missing_age, not_integer, out_of_range],
+        ["missing_name", "missing_age", "age_not_integer", "age_out_of_range"],
+        default="",
+    )
+
+    # 以 (姓名, 年齡) 的雜湊值判斷重複：同批次內以 duplicated，跨批次查詢 seen
+    valid = reason == ""
+    hashes = pd.util.hash_pandas_object(
+        pd.DataFrame({"name": names, "age": np.where(valid, ages, 0)}), index=False
+    ).to_numpy()
+    duplicate = valid & pd.Series(np.where(valid, hashes, 0)).duplicated().to_numpy()
+    first_seen = valid & ~duplicate
+    duplicate[first_seen] = seen.check_and_add(hashes[first_seen])
+    reason = np.where(duplicate, "duplicate_in_file", reason)
+    valid = reason == ""
+
+    good = pd.DataFrame({"name": names[valid], "age": ages[valid].astype("int64")})
+    bad = pd.DataFrame(
+        {
+            "row": np.arange(first_row, first_row + len(chunk))[~valid],
+            "Name": chunk["Name"].to_numpy(dtype=object)[~valid],
+            "Age": chunk["Age"].to_numpy(dtype=object)[~valid],
+            "reason": reason[~valid],
+        }
+    )
+    return good, bad
+
+
+# 將被拒絕的資料附加寫入 CSV 報表（第一次寫入時加上標題列）
+def append_rejected_report(path, bad):
+    if bad.empty:
+        return
+    write_header = not os.path.exists(path)
+    bad.to_csv(path, mode="a", header=write_header, index=False, encoding="utf-8")
+
+
+# 在呼叫端的交易內寫入一批已驗證的使用者（name, age 欄位），並更新彙總表
+def write_users_frame(conn, frame):
+    rows = frame.to_dict("records")
+    if UNIQUE_USER_NAMES:
+        # 名稱唯一模式：以 UPSERT 寫入，重新匯入同一份檔案不會產生重複資料
+        upsert_users(conn, rows)
+        return
+    conn.execute(insert(UserTable), rows)
+    if AGE_STATS_MATERIALIZED:
+        # 以整欄運算計算本批次各組的年齡總和與人數
+        grouped = (
+            frame.assign(group=frame["name"].str[:1])
+            .groupby("group")["age"]
+            .agg(["sum", "count"])
+        )
+        bump_age_stats(conn, grouped.itertuples(name=None))
+
+
+# 分片模式：在單一分片的獨立交易中寫入屬於該分片的使用者
+def write_users_shard(shard, shard_engine, frame):
+    with shard_engine.begin() as conn:
+        write_users_frame(conn, frame)
+
+
+# 寫入一批已驗證的使用者，on_commit(conn) 會在主資料庫的同一個交易內被呼叫（用於提交進度）
+# 分片模式下各分片平行寫入自己的交易，進度隨後在主資料庫提交；
+# 兩者之間中斷時，續跑會重新寫入這一批（名稱唯一模式下 UPSERT 為冪等）
+def store_users_frame(good, on_commit=None):
+    if shards is not None:
+        if not good.empty:
+            shards.run(write_users_shard, shards.partition_frame(good, "name"))
+        if on_commit is not None:
+            with engine.begin() as conn:
+                on_commit(conn)
+    else:
+        # 每一批次使用獨立的交易，避免單一交易無限制成長
+        with engine.begin() as conn:
+            if not good.empty:
+                write_users_frame(conn, good)
+            if on_commit is not None:
+                on_commit(conn)
+    if not good.empty:
+        response_cache.bump()
+
+
+# 以串流方式分批讀取並驗證 CSV，依檔案順序產生每一批的 (有效資料, 被拒絕資料)
+# 記憶體用量只與 chunk_size 有關；skip_rows 用於續跑時略過已處理的資料列
+# 略過的資料列仍會驗證並記錄雜湊（不產生結果），續跑後與其重複的資料列一樣會被拒絕
+def iter_validated_chunks(fileobj, chunk_size=CSV_CHUNK_SIZE, skip_rows=0):
+    # 先只讀取標題列檢查欄位名稱，再回到檔案開頭進行分批解析
+    check_csv_columns(fileobj)
+
+    seen = SeenRows()
+    try:
+        reader = pd.read_csv(
+            fileobj,
+            usecols=["Name", "Age"],
+            dtype={"Name": "string", "Age": "string"},
+            chunksize=chunk_size,
+            encoding="utf-8",
+        )
+        next_row = 1
+        for chunk in reader:
+            skip = min(max(skip_rows - next_row + 1, 0), len(chunk))
+            if skip:
+                validate_users_frame(chunk.iloc[:skip], seen, next_row)
+                chunk = chunk.iloc[skip:]
+                next_row += skip
+            if chunk.empty:
+                continue
+            # 以整欄方式驗證並切分有效與被拒絕的資料
+            good, bad = validate_users_frame(chunk, seen, next_row)
+            next_row += len(chunk)
+            yield good, bad
+    finally:
+        seen.close()
+
+
+# 以串流方式分批讀取 CSV，並將每一批資料以單一 INSERT（executemany）寫入資料庫
+# 回傳 (成功匯入筆數, 被拒絕筆數)，記憶體用量只與 chunk_size 有關，與檔案大小無關
+# skip_rows 用於續跑時略過已處理的資料列；on_chunk(conn, inserted, rejected)
+# 會在每一批次的同一個交易內被呼叫，讓進度與資料一起提交
+# rejected_path 指定時，被拒絕的資料列與原因會附加寫入該 CSV 報表
+def import_csv_stream(
+    fileobj, chunk_size=CSV_CHUNK_SIZE, skip_rows=0, on_chunk=None, rejected_path=None
+):
+    inserted = 0
+    rejected = 0
+    for good, bad in iter_validated_chunks(fileobj, chunk_size, skip_rows):
+        if not good.empty or on_chunk is not None:
+            store_users_frame(
+                good,
+                on_chunk and (lambda conn: on_chunk(conn, len(good), len(bad))),
+            )
+        if rejected_path:
+            append_rejected_report(rejected_path, bad)
+        inserted += len(good)
+        rejected += len(bad)
+
+    return inserted, rejected
+
+
+# 子行程用來回傳解析結果的佇列，由行程池的 initializer 設定
+_parsed_chunks = None
+
+
+def set_parsed_chunks_queue(chunks):
+    global _parsed_chunks
+    _parsed_chunks = chunks
+
+
+# 子行程執行：分批解析並驗證 CSV，每一批以 ("chunk", key, 有效資料, 被拒絕資料, 已讀取位元組數)
+# 放入佇列，結束時放入 ("done", key, 錯誤訊息或 None)；佇列已滿時等待寫入端取出，不會累積整份檔案
+def parse_csv_file(key, path, chunk_size=CSV_CHUNK_SIZE, skip_rows=0):
+    try:
+        with open(path, "rb") as f:
+            for good, bad in iter_validated_chunks(f, chunk_size, skip_rows):
+                _parsed_chunks.put(("chunk", key, good, bad, f.tell()))
+    except HTTPException as e:
+        _parsed_chunks.put(("done", key, str(e.detail)))
+    except Exception as e:
+        _parsed_chunks.put(("done", key, str(e)))
+    else:
+        _parsed_chunks.put(("done", key, None))
+
+
+# 以行程池平行解析多份 CSV，解析結果由呼叫端這一個執行緒依序寫入（SQLite 同時只允許一個寫入者）
+# tasks 為 [(key, 檔案路徑, skip_rows, 被拒絕報表路徑或 None)]
+# 每一批寫入時在同一個交易內呼叫 on_chunk(conn, key, inserted, rejected, bytes_processed)，
+# 每份檔案結束時呼叫 on_file(key, error)；回傳 {key: (匯入筆數, 拒絕筆數)}
+# 子行程經由最多 workers * 2 批的佇列交出結果，記憶體用量只與 chunk_size 有關，與檔案大小無關
+def ingest_csv_files(
+    tasks, workers=None, chunk_size=CSV_CHUNK_SIZE, on_chunk=None, on_file=None
+):
+    tasks = list(tasks)
+    if not tasks:
+        return {}
+    workers = min(workers or INGEST_WORKERS, len(tasks))
+    pending = iter(tasks)
+    # 以 spawn 啟動子行程：fork 會複製服務行程中的資料庫連線池與背景執行緒的狀態
+    context = multiprocessing.get_context("spawn")
+    chunks = context.Queue(maxsize=workers * 2)
+    totals = {}
+    errors = {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=set_parsed_chunks_queue,
+        initargs=(chunks,),
+    ) as pool:
+        running = {}  # key: (future, 被拒絕報表路徑)
+
+        # 每個子行程解析一份檔案，完成一份再交給它下一份
+        def submit_next():
+            task = next(pending, None)
+            if task is not None:
+                key, path, skip_rows, rejected_path = task
+                future = pool.submit(parse_csv_file, key, path, chunk_size, skip_rows)
+                running[key] = (future, rejected_path)
+                totals[key] = (0, 0)
+
+        def finish(key, error):
+            running.pop(key)
+            if on_file is not None:
+                on_file(key, errors.pop(key, None) or error)
+            submit_next()
+
+        for _ in range(workers):
+            submit_next()
+        while running:
+            try:
+                message = chunks.get(timeout=1)
+            except queue.Empty:
+                # 子行程異常結束（例如被系統終止）時不會送出結束訊息
+                for key, (future, _) in list(running.items()):
+                    if future.done() and future.exception() is not None:
+                        finish(key, str(future.exception()))
+                continue
+            kind, key = message[:2]
+            if key not in running:
+                continue
+            if kind == "done":
+                finish(key, message[2])
+                continue
+            _, _, good, bad, offset = message
+            if key in errors:
+                continue  # 寫入已失敗的檔案，略過其餘的批次
+            try:
+                store_users_frame(
+                    good,
+                    on_chunk
+                    and (lambda conn: on_chunk(conn, key, len(good), len(bad), offset)),
+                )
+                if running[key][1]:
+                    append_rejected_report(running[key][1], bad)
+            except Exception as e:
+                errors[key] = str(e)
+                continue
+            inserted, rejected = totals[key]
+            totals[key] = (inserted + len(good), rejected + len(bad))
+    return totals
+
+
+# 匯入工作的被拒絕資料報表路徑
+def rejected_report_path(job_id):
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{job_id}.rejected.csv")
+
+
+# 刪除逾期的被拒絕資料報表：所屬工作已結束超過保留期限，或工作紀錄已不存在
+# 尚未結束的工作（報表仍在寫入或等待續跑）一律保留；回傳刪除的報表數量
+def prune_rejected_reports(now=None, batch_size=500):
+    suffix = ".rejected.csv"
+    if not os.path.isdir(UPLOAD_SPOOL_DIR):
+        return 0
+    job_ids = [
+        name[: -len(suffix)]
+        for name in os.listdir(UPLOAD_SPOOL_DIR)
+        if name.endswith(suffix)
+    ]
+    cutoff = (now or time.time()) - REJECTED_REPORT_RETENTION
+    jobs = ImportJob.__table__
+    keep = set()
+    with engine.connect() as conn:
+        # 分批查詢，避免 IN 的參數數量超過 SQLite 的上限
+        for start in range(0, len(job_ids), batch_size):
+            batch = job_ids[start : start + batch_size]
+            keep.update(
+                conn.execute(
+                    select(jobs.c.id).where(
+                        jobs.c.id.in_(batch),
+                        (jobs.c.finished_at.is_(None)) | (jobs.c.finished_at > cutoff),
+                    )
+                ).scalars()
+            )
+    removed = 0
+    for job_id in job_ids:
+        if job_id not in keep:
+            try:
+                os.remove(rejected_report_path(job_id))
+                removed += 1
+            except FileNotFoundError:
+                pass  # 其他工作結束時已同時清除
+    return removed
+
+
+# 將匯入工作的狀態轉成 API 回傳格式，並計算處理速度與預估剩餘時間
+def job_to_dict(job):
+    now = job.finished_at or time.time()
+    elapsed = now - job.started_at if job.started_at else 0.0
+    rows_processed = job.rows_inserted + job.rows_rejected
+    throughput = rows_processed / elapsed if elapsed > 0 else 0.0
+
+    eta = None
+    if job.status == "running" and job.bytes_processed:
+        remaining = max(job.bytes_total - job.bytes_processed, 0)
+        eta = round(elapsed * remaining / job.bytes_processed, 2)
+    elif job.status == "done":
+        eta = 0.0
+
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "rows_processed": rows_processed,
+        "rows_inserted": job.rows_inserted,
+        "rows_rejected": job.rows_rejected,
+        "bytes_total": job.bytes_total,
+        "bytes_processed": job.bytes_processed,
+        "rows_per_second": round(throughput, 2),
+        "eta_seconds": eta,
+        "error": job.error,
+        "rejected_report": (
+            f"/jobs/{job.id}/rejected"
+            if os.path.exists(rejected_report_path(job.id))
+            else None
+        ),
+    }
+
+
+# 為已寫入暫存資料夾的 CSV 建立一筆排隊中的匯入工作
+def new_import_job(job_id, filename, spool_path):
+    return ImportJob(
+        id=job_id,
+        filename=filename,
+        spool_path=spool_path,
+        status="queued",
+        bytes_total=os.path.getsize(spool_path),
+        created_at=time.time(),
+    )
+
+
+# 背景執行單一匯入工作：從暫存檔分批匯入，並在每批次提交時更新進度
+def run_import_job(job_id):
+    with SessionLocal() as db:
+        job = db.get(ImportJob, job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return
+        # 續跑時從上次已提交的列數之後開始
+        skip_rows = job.rows_inserted + job.rows_rejected
+        spool_path = job.spool_path
+        job.status = "running"
+        job.started_at = job.started_at or time.time()
+        db.commit()
+
+    jobs = ImportJob.__table__
     try:
-        # 將檔案內容讀取並解碼成 UTF-8 字串
-        content = file.file.read().decode("utf-8")
+        with open(spool_path, "rb") as f:
 
-        # 使用 pandas 解析 CSV 內容為 DataFrame
-        data = pd.read_csv(io.StringIO(content))
+            def on_chunk(conn, inserted, rejected):
+                conn.execute(
+                    update(jobs)
+                    .where(jobs.c.id == job_id)
+                    .values(
+                        rows_inserted=jobs.c.rows_inserted + inserted,
+                        rows_rejected=jobs.c.rows_rejected + rejected,
+                        bytes_processed=f.tell(),
+                    )
+                )
 
-        # 檢查是否包含正確欄位名稱
-        if "Name" not in data.columns or "Age" not in data.columns:
-            raise HTTPException(
-                status_code=400, detail="CSV 欄位名稱錯誤，請確保包含 'Name' 和 'Age'"
+            import_csv_stream(
+                f,
+                skip_rows=skip_rows,
+                on_chunk=on_chunk,
+                rejected_path=rejected_report_path(job_id),
             )
+        error = None
+    except Exception as e:
+        error = str(e)
+    finish_import_job(job_id, spool_path, error)
+
 
-        db = SessionLocal()
-        # 逐列插入每一筆使用者資料
-        for _, row in data.iterrows():
-            db_user = UserTable(name=row["Name"], age=int(row["Age"]))
-            db.add(db_user)
+# 將匯入工作標記為完成或失敗，並刪除暫存檔
+def finish_import_job(job_id, spool_path, error=None):
+    jobs = ImportJob.__table__
+    if error is None:
+        values = {"status": "done", "bytes_processed": jobs.c.bytes_total}
+    else:
+        values = {"status": "failed", "error": error}
+    values["finished_at"] = time.time()
+    with engine.begin() as conn:
+        conn.execute(update(jobs).where(jobs.c.id == job_id).values(**values))
+    # 工作結束後刪除暫存檔，並順帶清除逾期的被拒絕資料報表
+    if os.path.exists(spool_path):
+        os.remove(spool_path)
+    prune_rejected_reports()
+
+
+# 背景執行一組匯入工作：由行程池平行解析各檔案，本執行緒作為唯一的寫入者依完成順序寫入
+# 每一批寫入與工作進度在同一個交易內提交，中斷後仍可由 resume_import_jobs 逐一續跑
+def run_import_batch(job_ids):
+    tasks = []
+    spool_paths = {}
+    with SessionLocal() as db:
+        for job_id in job_ids:
+            job = db.get(ImportJob, job_id)
+            if job is None or job.status not in ("queued", "running"):
+                continue
+            skip_rows = job.rows_inserted + job.rows_rejected
+            tasks.append(
+                (job_id, job.spool_path, skip_rows, rejected_report_path(job_id))
+            )
+            spool_paths[job_id] = job.spool_path
+            job.status = "running"
+            job.started_at = job.started_at or time.time()
         db.commit()
-        db.close()
 
-        return {"message": "CSV file processed"}  # 回傳成功訊息
+    jobs = ImportJob.__table__
+
+    def on_chunk(conn, job_id, inserted, rejected, bytes_processed):
+        conn.execute(
+            update(jobs)
+            .where(jobs.c.id == job_id)
+            .values(
+                rows_inserted=jobs.c.rows_inserted + inserted,
+                rows_rejected=jobs.c.rows_rejected + rejected,
+                bytes_processed=bytes_processed,
+            )
+        )
+
+    def on_file(job_id, error):
+        finish_import_job(job_id, spool_paths[job_id], error)
+
+    ingest_csv_files(tasks, on_chunk=on_chunk, on_file=on_file)
+
+
+# 重新排入尚未完成（queued 或 running）的匯入工作，用於服務重啟後續跑
+def resume_import_jobs():
+    with SessionLocal() as db:
+        pending = (
+            db.query(ImportJob.id)
+            .filter(ImportJob.status.in_(["queued", "running"]))
+            .order_by(ImportJob.created_at)
+            .all()
+        )
+    for (job_id,) in pending:
+        import_executor.submit(run_import_job, job_id)
+
+
+# 上傳 CSV 檔案並建立背景匯入工作：POST /upload_csv
+@app.post("/upload_csv")
+def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    spool_path = None
+    try:
+        # 以固定大小的區塊將上傳檔案寫入暫存資料夾，不將整份檔案載入記憶體
+        os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+        with open(spool_path, "wb") as out:
+            shutil.copyfileobj(file.file, out, length=1024 * 1024)
+
+        # 先檢查標題列，欄位錯誤時立即回報而不建立工作
+        with open(spool_path, "rb") as f:
+            check_csv_columns(f)
+
+        db.add(new_import_job(job_id, file.filename, spool_path))
+        db.commit()
+
+        # 交由背景執行緒池匯入，立即回傳工作編號
+        import_executor.submit(run_import_job, job_id)
+        return {"message": "CSV file queued", "job_id": job_id, "status": "queued"}
 
     except Exception as e:
         # 發生任何錯誤則回傳 HTTP 400 與錯誤內容
+        if spool_path and os.path.exists(spool_path):
+            os.remove(spool_path)
         raise HTTPException(status_code=400, detail=f"解析 CSV 失敗: {str(e)}")
 
 
-# 計算平均年齡（依照名稱第一個字分組）：GET /average_age
-@app.get("/average_age")
-def average_age():
-    db = SessionLocal()
-    users = db.query(UserTable).all()  # 查詢所有使用者
-    db.close()
+# 展開上傳的 zip：每個 .csv 成員另存為獨立的暫存檔，zip 本身在展開後刪除
+# spooled 為 [(工作編號, 原始檔名, 暫存路徑)]，逐一產生相同格式的 CSV 暫存檔
+def expand_csv_uploads(spooled):
+    for job_id, filename, path in spooled:
+        if not zipfile.is_zipfile(path):
+            yield job_id, filename, path
+            continue
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not member.filename.lower().endswith(".csv"):
+                    continue
+                member_id = uuid.uuid4().hex
+                member_path = os.path.join(UPLOAD_SPOOL_DIR, f"{member_id}.csv")
+                with archive.open(member) as src, open(member_path, "wb") as out:
+                    shutil.copyfileobj(src, out, length=1024 * 1024)
+                yield member_id, f"{filename}/{member.filename}", member_path
+        os.remove(path)
 
-    if not users:
-        return {"message": "No users to calculate average"}  # 若無使用者則回傳提示訊息
 
-    # 將使用者資料轉為 pandas DataFrame
-    df = pd.DataFrame([{"name": u.name, "age": u.age} for u in users])
+# 檢查每份暫存 CSV 的標題列，為有效的檔案建立匯入工作並交由背景批次匯入（同步與非同步版本共用）
+# 標題列錯誤的檔案不建立工作，在回應的 errors 中逐一列出；沒有任何有效檔案時回傳 400
+def queue_csv_batch(spooled):
+    jobs, errors = [], []
+    for job_id, filename, path in expand_csv_uploads(spooled):
+        try:
+            with open(path, "rb") as f:
+                check_csv_columns(f)
+        except Exception as e:
+            errors.append(
+                {"filename": filename, "detail": getattr(e, "detail", str(e))}
+            )
+            os.remove(path)
+            continue
+        jobs.append(new_import_job(job_id, filename, path))
+    if not jobs:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "沒有可匯入的 CSV 檔案", "errors": errors},
+        )
+
+    with SessionLocal() as db:
+        db.add_all(jobs)
+        db.commit()
+        queued = [{"job_id": job.id, "filename": job.filename} for job in jobs]
+
+    # 單一背景執行緒負責寫入，解析交由行程池平行處理
+    import_executor.submit(run_import_batch, [job["job_id"] for job in queued])
+    return {
+        "message": f"{len(queued)} CSV file(s) queued",
+        "jobs": [{**job, "status": "queued"} for job in queued],
+        "errors": errors,
+    }
+
+
+# 一次上傳多個 CSV 或內含 CSV 的 zip，每份 CSV 建立一個匯入工作：POST /upload_csv/batch
+@app.post("/upload_csv/batch")
+def upload_csv_batch(files: List[UploadFile] = File(...)):
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    spooled = []
+    for file in files:
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+        with open(spool_path, "wb") as out:
+            shutil.copyfileobj(file.file, out, length=1024 * 1024)
+        spooled.append((job_id, file.filename, spool_path))
+    try:
+        return queue_csv_batch(spooled)
+    except zipfile.BadZipFile as e:
+        for _, _, spool_path in spooled:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+        raise HTTPException(status_code=400, detail=f"解析 zip 失敗: {str(e)}")
+
+
+# 查詢所有匯入工作（最新的在前）：GET /jobs
+@app.get("/jobs")
+def list_jobs(limit: int = 20, db: Session = Depends(get_db)):
+    jobs = db.query(ImportJob).order_by(ImportJob.created_at.desc()).limit(limit).all()
+    return {"jobs": [job_to_dict(job) for job in jobs]}
+
+
+# 查詢單一匯入工作的進度：GET /jobs/{job_id}
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到匯入工作")
+    return job_to_dict(job)
+
+
+# 下載匯入工作中被拒絕的資料列與原因：GET /jobs/{job_id}/rejected
+@app.get("/jobs/{job_id}/rejected")
+def get_job_rejected(job_id: str, db: Session = Depends(get_db)):
+    if db.get(ImportJob, job_id) is None:
+        raise HTTPException(status_code=404, detail="找不到匯入工作")
+    path = rejected_report_path(job_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="此匯入工作沒有被拒絕的資料")
+    return FileResponse(path, media_type="text/csv", filename=f"{job_id}.rejected.csv")
+
 
-    # 根據使用者名稱的第一個字母分組
-    df["group"] = df["name"].apply(lambda x: x[0])
+# Prometheus 文字格式的效能指標：GET /metrics
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(
+        metrics_registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+# 建立依名稱第一個字分組的平均年齡查詢，回傳 (組別, 平均年齡) 列
+def build_average_age_query():
+    if AGE_STATS_MATERIALIZED:
+        # 直接讀取彙總表，只需處理 O(組數) 筆資料
+        stats = AgeStats.__table__
+        return (
+            select(stats.c.group_key, stats.c.age_sum * 1.0 / stats.c.user_count)
+            .where(stats.c.user_count > 0)
+            .order_by(stats.c.group_key)
+        )
+    # 在 SQL 端以名稱第一個字分組並計算平均，不將使用者載入 Python
+    users = UserTable.__table__
+    group = func.substr(users.c.name, 1, 1)
+    return select(group, func.avg(users.c.age)).group_by(group).order_by(group)
+
+
+# 建立可跨分片合併的分組彙總查詢，回傳 (組別, 年齡總和, 人數) 列
+def build_age_totals_query():
+    if AGE_STATS_MATERIALIZED:
+        stats = AgeStats.__table__
+        return select(stats.c.group_key, stats.c.age_sum, stats.c.user_count).where(
+            stats.c.user_count > 0
+        )
+    users = UserTable.__table__
+    group = func.substr(users.c.name, 1, 1)
+    return select(group, func.sum(users.c.age), func.count()).group_by(group)
+
+
+# 讀取 (組別, 平均年齡) 列；分片模式下各分片平行計算總和與人數，合併後再求平均
+def fetch_average_age_rows():
+    if shards is None:
+        with engine.connect() as conn:
+            return conn.execute(build_average_age_query()).all()
+
+    def fetch(shard, shard_engine, _):
+        with shard_engine.connect() as conn:
+            return conn.execute(build_age_totals_query()).all()
+
+    totals = {}
+    for rows in shards.run(fetch).values():
+        for group, age_sum, count in rows:
+            total_sum, total_count = totals.get(group, (0, 0))
+            totals[group] = (total_sum + age_sum, total_count + count)
+    return [(group, s / c) for group, (s, c) in sorted(totals.items())]
+
+
+# 將分組平均年齡整理成 API 回傳格式
+def average_age_response(rows):
+    if not rows:
+        return {"message": "No users to calculate average"}  # 若無使用者則回傳提示訊息
 
     # 計算每一組的平均年齡，四捨五入至小數點第二位
-    result = df.groupby("group")["age"].mean().round(2).to_dict()
+    result = {group: round(avg, 2) for group, avg in rows}
 
     return {"average_age_by_group": result}  # 回傳分組平均年齡字典
+
+
+# 計算平均年齡（依照名稱第一個字分組）：GET /average_age
+@app.get("/average_age")
+def average_age(request: Request, response: Response):
+    key = response_cache.key("/average_age")
+    etag = response_cache.etag(key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    body = response_cache.get(key)
+    if body is None:
+        rows = fetch_average_age_rows()
+        add_rows_read(len(rows))
+        body = average_age_response(rows)
+        response_cache.set(key, body)
+    return body
@@ -0,0 +1,360 @@
+# main.py 的非同步版本：以 aiosqlite 與 AsyncSession 處理資料庫 I/O，handler 全部為 async def
+# 啟動時選擇版本：
+#   uvicorn main:app        （同步版本，handler 在 Starlette 執行緒池中執行）
+#   uvicorn main_async:app  （非同步版本，handler 直接在事件迴圈中執行）
+# 兩個版本共用同一個 SQLite 資料庫、資料表定義與背景匯入工作
+
+# 匯入 FastAPI 框架、檔案上傳與錯誤處理相關模組
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Depends
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import json
+import os
+import uuid
+import zipfile
+
+# 匯入 SQLAlchemy 的非同步資料庫工具
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+# 匯入同步版本的資料表、設定與共用的查詢邏輯
+from main import (
+    DATABASE_URL,
+    USERS_PAGE_SIZE,
+    USERS_MAX_PAGE_SIZE,
+    USERS_STREAM_BATCH,
+    USERS_BATCH_MAX_CREATE,
+    USERS_BATCH_MAX_DELETE,
+    User,
+    UserTable,
+    ImportJob,
+    apply_sqlite_profile,
+    build_users_query,
+    build_average_age_query,
+    users_page_response,
+    average_age_response,
+    response_cache,
+    bump_age_stats,
+    upsert_users,
+    insert_users_batch,
+    delete_users_batch,
+    check_batch_size,
+    batch_create_response,
+    batch_delete_response,
+    check_csv_columns,
+    new_import_job,
+    queue_csv_batch,
+    job_to_dict,
+    export_users_response,
+    rejected_report_path,
+    run_import_job,
+    prune_rejected_reports,
+    resume_import_jobs,
+    import_executor,
+    rebuild_age_stats,
+    ensure_unique_name_index,
+    metrics_registry,
+    profiler,
+)
+import main
+from response_cache import etag_matches
+from metrics import MetricsMiddleware, add_rows_read, instrument_engine
+
+# 將同步的 SQLite 連線字串轉為 aiosqlite 驅動
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+# 建立非同步資料庫引擎
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+# 非同步引擎的每條新連線同樣套用 SQLite 參數組合
+event.listen(async_engine.sync_engine, "connect", apply_sqlite_profile)
+
+# 非同步引擎的查詢同樣計入效能指標
+instrument_engine(async_engine.sync_engine, metrics_registry)
+
+# 建立非同步 session 工具
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+
+# 提供給 FastAPI Depends 的非同步 session 產生器
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# 應用程式啟動時與同步版本相同：重建彙總表並續跑未完成的匯入工作
+# users 分片模式（USER_SHARDS > 1）目前只由同步版本提供，非同步版本啟動時直接拒絕
+@asynccontextmanager
+async def lifespan(app):
+    if main.shards is not None:
+        raise RuntimeError("USER_SHARDS > 1 的分片模式請使用 uvicorn main:app 啟動")
+    if main.UNIQUE_USER_NAMES:
+        ensure_unique_name_index()
+    if main.AGE_STATS_MATERIALIZED:
+        rebuild_age_stats()
+    prune_rejected_reports()
+    resume_import_jobs()
+    if profiler is not None:
+        profiler.start()
+    yield
+    if profiler is not None:
+        profiler.stop()
+    await async_engine.dispose()
+
+
+# 建立 FastAPI 應用實例，並掛上效能指標 middleware
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, registry=metrics_registry, profiler=profiler)
+
+
+# 建立單筆使用者的 API：POST /user
+@app.post("/user")
+async def create_user(user: User, db: AsyncSession = Depends(get_async_db)):
+    if main.UNIQUE_USER_NAMES:
+        # 名稱唯一模式：同名使用者已存在時改為更新年齡
+        conn = await db.connection()
+        old_ages = await conn.run_sync(upsert_users, [user.model_dump()])
+        await db.commit()
+        response_cache.bump()
+        message = "User updated" if user.name in old_ages else "User added"
+        return {"message": message, "user": user}
+
+    db.add(UserTable(name=user.name, age=user.age))
+    if main.AGE_STATS_MATERIALIZED:
+        # 與新增使用者在同一個交易內更新彙總表
+        conn = await db.connection()
+        await conn.run_sync(bump_age_stats, [(user.name[:1], user.age, 1)])
+    await db.commit()
+    response_cache.bump()  # 讓使用者相關的快取失效
+    return {"message": "User added", "user": user}
+
+
+# 刪除指定使用者名稱的 API：DELETE /user/{name}
+@app.delete("/user/{name}")
+async def delete_user(name: str, db: AsyncSession = Depends(get_async_db)):
+    users = UserTable.__table__
+    if main.AGE_STATS_MATERIALIZED:
+        # 刪除前先取得被刪除者的年齡總和與人數，從彙總表中扣除
+        result = await db.execute(
+            select(func.coalesce(func.sum(users.c.age), 0), func.count()).where(
+                users.c.name == name
+            )
+        )
+        age_sum, count = result.one()
+        conn = await db.connection()
+        await conn.run_sync(bump_age_stats, [(name[:1], -age_sum, -count)])
+    result = await db.execute(users.delete().where(users.c.name == name))
+    await db.commit()
+    response_cache.bump()
+    return {"message": f"Deleted {result.rowcount} user(s) named {name}"}
+
+
+# 批次新增使用者的 API：POST /users/batch
+@app.post("/users/batch")
+async def create_users_batch(users: List[User]):
+    check_batch_size(users, USERS_BATCH_MAX_CREATE)
+    async with async_engine.begin() as conn:
+        results = await conn.run_sync(insert_users_batch, users)
+    response_cache.bump()
+    return batch_create_response(results, users)
+
+
+# 批次刪除使用者的 API：DELETE /users/batch（請求內容為名稱陣列）
+@app.delete("/users/batch")
+async def delete_users_batch_endpoint(names: List[str]):
+    check_batch_size(names, USERS_BATCH_MAX_DELETE)
+    async with async_engine.begin() as conn:
+        deleted = await conn.run_sync(delete_users_batch, names)
+    response_cache.bump()
+    return batch_delete_response(deleted)
+
+
+# 以非同步游標逐批讀取使用者，並輸出成 NDJSON（每行一筆 JSON）
+async def stream_users_ndjson(query):
+    async with async_engine.connect() as conn:
+        result = await conn.stream(
+            query.execution_options(yield_per=USERS_STREAM_BATCH)
+        )
+        async for partition in result.partitions():
+            add_rows_read(len(partition))
+            yield "".join(
+                json.dumps(
+                    {"id": user_id, "name": name, "age": age}, ensure_ascii=False
+                )
+                + "\n"
+                for user_id, name, age in partition
+            )
+
+
+# 取得使用者的 API：GET /users（參數、快取與回傳格式與同步版本相同）
+@app.get("/users")
+async def get_users(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=USERS_MAX_PAGE_SIZE),
+    after_id: Optional[int] = None,
+    name: Optional[str] = None,
+    stream: bool = False,
+):
+    if stream:
+        query = build_users_query(after_id, name, limit)
+        return StreamingResponse(
+            stream_users_ndjson(query), media_type="application/x-ndjson"
+        )
+
+    limit = limit or USERS_PAGE_SIZE
+    key = response_cache.key(
+        "/users", {"limit": limit, "after_id": after_id, "name": name}
+    )
+    etag = response_cache.etag(key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    body = response_cache.get(key)
+    if body is None:
+        async with async_engine.connect() as conn:
+            result = await conn.execute(build_users_query(after_id, name, limit))
+            rows = result.all()
+        add_rows_read(len(rows))
+        body = users_page_response(rows, limit)
+        response_cache.set(key, body)
+    return body
+
+
+# 以欄式格式匯出整個 users 資料表：GET /users/export?format=parquet|arrow|csv
+# 匯出產生器為同步程式，由 StreamingResponse 在執行緒池中逐批執行，不會阻塞事件迴圈
+@app.get("/users/export")
+async def export_users(
+    format: str = Query("parquet", pattern="^(parquet|arrow|csv)$"),
+    compression: Optional[str] = None,
+):
+    return export_users_response(format, compression)
+
+
+# 以固定大小的區塊非同步讀取上傳檔案，寫入暫存檔的檔案 I/O 在執行緒池中執行，不阻塞事件迴圈
+async def spool_upload(file, spool_path):
+    out = await run_in_threadpool(open, spool_path, "wb")
+    try:
+        while block := await file.read(1024 * 1024):
+            await run_in_threadpool(out.write, block)
+    finally:
+        await run_in_threadpool(out.close)
+
+
+# 檢查暫存 CSV 的標題列（同步讀檔，由執行緒池呼叫）
+def check_spooled_columns(spool_path):
+    with open(spool_path, "rb") as f:
+        check_csv_columns(f)
+
+
+# 上傳 CSV 檔案並建立背景匯入工作：POST /upload_csv
+@app.post("/upload_csv")
+async def upload_csv(
+    file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)
+):
+    spool_path = None
+    try:
+        # 上傳檔案寫入暫存資料夾
+        os.makedirs(main.UPLOAD_SPOOL_DIR, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(main.UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+        await spool_upload(file, spool_path)
+
+        # 先檢查標題列，欄位錯誤時立即回報而不建立工作
+        await run_in_threadpool(check_spooled_columns, spool_path)
+
+        db.add(new_import_job(job_id, file.filename, spool_path))
+        await db.commit()
+
+        # 匯入本身是 CPU 與寫入密集的工作，交由共用的背景執行緒池處理
+        import_executor.submit(run_import_job, job_id)
+        return {"message": "CSV file queued", "job_id": job_id, "status": "queued"}
+
+    except Exception as e:
+        # 發生任何錯誤則回傳 HTTP 400 與錯誤內容
+        if spool_path and os.path.exists(spool_path):
+            os.remove(spool_path)
+        raise HTTPException(status_code=400, detail=f"解析 CSV 失敗: {str(e)}")
+
+
+# 一次上傳多個 CSV 或內含 CSV 的 zip，每份 CSV 建立一個匯入工作：POST /upload_csv/batch
+@app.post("/upload_csv/batch")
+async def upload_csv_batch(files: List[UploadFile] = File(...)):
+    os.makedirs(main.UPLOAD_SPOOL_DIR, exist_ok=True)
+    spooled = []
+    for file in files:
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(main.UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+        await spool_upload(file, spool_path)
+        spooled.append((job_id, file.filename, spool_path))
+    try:
+        # 解壓 zip 與建立工作（同步的檔案與資料庫 I/O）在執行緒池中執行
+        return await run_in_threadpool(queue_csv_batch, spooled)
+    except zipfile.BadZipFile as e:
+        for _, _, spool_path in spooled:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+        raise HTTPException(status_code=400, detail=f"解析 zip 失敗: {str(e)}")
+
+
+# 查詢所有匯入工作（最新的在前）：GET /jobs
+@app.get("/jobs")
+async def list_jobs(limit: int = 20, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(ImportJob).order_by(ImportJob.created_at.desc()).limit(limit)
+    )
+    return {"jobs": [job_to_dict(job) for job in result.scalars()]}
+
+
+# 查詢單一匯入工作的進度：GET /jobs/{job_id}
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    job = await db.get(ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到匯入工作")
+    return job_to_dict(job)
+
+
+# 下載匯入工作中被拒絕的資料列與原因：GET /jobs/{job_id}/rejected
+@app.get("/jobs/{job_id}/rejected")
+async def get_job_rejected(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    if await db.get(ImportJob, job_id) is None:
+        raise HTTPException(status_code=404, detail="找不到匯入工作")
+    path = rejected_report_path(job_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="此匯入工作沒有被拒絕的資料")
+    return FileResponse(path, media_type="text/csv", filename=f"{job_id}.rejected.csv")
+
+
+# Prometheus 文字格式的效能指標：GET /metrics
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(
+        metrics_registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+# 計算平均年齡（依照名稱第一個字分組）：GET /average_age
+@app.get("/average_age")
+async def average_age(request: Request, response: Response):
+    key = response_cache.key("/average_age")
+    etag = response_cache.etag(key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    body = response_cache.get(key)
+    if body is None:
+        async with async_engine.connect() as conn:
+            result = await conn.execute(build_average_age_query())
+            rows = result.all()
+        add_rows_read(len(rows))
+        body = average_age_response(rows)
+        response_cache.set(key, body)
+    return body
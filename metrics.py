@@ -0,0 +1,250 @@
+# 請求層級的效能指標與取樣分析器
+# - MetricsMiddleware：ASGI middleware，記錄每個路由的延遲直方圖、資料庫查詢次數與時間、讀寫列數
+# - instrument_engine：以 SQLAlchemy 的 before/after_cursor_execute 事件統計查詢
+# - MetricsRegistry.render()：輸出 Prometheus 文字格式，供 GET /metrics 使用
+# - SamplingProfiler：選用的取樣分析器，慢請求會輸出可直接給 flamegraph.pl 使用的 folded stacks
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+# 延遲直方圖的桶邊界（秒）
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 沒有請求上下文時（例如背景匯入工作）的查詢歸屬名稱
+BACKGROUND_ROUTE = "background"
+
+# 目前請求的統計資料；sync handler 在執行緒池中執行時 contextvar 會被複製，但指向同一個物件
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+# 單一請求期間累積的資料庫統計
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.threads = {threading.get_ident()}  # 處理此請求的執行緒，供取樣分析器篩選
+
+
+# 固定桶邊界的累積直方圖
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+# 所有指標的儲存處，以 lock 保護跨執行緒更新
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}  # (method, route, status) -> Histogram
+        self.db = {}  # route -> [查詢次數, 查詢秒數, 讀取列數, 寫入列數]
+
+    def observe_request(self, method, route, status, seconds, stats):
+        with self._lock:
+            key = (method, route, str(status))
+            self.latency.setdefault(key, Histogram()).observe(seconds)
+            self._add_db(route, stats.queries, stats.query_seconds)
+            self._add_rows(route, stats.rows_read, stats.rows_written)
+
+    # 沒有請求上下文的查詢直接累加到 background
+    def observe_background_query(self, seconds, rows_written):
+        with self._lock:
+            self._add_db(BACKGROUND_ROUTE, 1, seconds)
+            self._add_rows(BACKGROUND_ROUTE, 0, rows_written)
+
+    def _add_db(self, route, queries, seconds):
+        totals = self.db.setdefault(route, [0, 0.0, 0, 0])
+        totals[0] += queries
+        totals[1] += seconds
+
+    def _add_rows(self, route, rows_read, rows_written):
+        totals = self.db.setdefault(route, [0, 0.0, 0, 0])
+        totals[2] += rows_read
+        totals[3] += rows_written
+
+    # 輸出 Prometheus 文字格式（exposition format 0.0.4）
+    def render(self):
+        lines = [
+            "# HELP http_request_duration_seconds HTTP 請求延遲",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (method, route, status), hist in sorted(self.latency.items()):
+                labels = f'method="{method}",route="{route}",status="{status}"'
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(
+                        f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {hist.count}'
+                )
+                lines.append(
+                    f"http_request_duration_seconds_sum{{{labels}}} {hist.total}"
+                )
+                lines.append(
+                    f"http_request_duration_seconds_count{{{labels}}} {hist.count}"
+                )
+
+            db_metrics = [
+                ("db_queries_total", "資料庫查詢次數", 0),
+                ("db_query_duration_seconds_total", "資料庫查詢累計秒數", 1),
+                ("db_rows_read_total", "讀取的資料列數", 2),
+                ("db_rows_written_total", "寫入的資料列數", 3),
+            ]
+            for name, help_text, index in db_metrics:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for route, totals in sorted(self.db.items()):
+                    lines.append(f'{name}{{route="{route}"}} {totals[index]}')
+        return "\n".join(lines) + "\n"
+
+
+# 在 handler 中回報讀取的列數（SQLite 游標無法在查詢事件中得知 SELECT 的列數）
+def add_rows_read(count):
+    stats = current_request.get()
+    if stats is not None:
+        stats.rows_read += count
+
+
+# 為 SQLAlchemy 引擎註冊查詢事件，統計次數、時間與寫入列數
+def instrument_engine(engine, registry):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        is_select = statement.lstrip()[:6].upper() == "SELECT"
+        written = 0 if is_select else max(cursor.rowcount, 0)
+
+        stats = current_request.get()
+        if stats is None:
+            registry.observe_background_query(seconds, written)
+            return
+        stats.queries += 1
+        stats.query_seconds += seconds
+        stats.rows_written += written
+        stats.threads.add(threading.get_ident())
+
+    # 查詢失敗時不會觸發 after_cursor_execute，需移除 before_cursor_execute 推入的開始時間
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        conn = context.connection
+        if context.execution_context is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+# 選用的取樣分析器：背景執行緒定期擷取各執行緒的呼叫堆疊
+# 請求超過 slow_ms 時，將該請求期間、處理該請求之執行緒的樣本寫成 folded stacks 檔案
+class SamplingProfiler:
+    def __init__(self, slow_ms, output_dir, interval=0.005, max_samples=50_000):
+        self.slow_ms = slow_ms
+        self.output_dir = output_dir
+        self.interval = interval
+        self._samples = deque(maxlen=max_samples)  # (時間, 執行緒 id, folded stack)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                self._samples.append((now, thread_id, ";".join(reversed(stack))))
+
+    # 請求結束時呼叫；若為慢請求則輸出 folded stacks 並回傳檔案路徑
+    def request_finished(self, route, start, end, stats):
+        if (end - start) * 1000 < self.slow_ms:
+            return None
+        folded = {}
+        for timestamp, thread_id, stack in list(self._samples):
+            if start <= timestamp <= end and thread_id in stats.threads:
+                folded[stack] = folded.get(stack, 0) + 1
+        if not folded:
+            return None
+        safe_route = (
+            route.strip("/").replace("/", "_").replace("{", "").replace("}", "")
+        )
+        elapsed_ms = int((end - start) * 1000)
+        filename = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_route or 'root'}_{elapsed_ms}ms"
+        )
+        path = os.path.join(self.output_dir, filename + ".folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(folded.items()):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+# ASGI middleware：以路由樣板（例如 /user/{name}）為標籤記錄每個 HTTP 請求
+class MetricsMiddleware:
+    def __init__(self, app, registry, profiler=None):
+        self.app = app
+        self.registry = registry
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            current_request.reset(token)
+            # 使用路由樣板避免標籤數量隨路徑參數無限增加
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.registry.observe_request(
+                scope["method"], route, status, end - start, stats
+            )
+            if self.profiler is not None:
+                self.profiler.request_finished(route, start, end, stats)
@@ -1,10 +1,12 @@
 # 匯入相關套件
-import requests
-from bs4 import BeautifulSoup
-from langchain.docstore.document import Document
-from langchain.text_splitter import CharacterTextSplitter
+import crawler
+import crawl_state
+import rag_index
+import rag_embeddings
+import rag_qa
+import rag_chunker
+import argparse
 from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 from langchain_community.chat_models import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
@@ -14,41 +16,26 @@ import os
 OPENAI_API_KEY = ""
 
 # === 第一步：爬取網站文章 ===
-def crawl_articles():
-    url = "https://technews.tw/"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    res = requests.get(url, headers=headers)
-    soup = BeautifulSoup(res.text, "html.parser")
-
-    # 取得文章標題與連結
-    links = soup.select("h1.entry-title a")
-    articles = []
-    for link in links[:5]:  # 只抓前5篇
-        title = link.text.strip()
-        href = link['href']
-        article = get_article_content(href)
-        articles.append(title + "\n" + article)
-    return articles
+# 由 crawler.py 的非同步爬蟲並行抓取（共用連線池、逾時與重試，並會翻頁）
+# 回傳 crawler.Article（網址、標題、正文），向量庫以網址與內容雜湊判斷是否需要重新嵌入
+# 抓取狀態存放在 crawl_state.CRAWL_STATE_PATH：未變更的文章只需一個 304 回應，近似重複的文章不會進入向量庫
+def crawl_articles(max_pages=crawler.CRAWL_MAX_PAGES, max_articles=crawler.CRAWL_MAX_ARTICLES):
+    with crawl_state.CrawlState() as state:
+        articles = crawler.crawl_documents(max_pages=max_pages, max_articles=max_articles, state=state)
+        return state.drop_duplicates(articles)
 
 # === 第二步：抓取文章內容 ===
 def get_article_content(url):
-    try:
-        res = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-        soup = BeautifulSoup(res.text, "html.parser")
-        # 抓正文內容
-        content = soup.select_one("div.entry-content")
-        return content.get_text(strip=True).replace("\n", "")[:1000]  # 限制字數避免太長
-    except Exception as e:
-        return ""
+    return crawler.fetch_articles([("", url)])[0].lstrip("\n")
 
-# === 第三步：切片並建立向量資料庫 ===
+# === 第三步：切片並更新向量資料庫 ===
+# 向量庫存放在 rag_index.INDEX_DIR，只嵌入新增或變更的文章，並移除已不存在的文章
+# 嵌入模型由 RAG_EMBEDDING_BACKEND 選擇（openai / hashing / sentence-transformers），並經過嵌入快取
+# 切片依 token 數並保留段落與標題（RAG_CHUNK_TOKENS / RAG_CHUNK_OVERLAP），RAG_CHUNK_WORKERS 設定並行切片的行程數
 def build_vector_db(articles):
-    docs = [Document(page_content=a) for a in articles]
-    splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    split_docs = splitter.split_documents(docs)
-
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)  # 傳入 API key
-    vectordb = FAISS.from_documents(split_docs, embeddings)
+    splitter = rag_chunker.TokenChunker()
+    embeddings = rag_embeddings.create_embeddings(api_key=OPENAI_API_KEY)  # 傳入 API key
+    vectordb = rag_index.sync_vector_db(articles, embeddings, splitter)
     return vectordb
 
 # === 第四步：建立問答系統 ===
@@ -61,7 +48,8 @@ def create_qa_chain(vectordb):
     return qa_chain
 
 # === 第五步：主流程 ===
-def main():
+# questions_file 指定時進入批次模式：一次檢索所有問題並並行呼叫 LLM，印出答案後結束
+def main(questions_file=None):
     print("📥 開始爬取最新技術新聞...")
     articles = crawl_articles()
     print(f"✅ 成功抓取 {len(articles)} 篇文章")
@@ -71,13 +59,25 @@ def main():
 
     print("🤖 問答機器人已就緒！請輸入你的問題：")
     qa = create_qa_chain(vectordb)
+    # 答案快取綁定目前的索引版本，向量庫更新後舊答案自動失效
+    cache = rag_qa.AnswerCache(version=rag_index.index_version())
+
+    if questions_file:
+        questions = rag_qa.read_questions(questions_file)
+        results = rag_qa.answer_batch(qa, vectordb, cache, questions)
+        for question, (answer, source) in zip(questions, results):
+            print(f"📌 {question}\n💡 AI 回答（{source}）：{answer}\n")
+        return
 
     while True:
         query = input("📌 問題（輸入 'exit' 離開）：")
         if query.lower() == "exit":
             break
-        answer = qa.run(query)
-        print("💡 AI 回答：", answer)
+        answer, source = rag_qa.answer_question(qa, vectordb, cache, query)
+        print("💡 AI 回答：", answer, "（快取）" if source != "llm" else "")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="TechNews 問答機器人")
+    parser.add_argument("--questions", help="批次模式：每行一個問題的文字檔")
+    args = parser.parse_args()
+    main(args.questions)
@@ -0,0 +1,186 @@
+# rag_bot 的文章切片：依 token 數切片並保留文章結構（rag_index.sync_vector_db 使用）
+# - 文章正文由 crawler.clean_content 轉成每個區塊（段落、標題、清單項目）一行，標題以 # 開頭
+# - 盡量以整個段落組成片段；段落太長時依句子切開，單一句子仍太長時才依長度硬切
+# - 遇到新的標題就開始新的片段（前一段太短時併入），片段不在開頭時補上所屬的標題作為上下文
+# - 相鄰片段重疊 overlap_tokens 以內的結尾段落或句子
+# - 每個片段的 metadata 加上 offset（片段在文章文字中的字元位置）與 chunk（文章中的第幾個片段）
+# 安裝 tiktoken 時以實際的 tokenizer 計算 token 數，否則以字元規則估算（每個中日韓字、英文單字或標點算一個）
+#
+# 用法：
+#   splitter = TokenChunker(chunk_tokens=400, overlap_tokens=50)
+#   docs = splitter.split_documents([Document(page_content=article.text, metadata={...})])
+import math
+import os
+import re
+from collections import namedtuple
+
+from langchain_core.documents import Document
+
+try:
+    import tiktoken
+except ImportError:  # 選用套件
+    tiktoken = None
+
+# 每個片段的最多 token 數與相鄰片段重疊的 token 數
+CHUNK_TOKENS = int(os.environ.get("RAG_CHUNK_TOKENS", 400))
+CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", 50))
+
+# tiktoken 的編碼（OpenAI 嵌入模型使用 cl100k_base）
+TOKEN_ENCODING = os.environ.get("RAG_TOKEN_ENCODING", "cl100k_base")
+
+# 沒有 tiktoken 時估算 token 數的規則（長單字每 8 個字母算一個）
+CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+TOKEN_PATTERN = re.compile(rf"[{CJK}]|[^\W\d_{CJK}]{{1,8}}|\d{{1,3}}|[^\w\s]")
+
+# 句子：到句末標點（含其後的引號、括號與空白）或行尾為止
+SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?；;]+[」』”’）)\]]*\s*|\.\s+|$)")
+
+# 標題行（crawler.clean_content 以 # 標記 h1 ~ h6）
+HEADING_PATTERN = re.compile(r"#{1,6} ")
+
+# 片段的組成單位：在文章文字中的範圍、token 數、是否為標題，以及所屬的標題與其 token 數
+Unit = namedtuple(
+    "Unit", ["start", "end", "tokens", "heading", "section", "section_tokens"]
+)
+
+
+# 依 token 數切片並保留段落與標題的切片器；可序列化，能傳給 rag_index.split_articles 的子行程
+class TokenChunker:
+    def __init__(
+        self,
+        chunk_tokens=CHUNK_TOKENS,
+        overlap_tokens=CHUNK_OVERLAP,
+        encoding=TOKEN_ENCODING,
+    ):
+        if not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("overlap_tokens 必須介於 0 與 chunk_tokens 之間")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding = encoding
+        # 遇到新標題時，前一段短於此 token 數就併入下一段而不單獨成為片段
+        self.min_tokens = chunk_tokens // 4
+        self._encoder = None
+
+    # 切片設定的名稱；設定不同時 rag_index 會重新切片所有文章
+    @property
+    def name(self):
+        counter = self.encoding if tiktoken is not None else "estimate"
+        return f"tokens-{counter}-{self.chunk_tokens}-{self.overlap_tokens}"
+
+    # tokenizer 在各行程中延遲載入，不隨切片器序列化
+    def __getstate__(self):
+        return {**self.__dict__, "_encoder": None}
+
+    # 文字的 token 數
+    def count(self, text):
+        if tiktoken is None:
+            return len(TOKEN_PATTERN.findall(text))
+        if self._encoder is None:
+            self._encoder = tiktoken.get_encoding(self.encoding)
+        return len(self._encoder.encode(text, disallowed_special=()))
+
+    # 將 [start, end) 的文字依長度硬切成約 limit 個 token 的範圍，盡量在空白處切開
+    def _hard_split(self, text, start, end, tokens, limit):
+        step = math.ceil((end - start) / math.ceil(tokens / limit))
+        piece = start
+        while piece < end:
+            stop = min(piece + step, end)
+            if stop < end:
+                space = text.rfind(" ", piece + 1, stop)
+                if space != -1:
+                    stop = space + 1
+            yield piece, stop
+            piece = stop
+
+    # 將文章文字拆成片段的組成單位：每行一個單位，加上所屬標題後超過 chunk_tokens 的行依句子拆開
+    def units(self, text):
+        section, section_tokens = None, 0
+        for line in re.finditer(r"[^\n]+", text):
+            if not line.group().strip():
+                continue
+            tokens = self.count(line.group())
+            if HEADING_PATTERN.match(line.group()):
+                section, section_tokens = line.group(), tokens
+                yield Unit(line.start(), line.end(), tokens, True, section, tokens)
+                continue
+            limit = max(self.chunk_tokens - section_tokens, 1)
+            if tokens <= limit:
+                spans = [(line.start(), line.end(), tokens)]
+            else:
+                spans = []
+                for sentence in SENTENCE_PATTERN.finditer(line.group()):
+                    start = line.start() + sentence.start()
+                    end = line.start() + sentence.end()
+                    tokens = self.count(sentence.group())
+                    if tokens <= limit:
+                        spans.append((start, end, tokens))
+                        continue
+                    for piece in self._hard_split(text, start, end, tokens, limit):
+                        spans.append((*piece, self.count(text[slice(*piece)])))
+            for start, end, tokens in spans:
+                yield Unit(start, end, tokens, False, section, section_tokens)
+
+    # 前一個片段結尾要重疊到下一個片段的單位（不含標題，也不會是整個片段）
+    def _overlap(self, current):
+        carried, size = [], 0
+        for unit in reversed(current[1:]):
+            if unit.heading or size + unit.tokens > self.overlap_tokens:
+                break
+            carried.insert(0, unit)
+            size += unit.tokens
+        return carried
+
+    # 片段的 token 數（不以標題開頭時包含補上的標題）
+    @staticmethod
+    def _size(current):
+        size = sum(unit.tokens for unit in current)
+        if current and not current[0].heading:
+            size += current[0].section_tokens
+        return size
+
+    # 將文章文字切片，回傳 [(片段在文字中的字元位置, 片段文字), ...]
+    def split_with_offsets(self, text):
+        chunks, current = [], []
+
+        def emit():
+            first = current[0]
+            raw = text[first.start : current[-1].end]
+            chunk = raw.strip()
+            offset = first.start + len(raw) - len(raw.lstrip())
+            if not first.heading and first.section is not None:
+                chunk = f"{first.section}\n{chunk}"
+            chunks.append((offset, chunk))
+
+        for unit in self.units(text):
+            body = sum(u.tokens for u in current if not u.heading)
+            if unit.heading:
+                # 新的段落標題：前一段夠長時結束片段，標題不與上一段的內容重疊
+                if body >= self.min_tokens:
+                    emit()
+                    current = []
+            elif body and self._size(current + [unit]) > self.chunk_tokens:
+                emit()
+                current = self._overlap(current)
+                while current and self._size(current + [unit]) > self.chunk_tokens:
+                    current.pop(0)
+            current.append(unit)
+        if current and (not chunks or any(not u.heading for u in current)):
+            emit()
+        return chunks
+
+    # 與 langchain 的 TextSplitter 相同的介面：回傳片段文字清單
+    def split_text(self, text):
+        return [chunk for _, chunk in self.split_with_offsets(text)]
+
+    # 切片多個 Document，片段沿用原本的 metadata 並加上 offset 與 chunk
+    def split_documents(self, documents):
+        return [
+            Document(
+                page_content=chunk,
+                metadata={**doc.metadata, "offset": offset, "chunk": index},
+            )
+            for doc in documents
+            for index, (offset, chunk) in enumerate(
+                self.split_with_offsets(doc.page_content)
+            )
+        ]
@@ -0,0 +1,209 @@
+# rag_bot 的嵌入模型與嵌入快取
+# - CachedEmbeddings：以「模型名稱 + 片段文字」的雜湊為鍵，將向量存放在 SQLite，相同文字不會重複呼叫嵌入 API；
+#   超過筆數上限時依最後使用時間淘汰（LRU）；未命中的文字依 batch_size 分批送出
+# - HashingEmbeddings：純 numpy 的字元 n-gram 雜湊向量，不需網路與模型檔，可離線建立索引
+# - SentenceTransformerEmbeddings：選用的本機 sentence-transformers 模型
+#
+# 用法：
+#   embeddings = create_embeddings("hashing")              離線
+#   embeddings = create_embeddings("openai", api_key=...)  OpenAI，並經過快取
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 嵌入模型後端：openai / hashing / sentence-transformers，可由環境變數切換
+EMBEDDING_BACKEND = os.environ.get("RAG_EMBEDDING_BACKEND", "openai")
+
+# 每次送給嵌入模型的片段數量
+EMBEDDING_BATCH_SIZE = int(os.environ.get("RAG_EMBEDDING_BATCH_SIZE", 64))
+
+# 嵌入快取的 SQLite 檔案與筆數上限；路徑設為空字串時停用快取
+EMBEDDING_CACHE_PATH = os.environ.get("RAG_EMBEDDING_CACHE", "./rag_embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# 本機模型的預設設定
+HASHING_DIM = 1024
+HASHING_NGRAMS = (1, 2, 3)
+SENTENCE_TRANSFORMER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# SQLite 單一查詢的參數數量上限
+SQLITE_MAX_PARAMS = 500
+
+
+# 依大小切成多批
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+# 字元 n-gram 的雜湊向量（hashing trick）：以字元切分，中文不需斷詞；向量經 L2 正規化
+class HashingEmbeddings(Embeddings):
+    def __init__(self, dim=HASHING_DIM, ngrams=HASHING_NGRAMS):
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+        self.model = f"hashing-{dim}-{'-'.join(map(str, self.ngrams))}"
+
+    def _embed(self, text):
+        text = " ".join(text.lower().split())
+        vector = np.zeros(self.dim, dtype="float32")
+        for n in self.ngrams:
+            for start in range(len(text) - n + 1):
+                digest = hashlib.blake2b(
+                    text[start : start + n].encode("utf-8"), digest_size=8
+                ).digest()
+                value = int.from_bytes(digest, "little")
+                # 以最高位元決定正負號，降低雜湊碰撞造成的偏差
+                vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+# 本機 sentence-transformers 模型（需另外安裝 sentence-transformers）
+class SentenceTransformerEmbeddings(Embeddings):
+    def __init__(self, model_name=SENTENCE_TRANSFORMER_MODEL, batch_size=None):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = model_name
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        self._model = SentenceTransformer(model_name)
+
+    def embed_documents(self, texts):
+        vectors = self._model.encode(
+            list(texts), batch_size=self.batch_size, normalize_embeddings=True
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+# 以 SQLite 存放的內容定址嵌入快取，包裝任何 langchain Embeddings
+class CachedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        inner,
+        path=EMBEDDING_CACHE_PATH,
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        batch_size=None,
+    ):
+        self.inner = inner
+        self.model = getattr(inner, "model", None) or type(inner).__name__
+        self.max_entries = max_entries
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_last_used "
+            "ON embeddings (last_used)"
+        )
+
+    # 快取鍵：模型名稱與文字的 SHA-256，不同模型的向量不會混用
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    # 分批查詢快取並更新命中項目的最後使用時間，回傳 {鍵: 向量}
+    def _lookup(self, keys):
+        found = {}
+        with self._lock, self._conn:
+            for batch in batched(keys, SQLITE_MAX_PARAMS):
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(
+                    (key, np.frombuffer(blob, dtype="float32").tolist())
+                    for key, blob in rows
+                )
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+        return found
+
+    # 寫入新向量，超過上限時刪除最久未使用的項目
+    def _store(self, vectors):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) "
+                "VALUES (?, ?, ?)",
+                [
+                    (key, np.asarray(vector, dtype="float32").tobytes(), now)
+                    for key, vector in vectors.items()
+                ],
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    # 相同文字只嵌入一次：先查快取，未命中的文字去除重複後依 batch_size 分批嵌入
+    def embed_documents(self, texts):
+        keys = [self.key(text) for text in texts]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        items = list(missing.items())
+        for batch in batched(items, self.batch_size):
+            vectors = self.inner.embed_documents([text for _, text in batch])
+            new = {key: vector for (key, _), vector in zip(batch, vectors)}
+            self._store(new)
+            cached.update(new)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def close(self):
+        self._conn.close()
+
+
+# 依後端名稱建立嵌入模型，並在設定了快取路徑時包上嵌入快取
+def create_embeddings(
+    backend=None, api_key=None, cache_path=None, batch_size=None, **options
+):
+    backend = backend or EMBEDDING_BACKEND
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    if backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        inner = OpenAIEmbeddings(openai_api_key=api_key, chunk_size=batch_size)
+    elif backend == "hashing":
+        inner = HashingEmbeddings(**options)
+    elif backend == "sentence-transformers":
+        inner = SentenceTransformerEmbeddings(batch_size=batch_size, **options)
+    else:
+        raise ValueError(f"未知的嵌入模型後端：{backend}")
+
+    cache_path = EMBEDDING_CACHE_PATH if cache_path is None else cache_path
+    if not cache_path:
+        return inner
+    return CachedEmbeddings(inner, cache_path, batch_size=batch_size)
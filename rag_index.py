@@ -0,0 +1,432 @@
+# rag_bot 的持久化 FAISS 向量庫：以 save_local / load_local 存放在磁碟，並以 manifest 記錄每篇文章
+# - manifest.json：{網址: {"hash": 內容雜湊, "ids": [docstore 中該文章各片段的 id]}} 與嵌入模型名稱
+# - 啟動時只嵌入新增或內容變更的文章（add_documents），已不存在的文章以 delete 移除
+# - 沒有任何變更時只需載入索引，不會呼叫嵌入 API
+# - 索引類型可設定（RAG_INDEX_TYPE）：flat（精確搜尋）/ ivf / hnsw / ivfpq（近似搜尋，適合百萬片段以上）
+#   IVF 類型以隨機抽樣的向量訓練；向量數量不足以訓練時先使用 flat，數量足夠後自動重建
+#   搜尋參數 nprobe / efSearch 於載入時設定；RAG_INDEX_MMAP=1 時以記憶體映射載入（沒有變更時）
+# - 片段的 metadata 包含 source（網址）、hash、title，以及切片器加上的欄位（rag_chunker 的 offset 與 chunk）
+#   manifest 記錄切片器的設定（splitter），設定變更時所有文章重新切片；變更的文章很多時以行程池並行切片
+#
+# 用法：
+#   vectordb = sync_vector_db(articles, embeddings, splitter)   articles 為 crawler.Article 清單
+#   vectordb = sync_vector_db(articles, embeddings, splitter, index_type="hnsw")
+#   python bench_rag_index.py --vectors 1000000   比較各索引類型的召回率與延遲
+import hashlib
+import json
+import math
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+# 向量庫與 manifest 的存放資料夾
+INDEX_DIR = "./rag_index"
+MANIFEST_FILE = "manifest.json"
+
+# 索引類型：flat / ivf / hnsw / ivfpq
+INDEX_TYPE = os.environ.get("RAG_INDEX_TYPE", "flat")
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+# IVF 的分群數（0 代表依向量數量自動決定，約 4 * sqrt(n)）與搜尋時檢查的分群數
+IVF_NLIST = int(os.environ.get("RAG_IVF_NLIST", 0))
+IVF_NPROBE = int(os.environ.get("RAG_IVF_NPROBE", 16))
+
+# HNSW 每個節點的鄰居數、建立與搜尋時的候選數
+HNSW_M = int(os.environ.get("RAG_HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("RAG_HNSW_EF_CONSTRUCTION", 128))
+HNSW_EF_SEARCH = int(os.environ.get("RAG_HNSW_EF_SEARCH", 64))
+
+# PQ 的子向量數（必須整除向量維度）與每個子向量的位元數
+PQ_M = int(os.environ.get("RAG_PQ_M", 16))
+PQ_BITS = 8
+
+# 訓練時每個分群至少需要的向量數（faiss 建議 39），抽樣時每個分群取的向量數，與值得使用 IVF 的最少分群數
+MIN_POINTS_PER_CENTROID = 39
+TRAIN_POINTS_PER_CENTROID = 64
+MIN_NLIST = 16
+
+# 並行切片的行程數（0 代表在目前的行程中切片），以及值得啟動行程池的最少變更文章數
+CHUNK_WORKERS = int(os.environ.get("RAG_CHUNK_WORKERS", 0))
+PARALLEL_CHUNK_MIN = 32
+
+# 是否以記憶體映射載入索引（多個行程可共用同一份頁面快取，啟動時不必整份讀入記憶體）
+INDEX_MMAP = os.environ.get("RAG_INDEX_MMAP") == "1"
+
+
+# 文章內容的雜湊值，用來判斷文章是否變更
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# 嵌入模型的名稱；模型不同時向量無法混用，必須整份重建
+def embedding_model_name(embeddings):
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+# 切片器設定的名稱；設定不同時片段無法沿用，必須重新切片
+def splitter_name(splitter):
+    return getattr(splitter, "name", None) or type(splitter).__name__
+
+
+# 讀取 manifest，不存在時回傳空的 manifest
+def load_manifest(index_dir=INDEX_DIR):
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"embedding_model": None, "index": None, "articles": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# 先寫入暫存檔再取代，避免中斷時留下寫到一半的 manifest
+def save_manifest(manifest, index_dir=INDEX_DIR):
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# 索引版本：由嵌入模型與各文章的內容雜湊計算，索引內容有任何變更時版本就不同（答案快取以此失效）
+def index_version(index_dir=INDEX_DIR):
+    manifest = load_manifest(index_dir)
+    state = {
+        "embedding_model": manifest["embedding_model"],
+        "index": manifest.get("index"),
+        "splitter": manifest.get("splitter"),
+        "articles": {url: entry["hash"] for url, entry in manifest["articles"].items()},
+    }
+    return hashlib.sha256(
+        json.dumps(state, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+# 由索引中各片段的 metadata（source 與 hash）重建 manifest，用於 manifest 遺失或與索引不一致時
+def manifest_from_index(vectordb, model):
+    articles = {}
+    for doc_id in vectordb.index_to_docstore_id.values():
+        metadata = vectordb.docstore.search(doc_id).metadata
+        entry = articles.setdefault(
+            metadata["source"], {"hash": metadata["hash"], "ids": []}
+        )
+        entry["ids"].append(doc_id)
+    return {"embedding_model": model, "index": None, "articles": articles}
+
+
+# 索引類型的建立參數，會記錄在 manifest 中；參數變更時整份重建（搜尋參數不影響索引內容，不列入）
+def index_settings(index_type=None):
+    index_type = index_type or INDEX_TYPE
+    if index_type == "flat":
+        return {"type": "flat"}
+    if index_type == "ivf":
+        return {"type": "ivf", "nlist": IVF_NLIST}
+    if index_type == "hnsw":
+        return {"type": "hnsw", "m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+    if index_type == "ivfpq":
+        return {"type": "ivfpq", "nlist": IVF_NLIST, "pq_m": PQ_M, "pq_bits": PQ_BITS}
+    raise ValueError(f"未知的索引類型：{index_type}（可用：{', '.join(INDEX_TYPES)}）")
+
+
+# 舊版 manifest 沒有記錄索引類型，當時一律是 flat
+def manifest_settings(manifest):
+    return manifest.get("index") or index_settings("flat")
+
+
+# 由 faiss 索引物件判斷索引類型
+def index_kind(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+# 依向量數量決定 IVF 的分群數，並確保每個分群有足夠的訓練向量
+def ivf_nlist(count, settings):
+    nlist = settings["nlist"] or int(4 * math.sqrt(count))
+    return min(nlist, count // MIN_POINTS_PER_CENTROID)
+
+
+# 向量數量是否足以訓練此索引類型；不足時改用 flat
+def can_train(count, settings):
+    if settings["type"] not in ("ivf", "ivfpq"):
+        return True
+    if ivf_nlist(count, settings) < MIN_NLIST:
+        return False
+    if settings["type"] == "ivfpq":
+        return count >= MIN_POINTS_PER_CENTROID * 2 ** settings["pq_bits"]
+    return True
+
+
+# 設定搜尋參數：IVF 檢查的分群數與 HNSW 的搜尋候選數，數值越大召回率越高、延遲越長
+def tune_index(index, nprobe=None, ef_search=None):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or IVF_NPROBE, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+    return index
+
+
+# 建立空的 faiss 索引，需要訓練的類型以隨機抽樣的向量訓練；向量不足以訓練時回傳 flat 索引
+def create_index(vectors, settings, seed=0):
+    count, dim = vectors.shape
+    kind = settings["type"] if can_train(count, settings) else "flat"
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, settings["m"])
+        index.hnsw.efConstruction = settings["ef_construction"]
+    elif kind in ("ivf", "ivfpq"):
+        nlist = ivf_nlist(count, settings)
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+            centroids = nlist
+        else:
+            if dim % settings["pq_m"]:
+                raise ValueError(
+                    f"PQ 子向量數 {settings['pq_m']} 必須整除向量維度 {dim}"
+                )
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, nlist, settings["pq_m"], settings["pq_bits"]
+            )
+            centroids = max(nlist, 2 ** settings["pq_bits"])
+        sample = min(count, TRAIN_POINTS_PER_CENTROID * centroids)
+        rows = np.random.default_rng(seed).choice(count, sample, replace=False)
+        index.train(vectors[np.sort(rows)])
+    else:
+        index = faiss.IndexFlatL2(dim)
+    return tune_index(index)
+
+
+# 索引是否能直接刪除向量：HNSW 不支援刪除，IVF 刪除後留下的編號空缺與 FAISS 向量庫依位置對應 docstore 的方式不相容
+def supports_remove(index):
+    return index_kind(index) == "flat"
+
+
+# 以片段向量建立 FAISS 向量庫；未指定 index 時依設定建立並訓練新的索引
+def build_vector_store(vectors, docs, ids, embeddings, settings, index=None):
+    if index is None:
+        index = create_index(vectors, settings)
+    vectordb = FAISS(embeddings, index, InMemoryDocstore(), {})
+    add_vectors(vectordb, vectors, docs, ids)
+    return vectordb
+
+
+# 將已嵌入的片段加入向量庫
+def add_vectors(vectordb, vectors, docs, ids):
+    vectordb.add_embeddings(
+        zip([doc.page_content for doc in docs], vectors),
+        metadatas=[doc.metadata for doc in docs],
+        ids=ids,
+    )
+
+
+# 取出向量庫中各位置的原始向量；PQ 壓縮過的向量有失真，改以嵌入模型（經嵌入快取）重新計算
+def stored_vectors(vectordb):
+    index = vectordb.index
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    if index_kind(index) == "ivfpq":
+        texts = [
+            vectordb.docstore.search(vectordb.index_to_docstore_id[i]).page_content
+            for i in range(index.ntotal)
+        ]
+        return embed_texts(vectordb.embeddings, texts)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+# 以嵌入模型計算文字的向量，回傳 float32 矩陣
+def embed_texts(embeddings, texts):
+    return np.asarray(embeddings.embed_documents(texts), dtype="float32")
+
+
+# 重建整份向量庫：保留未移除的片段並加上新片段
+# retrain=True 時依目前的設定重新建立並訓練索引，否則沿用原索引已訓練好的分群與編碼（清空後重新加入）
+def rebuild_vector_db(vectordb, stale_ids, vectors, docs, ids, settings, retrain=True):
+    stale = set(stale_ids)
+    keep = [
+        (position, doc_id)
+        for position, doc_id in sorted(vectordb.index_to_docstore_id.items())
+        if doc_id not in stale
+    ]
+    kept_vectors = stored_vectors(vectordb)[[position for position, _ in keep]]
+    all_docs = [vectordb.docstore.search(doc_id) for _, doc_id in keep] + docs
+    all_ids = [doc_id for _, doc_id in keep] + ids
+    all_vectors = np.vstack([kept_vectors, vectors])
+    index = None
+    if not retrain:
+        index = tune_index(faiss.clone_index(vectordb.index))
+        index.reset()
+    return build_vector_store(
+        all_vectors, all_docs, all_ids, vectordb.embeddings, settings, index
+    )
+
+
+# 是否需要整份重建：索引參數變更，或先前因向量不足而使用 flat、現在已可訓練設定的類型
+def needs_rebuild(vectordb, manifest, settings, count):
+    if manifest_settings(manifest) != settings:
+        return True
+    return index_kind(vectordb.index) != settings["type"] and can_train(count, settings)
+
+
+# 將一篇文章切片成帶有 source、hash 與 title metadata 的 Document，並為每個片段產生 id
+def split_article(article, digest, splitter):
+    docs = splitter.split_documents(
+        [
+            Document(
+                page_content=article.text,
+                metadata={
+                    "source": article.url,
+                    "hash": digest,
+                    "title": article.title,
+                },
+            )
+        ]
+    )
+    return docs, [uuid.uuid4().hex for _ in docs]
+
+
+# 行程池中切片一篇文章（參數打包成一個 tuple 以便 executor.map 使用）
+def split_job(job):
+    return split_article(*job)
+
+
+# 切片多篇文章 [(文章, 雜湊), ...]，依輸入順序回傳 [(片段, id), ...]
+# 文章數達到 PARALLEL_CHUNK_MIN 且 workers > 1 時以行程池並行切片（切片器必須可序列化）
+def split_articles(items, splitter, workers=CHUNK_WORKERS):
+    jobs = [(article, digest, splitter) for article, digest in items]
+    if workers > 1 and len(jobs) >= PARALLEL_CHUNK_MIN:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(len(jobs) // (workers * 4), 1)
+            return list(executor.map(split_job, jobs, chunksize=chunksize))
+    return [split_job(job) for job in jobs]
+
+
+# 讀取磁碟上的向量庫（不存在或嵌入模型不同時回傳 None），以及對應的 manifest
+# mmap=True 時以唯讀的記憶體映射載入，只適合查詢，不能再加入或刪除片段
+def load_vector_db(embeddings, index_dir=INDEX_DIR, mmap=False):
+    model = embedding_model_name(embeddings)
+    manifest = load_manifest(index_dir)
+    if not os.path.exists(os.path.join(index_dir, "index.faiss")):
+        return None, {"embedding_model": model, "index": None, "articles": {}}
+    if manifest["embedding_model"] not in (None, model):
+        return None, {"embedding_model": model, "index": None, "articles": {}}
+    # 索引檔由本程式自行產生，因此允許反序列化 docstore
+    vectordb = FAISS.load_local(
+        index_dir,
+        embeddings,
+        allow_dangerous_deserialization=True,
+        io_flags=faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0,
+    )
+    tune_index(vectordb.index)
+    indexed = set(vectordb.index_to_docstore_id.values())
+    recorded = {
+        doc_id for entry in manifest["articles"].values() for doc_id in entry["ids"]
+    }
+    if recorded != indexed:
+        manifest = {
+            **manifest_from_index(vectordb, model),
+            "index": manifest.get("index"),
+        }
+    return vectordb, manifest
+
+
+# 比對 manifest 與這次爬取的文章，回傳 (有內容的文章, {新增或變更的網址: 雜湊}, 需移除舊片段的網址)
+def plan_sync(indexed, articles, prune):
+    current = {article.url: article for article in articles if article.content}
+    changed = {}
+    for url, article in current.items():
+        digest = content_hash(article.text)
+        if indexed.get(url, {}).get("hash") != digest:
+            changed[url] = digest
+    crawled = {article.url for article in articles}
+    removed = [
+        url for url in indexed if url in changed or (prune and url not in crawled)
+    ]
+    return current, changed, removed
+
+
+# 將向量庫同步成 articles 的內容並存回磁碟，回傳 FAISS 向量庫（沒有任何片段時回傳 None）
+# 內容為空的文章（抓取失敗）沿用索引中的舊版本；prune=True 時移除這次沒有出現的文章
+# index_type 與 mmap 未指定時使用 RAG_INDEX_TYPE 與 RAG_INDEX_MMAP 的設定
+def sync_vector_db(
+    articles,
+    embeddings,
+    splitter,
+    index_dir=INDEX_DIR,
+    prune=True,
+    index_type=None,
+    mmap=None,
+    workers=CHUNK_WORKERS,
+):
+    settings = index_settings(index_type)
+    mmap = INDEX_MMAP if mmap is None else mmap
+    splitter_id = splitter_name(splitter)
+
+    # 載入向量庫並比對文章；切片器設定變更時所有文章都視為變更
+    def load(mmap):
+        vectordb, manifest = load_vector_db(embeddings, index_dir, mmap=mmap)
+        if manifest.get("splitter") != splitter_id:
+            for entry in manifest["articles"].values():
+                entry["hash"] = None
+        return vectordb, manifest, *plan_sync(manifest["articles"], articles, prune)
+
+    vectordb, manifest, current, changed, removed = load(mmap)
+    if mmap and vectordb is not None:
+        if changed or removed or manifest_settings(manifest) != settings:
+            # 記憶體映射的索引是唯讀的，需要寫入時改為完整載入
+            vectordb, manifest, current, changed, removed = load(False)
+    indexed = manifest["articles"]
+
+    # 已移除或已變更文章的舊片段
+    stale_ids = [doc_id for url in removed for doc_id in indexed.pop(url)["ids"]]
+
+    # 只嵌入新增或變更的文章
+    docs, ids = [], []
+    split = split_articles(
+        [(current[url], digest) for url, digest in changed.items()], splitter, workers
+    )
+    for (url, digest), (article_docs, article_ids) in zip(changed.items(), split):
+        docs += article_docs
+        ids += article_ids
+        indexed[url] = {"hash": digest, "ids": article_ids}
+    vectors = embed_texts(embeddings, [doc.page_content for doc in docs])
+
+    modified = bool(docs or stale_ids)
+    if vectordb is None:
+        if docs:
+            vectordb = build_vector_store(vectors, docs, ids, embeddings, settings)
+    else:
+        count = vectordb.index.ntotal - len(stale_ids) + len(docs)
+        vectors = vectors.reshape(-1, vectordb.index.d)
+        if needs_rebuild(vectordb, manifest, settings, count):
+            vectordb = rebuild_vector_db(
+                vectordb, stale_ids, vectors, docs, ids, settings
+            )
+            modified = True
+        elif stale_ids and not supports_remove(vectordb.index):
+            vectordb = rebuild_vector_db(
+                vectordb, stale_ids, vectors, docs, ids, settings, retrain=False
+            )
+        else:
+            if stale_ids:
+                vectordb.delete(stale_ids)
+            if docs:
+                add_vectors(vectordb, vectors, docs, ids)
+
+    if vectordb is not None and modified:
+        manifest["index"] = settings
+        manifest["splitter"] = splitter_id
+        os.makedirs(index_dir, exist_ok=True)
+        vectordb.save_local(index_dir)
+        save_manifest(manifest, index_dir)
+    return vectordb
@@ -0,0 +1,244 @@
+# rag_bot 的問答流程：兩層答案快取與批次提問
+# - 完全相同：問題正規化（全半形、大小寫、空白、結尾標點）後完全相同即直接回傳
+# - 語意相近：問題向量與已回答問題的餘弦相似度達到門檻時回傳該答案
+# - 快取項目綁定索引版本（rag_index.index_version），向量庫內容變更或超過 TTL 後即失效
+# - 批次模式：一次嵌入所有問題，以單一次 FAISS 向量化搜尋取得所有問題的相關片段，再並行呼叫 LLM
+# - 檢索時多取幾倍的候選片段，同一篇文章（metadata 的 source）最多保留 max_per_source 個，避免重複的上下文
+#
+# 用法：
+#   cache = AnswerCache(version=rag_index.index_version())
+#   answer = answer_question(qa, vectordb, cache, "問題")
+#   answers = answer_batch(qa, vectordb, cache, read_questions("questions.txt"))
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+import unicodedata
+
+import numpy as np
+
+# 答案快取的 SQLite 檔案、存活秒數與語意相近的相似度門檻
+ANSWER_CACHE_PATH = os.environ.get("RAG_ANSWER_CACHE", "./rag_answer_cache.db")
+ANSWER_CACHE_TTL = int(os.environ.get("RAG_ANSWER_CACHE_TTL", 24 * 3600))
+SEMANTIC_THRESHOLD = float(os.environ.get("RAG_SEMANTIC_THRESHOLD", 0.95))
+
+# 每個問題檢索的片段數（與 as_retriever 的預設值相同）與同時進行的 LLM 呼叫數
+RETRIEVAL_K = 4
+LLM_CONCURRENCY = 8
+
+# 每篇文章最多保留的片段數（0 代表不限制），以及去除重複時多取的候選倍數
+MAX_PER_SOURCE = int(os.environ.get("RAG_MAX_PER_SOURCE", 1))
+RETRIEVAL_OVERSAMPLE = 4
+
+# 正規化時移除的結尾標點
+TRAILING_PUNCTUATION = "?？!！。.，,、 "
+
+
+# 問題正規化：NFKC 統一全半形、轉小寫、合併空白並移除結尾標點
+def normalize_question(question):
+    text = unicodedata.normalize("NFKC", question).lower()
+    return " ".join(text.split()).rstrip(TRAILING_PUNCTUATION)
+
+
+# 將向量轉成單位長度的 float32 陣列，內積即為餘弦相似度
+def unit_vectors(vectors):
+    matrix = np.atleast_2d(np.asarray(vectors, dtype="float32"))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+# 以 SQLite 保存的答案快取；目前版本的問題向量常駐記憶體，語意比對只需一次矩陣乘法
+class AnswerCache:
+    def __init__(
+        self,
+        version,
+        path=ANSWER_CACHE_PATH,
+        ttl=ANSWER_CACHE_TTL,
+        threshold=SEMANTIC_THRESHOLD,
+    ):
+        self.version = version
+        self.ttl = ttl
+        self.threshold = threshold
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, question TEXT, answer TEXT, vector BLOB, "
+            "version TEXT, created_at REAL)"
+        )
+        # 刪除其他索引版本與已過期的答案
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM answers WHERE version != ? OR created_at < ?",
+                (version, time.time() - ttl),
+            )
+        rows = self._conn.execute(
+            "SELECT key, vector, created_at FROM answers WHERE vector IS NOT NULL"
+        ).fetchall()
+        self._keys = [key for key, _, _ in rows]
+        self._created = np.array([created for _, _, created in rows], dtype="float64")
+        self._vectors = (
+            np.stack([np.frombuffer(blob, dtype="float32") for _, blob, _ in rows])
+            if rows
+            else None
+        )
+
+    def key(self, question):
+        return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+    # 完全相同的問題；未過期時回傳答案
+    def lookup_exact(self, question):
+        row = self._conn.execute(
+            "SELECT answer FROM answers WHERE key = ? AND version = ? AND created_at >= ?",
+            (self.key(question), self.version, time.time() - self.ttl),
+        ).fetchone()
+        return row[0] if row else None
+
+    # 語意相近的問題：找出相似度最高且未過期的已回答問題，達到門檻時回傳答案
+    def lookup_semantic(self, vector):
+        if self._vectors is None:
+            return None
+        scores = self._vectors @ unit_vectors(vector)[0]
+        scores[self._created < time.time() - self.ttl] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        row = self._conn.execute(
+            "SELECT answer FROM answers WHERE key = ?", (self._keys[best],)
+        ).fetchone()
+        return row[0] if row else None
+
+    def store(self, question, vector, answer):
+        key = self.key(question)
+        vector = unit_vectors(vector)[0]
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                (key, question, answer, vector.tobytes(), self.version, now),
+            )
+        if key in self._keys:
+            position = self._keys.index(key)
+            self._vectors[position] = vector
+            self._created[position] = now
+            return
+        self._keys.append(key)
+        self._created = np.append(self._created, now)
+        self._vectors = (
+            vector[None, :]
+            if self._vectors is None
+            else np.vstack([self._vectors, vector])
+        )
+
+    def close(self):
+        self._conn.close()
+
+
+# 以單一次 FAISS 搜尋取得多個問題的相關片段，回傳每個問題依相關度排序的 Document 清單
+# 同一篇文章的片段最多保留 max_per_source 個；沒有 source metadata 的片段不受限制
+def retrieve_batch(vectordb, vectors, k=RETRIEVAL_K, max_per_source=MAX_PER_SOURCE):
+    matrix = np.asarray(vectors, dtype="float32")
+    if getattr(vectordb, "_normalize_L2", False):
+        matrix = unit_vectors(matrix)
+    candidates = k * RETRIEVAL_OVERSAMPLE if max_per_source else k
+    _, indices = vectordb.index.search(matrix, candidates)
+    results = []
+    for row in indices:
+        docs, per_source = [], {}
+        for i in row:
+            if i == -1:
+                continue
+            doc = vectordb.docstore.search(vectordb.index_to_docstore_id[i])
+            source = doc.metadata.get("source")
+            if max_per_source and source is not None:
+                if per_source.get(source, 0) >= max_per_source:
+                    continue
+                per_source[source] = per_source.get(source, 0) + 1
+            docs.append(doc)
+            if len(docs) == k:
+                break
+        results.append(docs)
+    return results
+
+
+# 以 RetrievalQA 的文件合併鏈（stuff + LLM）回答已檢索好片段的問題
+def run_llm(qa, question, docs):
+    result = qa.combine_documents_chain.invoke(
+        {"input_documents": docs, "question": question}
+    )
+    return result[qa.combine_documents_chain.output_key]
+
+
+# 回答單一問題，回傳 (答案, 來源)；來源為 exact / semantic / llm
+# 問題向量同時用於語意快取與檢索，只需嵌入一次
+def answer_question(qa, vectordb, cache, question):
+    answer = cache.lookup_exact(question)
+    if answer is not None:
+        return answer, "exact"
+    vector = vectordb.embeddings.embed_query(question)
+    answer = cache.lookup_semantic(vector)
+    if answer is not None:
+        return answer, "semantic"
+    (docs,) = retrieve_batch(vectordb, [vector])
+    answer = run_llm(qa, question, docs)
+    cache.store(question, vector, answer)
+    return answer, "llm"
+
+
+# 批次回答多個問題，依輸入順序回傳 [(答案, 來源), ...]
+# 未命中快取的問題一次嵌入、一次搜尋，再以最多 concurrency 個並行請求呼叫 LLM
+def answer_batch(qa, vectordb, cache, questions, concurrency=LLM_CONCURRENCY):
+    results = [None] * len(questions)
+    pending = {}  # 正規化問題 -> 原始位置清單（同一批內重複的問題只問一次）
+    for position, question in enumerate(questions):
+        answer = cache.lookup_exact(question)
+        if answer is not None:
+            results[position] = (answer, "exact")
+        else:
+            pending.setdefault(normalize_question(question), []).append(position)
+    if not pending:
+        return results
+
+    first = [positions[0] for positions in pending.values()]
+    vectors = vectordb.embeddings.embed_documents([questions[p] for p in first])
+    to_ask = []
+    for positions, vector in zip(pending.values(), vectors):
+        answer = cache.lookup_semantic(vector)
+        if answer is not None:
+            for position in positions:
+                results[position] = (answer, "semantic")
+        else:
+            to_ask.append((positions, vector))
+
+    if to_ask:
+        docs_by_question = retrieve_batch(vectordb, [vector for _, vector in to_ask])
+
+        async def ask_all():
+            limit = asyncio.Semaphore(concurrency)
+
+            async def ask(question, docs):
+                async with limit:
+                    result = await qa.combine_documents_chain.ainvoke(
+                        {"input_documents": docs, "question": question}
+                    )
+                return result[qa.combine_documents_chain.output_key]
+
+            return await asyncio.gather(
+                *(
+                    ask(questions[positions[0]], docs)
+                    for (positions, _), docs in zip(to_ask, docs_by_question)
+                )
+            )
+
+        answers = asyncio.run(ask_all())
+        for (positions, vector), answer in zip(to_ask, answers):
+            cache.store(questions[positions[0]], vector, answer)
+            for position in positions:
+                results[position] = (answer, "llm")
+    return results
+
+
+# 讀取問題檔：每行一個問題，略過空白行
+def read_questions(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
@@ -0,0 +1,105 @@
+# API 回應快取：以「端點 + 查詢參數 + 資料表版本」為鍵，支援 TTL 與 LRU 淘汰
+# 寫入資料的 API 只要呼叫 bump() 讓版本號加一，舊版本的快取就不會再被讀到
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# 行程內的記憶體快取後端：OrderedDict 實作 LRU，每筆資料帶有到期時間
+class MemoryCacheBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)  # 標記為最近使用
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)  # 淘汰最久未使用的項目
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+
+# Redis 快取後端：可在多個 worker 行程間共用快取與版本號，淘汰策略交由 Redis 的 maxmemory-policy
+# client 可以是 redis-py 的 Redis 物件，或任何提供 get / set(ex=) / incr 的相容替代品
+class RedisCacheBackend:
+    def __init__(self, client, prefix="response_cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def incr(self, key):
+        return int(self.client.incr(self.prefix + "counter:" + key))
+
+    def get_counter(self, key):
+        value = self.client.get(self.prefix + "counter:" + key)
+        return int(value or 0)
+
+
+# 讀穿式回應快取，namespace 對應一張資料表的版本號
+class ResponseCache:
+    def __init__(self, backend=None, ttl=30, namespace="users"):
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = ttl
+        self.namespace = namespace
+
+    # 目前的資料表版本號
+    def version(self):
+        return self.backend.get_counter(self.namespace)
+
+    # 資料表有寫入時呼叫，讓所有舊快取失效
+    def bump(self):
+        return self.backend.incr(self.namespace)
+
+    # 以端點、排序後的查詢參數與目前版本號組成快取鍵
+    def key(self, endpoint, params=None):
+        query = json.dumps(params or {}, sort_keys=True, ensure_ascii=False)
+        return f"{self.namespace}:v{self.version()}:{endpoint}?{query}"
+
+    # 由快取鍵產生 ETag，版本號或參數不同時 ETag 也不同
+    def etag(self, key):
+        return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+
+# 判斷請求的 If-None-Match 標頭是否與目前的 ETag 相符
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
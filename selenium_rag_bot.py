@@ -1,50 +1,77 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from bs4 import BeautifulSoup
-import time
-import requests
-
-# === 設定 Chrome Driver ===
-CHROMEDRIVER_PATH = r"C:\PYTHONC\chromedriver-win64\chromedriver.exe"  # ← 改成你的實際路徑
-
-def start_browser():
-    options = Options()
-    options.add_argument("--headless")  # 無頭模式（不跳出視窗）
-    options.add_argument("--disable-gpu")
-    service = Service(CHROMEDRIVER_PATH)
-    driver = webdriver.Chrome(service=service, options=options)
-    return driver
-
-# === 動態爬取 TechNews 首頁文章連結 ===
-def crawl_articles():
-    driver = start_browser()
-    driver.get("https://technews.tw/")
-    time.sleep(2)  # 等待 JS 載入內容
-
-    # 取得頁面 HTML 解析
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    driver.quit()
-
-    links = soup.select("h1.entry-title a")
-    articles = []
-    for link in links[:5]:
-        title = link.text.strip()
-        href = link['href']
-        article = get_article_content(href)
-        articles.append(title + "\n" + article)
-    return articles
-
-# === 文章內容擷取（requests 即可） ===
-def get_article_content(url):
+import os
+import crawler
+import crawl_state
+from browser_pool import BrowserPool
+
+# === 爬取模式 ===
+# static：只用 httpx 靜態抓取；browser：一律以瀏覽器渲染；hybrid：靜態解析不到內容的網頁才以瀏覽器渲染
+CRAWL_MODE = os.environ.get("SELENIUM_CRAWL_MODE", "hybrid")
+
+# === 列表頁：靜態解析不到文章連結時才以瀏覽器渲染 ===
+def fetch_listing(url, mode, pool):
+    if mode != "browser":
+        html = crawler.fetch_pages([url])[0]
+        links, next_url = crawler.parse_article_links(html, url) if html else ([], None)
+        if links or mode == "static":
+            return links, next_url
+    html = pool.render(url, crawler.ARTICLE_LINK_SELECTOR)  # 等待文章連結出現，不再固定 sleep
+    if html is None:
+        return [], None
+    return crawler.parse_article_links(html, url)
+
+# === 文章內容：靜態抓取後，只渲染有 HTML 卻解析不到正文的文章（抓取失敗的文章不渲染） ===
+# 靜態抓取以條件式請求進行，未變更（304）的文章沿用狀態庫中的正文；渲染出的正文也記錄到狀態庫
+def fetch_contents(urls, mode, pool, state):
+    if mode == "browser":
+        pages = pool.render_many(urls, crawler.ARTICLE_CONTENT_SELECTOR)
+        contents = [crawler.parse_article_content(html) if html else "" for html in pages]
+        for url, html, content in zip(urls, pages, contents):
+            if html:
+                state.record(url, content)
+        return contents
+
+    contents = crawler.fetch_contents(urls, state=state)
+    if mode == "hybrid":
+        missing = [i for i, content in enumerate(contents) if content == ""]
+        rendered = pool.render_many([urls[i] for i in missing], crawler.ARTICLE_CONTENT_SELECTOR)
+        for i, html in zip(missing, rendered):
+            contents[i] = crawler.parse_article_content(html) if html else ""
+            if contents[i]:
+                state.set_content(urls[i], contents[i])
+    return [content or "" for content in contents]
+
+# === 動態爬取 TechNews 文章 ===
+# pool 未指定時建立只用於這次爬取的瀏覽器池；瀏覽器在第一次需要渲染時才啟動
+# state 未指定時使用 crawl_state.CRAWL_STATE_PATH 的抓取狀態；近似重複的文章會被略過
+def crawl_articles(start_url=crawler.CRAWL_START_URL, max_pages=1, mode=None, pool=None, state=None):
+    mode = mode or CRAWL_MODE
+    own_pool, own_state = pool is None, state is None
+    pool = pool or BrowserPool()
+    state = state or crawl_state.CrawlState()
     try:
-        res = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-        soup = BeautifulSoup(res.text, "html.parser")
-        content = soup.select_one("div.entry-content")
-        return content.get_text(strip=True).replace("\n", "")[:1000]
-    except Exception as e:
-        return ""
+        links, seen, url = [], set(), start_url
+        for _ in range(max_pages):
+            if url is None:
+                break
+            page_links, url = fetch_listing(url, mode, pool)
+            state.discover(page_links)
+            for title, href in page_links:
+                if href not in seen:
+                    seen.add(href)
+                    links.append((title, href))
+
+        contents = fetch_contents([href for _, href in links], mode, pool, state)
+        articles = [crawler.Article(href, title, content) for (title, href), content in zip(links, contents)]
+        return [article.text for article in state.drop_duplicates(articles)]
+    finally:
+        if own_pool:
+            pool.close()
+        if own_state:
+            state.close()
+
+# === 文章內容擷取（非同步爬蟲即可） ===
+def get_article_content(url):
+    return crawler.fetch_articles([("", url)])[0].lstrip("\n")
 
 # === 主程式測試 ===
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+# users 資料表的水平分片：依名稱雜湊將資料分散到 N 個 SQLite 檔案，每個分片有獨立的引擎與寫入鎖
+# - 寫入依名稱路由到單一分片；讀取在各分片平行執行後合併
+# - 對外的使用者 id 為「全域 id」= 分片內 id * N + 分片編號，因此仍可用單一整數做 keyset 分頁
+import heapq
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# 合併後的使用者資料列，欄位與 users 查詢結果相同
+UserRow = namedtuple("UserRow", ["id", "name", "age"])
+
+
+# 以 pandas 的雜湊函式（固定金鑰，跨行程穩定）計算每個名稱所屬的分片編號
+def shard_indices(names, count):
+    names = np.asarray(list(names), dtype=object)
+    if len(names) == 0:
+        return np.empty(0, dtype="int64")
+    return (pd.util.hash_array(names) % np.uint64(count)).astype("int64")
+
+
+# 一組分片引擎與路由、平行執行的工具
+class ShardSet:
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self.count = len(self.engines)
+        self._executor = ThreadPoolExecutor(max_workers=self.count)
+
+    # 單一名稱所屬的分片編號
+    def shard_for(self, name):
+        return int(shard_indices([name], self.count)[0])
+
+    def engine_for(self, name):
+        return self.engines[self.shard_for(name)]
+
+    # 依名稱將項目分組：回傳 {分片編號: [(原始位置, 項目), ...]}
+    def partition(self, items, key=lambda item: item):
+        items = list(items)
+        groups = {}
+        for position, (item, shard) in enumerate(
+            zip(items, shard_indices(map(key, items), self.count))
+        ):
+            groups.setdefault(int(shard), []).append((position, item))
+        return groups
+
+    # 依 column 欄位的名稱將 DataFrame 分組：回傳 {分片編號: 子 DataFrame}
+    def partition_frame(self, frame, column):
+        shard_of = shard_indices(frame[column].to_numpy(dtype=object), self.count)
+        return {int(shard): frame[shard_of == shard] for shard in np.unique(shard_of)}
+
+    # 在指定的分片上平行執行 fn(分片編號, 引擎, 參數)，回傳 {分片編號: 結果}
+    def run(self, fn, args_by_shard=None):
+        if args_by_shard is None:
+            args_by_shard = {shard: None for shard in range(self.count)}
+        futures = {
+            shard: self._executor.submit(fn, shard, self.engines[shard], args)
+            for shard, args in args_by_shard.items()
+        }
+        return {shard: future.result() for shard, future in futures.items()}
+
+    # 分片內 id 與全域 id 的轉換
+    def to_global(self, local_id, shard):
+        return local_id * self.count + shard
+
+    # 全域游標 after_id 在某分片中對應的分片內游標（分片內 id 需大於此值）
+    def local_after(self, after_id, shard):
+        if after_id is None:
+            return None
+        return (after_id - shard) // self.count
+
+    # 將單一分片的資料列轉成帶有全域 id 的 UserRow
+    def _global_rows(self, rows, shard):
+        for row in rows:
+            yield UserRow(self.to_global(row[0], shard), row[1], row[2])
+
+    # 合併各分片已依 id 排序的資料列（可為產生器），輸出依全域 id 排序的 UserRow
+    def merge_rows(self, rows_by_shard):
+        streams = [
+            self._global_rows(rows, shard) for shard, rows in rows_by_shard.items()
+        ]
+        return heapq.merge(*streams, key=lambda row: row.id)
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,42 @@
+import numpy as np  # 用來產生合成的測試錄音
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("soundfile")
+pytest.importorskip("librosa")
+pytest.importorskip("noisereduce")
+matplotlib = pytest.importorskip("matplotlib")
+matplotlib.use("Agg")  # audio.py 匯入 pyplot，測試中不開啟視窗
+
+import librosa  # noqa: E402
+import soundfile as sf  # noqa: E402
+
+import audio  # noqa: E402  匯入要測試的降噪流程
+
+
+# 合成的雙聲道錄音：兩個正弦波加上白雜訊，長度超過一個 noisereduce 分塊
+def synthetic_wav(path, sr=16000, seconds=40):
+    rng = np.random.default_rng(0)
+    t = np.arange(sr * seconds) / sr
+    speech = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.2 * np.sin(2 * np.pi * 1250 * t)
+    noise = 0.05 * rng.standard_normal((len(t), 2))
+    sf.write(path, speech[:, None] + noise, sr)
+    return len(t)
+
+
+# 測試串流模式跨越多個讀取區塊與 noisereduce 分塊，結果與整段載入的批次模式在誤差內相同
+# 串流的輸出檔為 16 位元 PCM，因此允許約一個量化階（1 / 32768）的誤差
+def test_denoise_file_matches_batch(tmp_path):
+    input_path = str(tmp_path / "input.wav")
+    output_path = str(tmp_path / "output.wav")
+    total = synthetic_wav(input_path)
+    assert total > audio.NR_CHUNK_SIZE + audio.NR_PADDING
+
+    assert audio.denoise_file(input_path, output_path, block_size=50_000) == 16000
+    streamed, _ = sf.read(output_path)
+
+    y, sr = librosa.load(input_path, sr=None)
+    expected, _, _ = audio.denoise_batch(y, sr)
+    assert len(streamed) == len(expected)
+    assert np.max(np.abs(streamed - expected)) < 1e-4
+    # 暫存檔在完成後刪除
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["input.wav", "output.wav"]
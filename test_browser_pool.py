@@ -0,0 +1,153 @@
+import functools  # 用來指定靜態檔案伺服器的資料夾
+import re  # 用來模擬執行頁面中的 JS
+import threading  # 用來在背景執行伺服器與測試並行借用
+import time  # 用來模擬渲染耗時
+import urllib.request  # 替身瀏覽器用來讀取網頁
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("selenium")
+pytest.importorskip("bs4")
+
+from bs4 import BeautifulSoup  # noqa: E402
+from selenium.common.exceptions import (  # noqa: E402
+    NoSuchElementException,
+    WebDriverException,
+)
+
+import selenium_rag_bot  # noqa: E402  匯入要測試的混合模式爬蟲
+from crawl_state import CrawlState  # noqa: E402
+from browser_pool import BrowserPool  # noqa: E402  匯入要測試的瀏覽器池
+
+# 以 <script type="text/html"> 包住的內容靜態解析不到，必須「執行 JS」才會出現在頁面上
+RENDERED = re.compile(r'<script type="text/html">(.*?)</script>', re.S)
+
+# 本機測試網站：第 1 頁為靜態列表，第 2 頁需要渲染；文章 b 的正文需要渲染，文章 d 不存在
+SITE = {
+    "index.html": '<h1 class="entry-title"><a href="/a/">A</a></h1>'
+    '<h1 class="entry-title"><a href="/b/">B</a></h1>'
+    '<a class="next page-numbers" href="/page2.html">下一頁</a>',
+    "page2.html": '<script type="text/html"><h1 class="entry-title"><a href="/c/">C</a>'
+    '</h1><h1 class="entry-title"><a href="/d/">D</a></h1></script>',
+    "a/index.html": '<div class="entry-content"><p>A 的內文</p></div>',
+    "b/index.html": '<script type="text/html">'
+    '<div class="entry-content"><p>B 的內文</p></div></script>',
+    "c/index.html": '<div class="entry-content"><p>C 的內文</p></div>',
+}
+
+
+# 替身瀏覽器：以 urllib 讀取網頁並展開 text/html 腳本，記錄渲染過的網址
+class FakeDriver:
+    started = []
+
+    def __init__(self):
+        self.page_source = ""
+        self.visited = []
+        self.closed = False
+        FakeDriver.started.append(self)
+
+    def get(self, url):
+        time.sleep(0.01)
+        html = urllib.request.urlopen(url).read().decode("utf-8")
+        self.page_source = RENDERED.sub(r"\1", html)
+        self.visited.append(url)
+
+    def find_element(self, by, selector):
+        element = BeautifulSoup(self.page_source, "html.parser").select_one(selector)
+        if element is None:
+            raise NoSuchElementException(selector)
+        return element
+
+    def quit(self):
+        self.closed = True
+
+
+# 以背景執行緒啟動本機靜態檔案伺服器，回傳網址
+@pytest.fixture
+def site(tmp_path):
+    for name, body in SITE.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"<html><body>{body}</body></html>", encoding="utf-8")
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(QuietHandler, directory=str(tmp_path))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeDriver.started = []
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+# 測試混合模式只渲染靜態解析不到內容的網頁（第 2 頁與文章 b），且瀏覽器可重複使用
+def test_hybrid_crawl_renders_only_dynamic_pages(site, tmp_path):
+    state = CrawlState(str(tmp_path / "state.db"))
+    with BrowserPool(size=2, driver_factory=FakeDriver, timeout=1) as pool:
+        articles = selenium_rag_bot.crawl_articles(
+            f"{site}/index.html", max_pages=3, mode="hybrid", pool=pool, state=state
+        )
+    assert articles == ["A\nA 的內文", "B\nB 的內文", "C\nC 的內文", "D\n"]
+    rendered = sorted(url for d in FakeDriver.started for url in d.visited)
+    assert rendered == [f"{site}/b/", f"{site}/page2.html"]
+    assert all(d.closed for d in FakeDriver.started)
+
+    # 只用靜態抓取時不會啟動瀏覽器
+    started = len(FakeDriver.started)
+    articles = selenium_rag_bot.crawl_articles(
+        f"{site}/index.html",
+        max_pages=3,
+        mode="static",
+        state=CrawlState(str(tmp_path / "static.db")),
+    )
+    assert articles == ["A\nA 的內文", "B\n"]
+    assert len(FakeDriver.started) == started
+
+
+# 測試瀏覽器數量不超過上限、並行渲染依輸入順序回傳，以及當掉的瀏覽器會被替換
+def test_browser_pool_reuses_and_replaces_drivers(site):
+    pool = BrowserPool(size=2, driver_factory=FakeDriver, timeout=1)
+    names = ["a", "b", "c"] * 4
+    pages = pool.render_many([f"{site}/{name}/" for name in names], "div.entry-content")
+    assert all(f"{name.upper()} 的內文" in html for name, html in zip(names, pages))
+    assert len(FakeDriver.started) == 2
+
+    with pytest.raises(WebDriverException):
+        with pool.driver() as driver:
+            raise WebDriverException("瀏覽器當掉")
+    assert driver.closed
+    # 同時借出兩個瀏覽器時，當掉的那個由新啟動的瀏覽器補上
+    with pool.driver() as first, pool.driver() as second:
+        assert driver not in (first, second)
+    assert len(FakeDriver.started) == 3
+
+    pool.close()
+    assert all(d.closed for d in FakeDriver.started)
+    with pytest.raises(RuntimeError):
+        pool.render(f"{site}/a/")
+
+
+# 替身瀏覽器：載入網址含 crash 的網頁時當掉
+class CrashingDriver(FakeDriver):
+    def get(self, url):
+        if "crash" in url:
+            self.crashed = True
+            raise WebDriverException("瀏覽器當掉")
+        super().get(url)
+
+
+# 測試並行渲染時單一網頁讓瀏覽器當掉：該頁回傳 None 並記錄錯誤，當掉的瀏覽器被替換，其他網頁照常渲染
+def test_render_many_survives_driver_crash(site, caplog):
+    urls = [f"{site}/a/", f"{site}/crash/", f"{site}/c/", f"{site}/b/"]
+    with BrowserPool(size=2, driver_factory=CrashingDriver, timeout=1) as pool:
+        pages = pool.render_many(urls, "div.entry-content")
+        assert pages[1] is None
+        assert "A 的內文" in pages[0] and "C 的內文" in pages[2]
+        assert "B 的內文" in pages[3]
+        assert f"{site}/crash/" in caplog.text
+        # 當掉的瀏覽器在池關閉前就已丟棄，之後借出的是其他瀏覽器
+        (crashed,) = [d for d in FakeDriver.started if getattr(d, "crashed", False)]
+        assert crashed.closed
+        assert "A 的內文" in pool.render(f"{site}/a/", "div.entry-content")
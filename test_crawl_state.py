@@ -0,0 +1,99 @@
+import httpx  # 用來建立本機 HTTP 替身
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("bs4")
+
+import crawler  # noqa: E402  匯入要測試的爬蟲引擎
+from crawl_state import CrawlState  # noqa: E402  匯入要測試的抓取狀態庫
+
+# 替身網站的文章正文；測試中可修改以模擬文章更新
+BODIES = {
+    f"/news/{i}/": f"第 {i} 篇文章的內文，內容各不相同 {i * 7919}" for i in range(5)
+}
+
+
+# 建立支援 ETag 的本機 HTTP 替身，記錄每個文章網址收到的 200 與 304 回應數
+# broken 中的網址一律回傳 503；listed 為列表頁上的文章
+def stand_in(bodies, listed, broken=()):
+    stats = {"200": [], "304": []}
+
+    def handler(request):
+        path = request.url.path
+        if path == "/":
+            links = "".join(
+                f'<h1 class="entry-title"><a href="{href}">T{href}</a></h1>'
+                for href in listed
+            )
+            return httpx.Response(200, text=f"<html><body>{links}</body></html>")
+        if path in broken:
+            return httpx.Response(503)
+        etag = f'"{hash(bodies[path])}"'
+        if request.headers.get("If-None-Match") == etag:
+            stats["304"].append(path)
+            return httpx.Response(304, headers={"ETag": etag})
+        stats["200"].append(path)
+        body = f'<div class="entry-content"><p>{bodies[path]}</p></div>'
+        return httpx.Response(200, text=body, headers={"ETag": etag})
+
+    return httpx.MockTransport(handler), stats
+
+
+# 測試重新爬取只有變更的文章會下載，未變更的文章回應 304 並沿用狀態庫中的正文
+def test_conditional_recrawl(tmp_path):
+    bodies = dict(BODIES)
+    listed = list(bodies)
+    options = {"retries": 0, "backoff": 0}
+    with CrawlState(str(tmp_path / "state.db")) as state:
+        transport, stats = stand_in(bodies, listed, broken={"/news/4/"})
+        first = crawler.crawl_documents(
+            "http://t/", transport=transport, state=state, **options
+        )
+        assert sorted(stats["200"]) == listed[:4]
+        assert first[4].content == ""
+        assert state.pending() == [("T/news/4/", "http://t/news/4/")]
+
+        # 文章 2 更新；文章 4 已不在列表頁上，但先前抓取失敗，仍會從待抓清單重試
+        bodies["/news/2/"] = "更新後的內文"
+        transport, stats = stand_in(bodies, listed[:4])
+        second = crawler.crawl_documents(
+            "http://t/", transport=transport, state=state, **options
+        )
+        assert sorted(stats["200"]) == ["/news/2/", "/news/4/"]
+        assert sorted(stats["304"]) == ["/news/0/", "/news/1/", "/news/3/"]
+        assert [a.content for a in second] == [
+            BODIES["/news/0/"],
+            BODIES["/news/1/"],
+            "更新後的內文",
+            BODIES["/news/3/"],
+            BODIES["/news/4/"],
+        ]
+        assert state.pending() == []
+
+    # 剛檢查過的文章不再送出請求
+    with CrawlState(str(tmp_path / "state.db"), refresh_after=3600) as state:
+        transport, stats = stand_in(bodies, listed)
+        contents = crawler.fetch_contents(
+            [f"http://t{path}" for path in listed], transport=transport, state=state
+        )
+        assert stats == {"200": [], "304": []}
+        assert contents[2] == "更新後的內文"
+
+
+# 測試近似重複的文章只保留最早發現的網址，內容不同或沒有正文的文章保留
+def test_drop_duplicates(tmp_path):
+    original = "".join(
+        f"第{i}段：台積電宣布在美國的第{i}座晶圓廠將於{2020 + i}年量產，採用{i}奈米製程。"
+        for i in range(12)
+    )
+    copy = original.replace("2025年", "2026年") + "（本文轉載自外電）"
+    with CrawlState(str(tmp_path / "state.db")) as state:
+        state.discover([("原文", "http://t/a"), ("不同", "http://t/c")])
+        state.discover([("轉載", "http://t/b")])
+        articles = [
+            crawler.Article("http://t/b", "轉載", copy),
+            crawler.Article("http://t/a", "原文", original),
+            crawler.Article("http://t/c", "不同", "完全不同的另一篇新聞內容" * 5),
+            crawler.Article("http://t/d", "失敗", ""),
+        ]
+        kept = state.drop_duplicates(articles)
+    assert [a.url for a in kept] == ["http://t/a", "http://t/c", "http://t/d"]
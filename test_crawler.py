@@ -0,0 +1,117 @@
+import asyncio  # 用來在替身伺服器中模擬網路延遲
+import time  # 用來確認並行抓取的耗時
+import httpx  # 用來建立本機 HTTP 替身
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("bs4")
+
+import crawler  # noqa: E402  匯入要測試的爬蟲引擎
+
+PAGES = 3  # 替身網站的列表頁數
+PER_PAGE = 40  # 每頁的文章數
+
+
+# 產生 TechNews 風格的列表頁 HTML（WordPress 的 entry-title 與 next page-numbers 分頁）
+def listing_html(page):
+    articles = "".join(
+        f'<article><h1 class="entry-title"><a href="/news/{page}-{i}/">'
+        f"文章 {page}-{i}</a></h1></article>"
+        for i in range(PER_PAGE)
+    )
+    next_link = (
+        f'<a class="next page-numbers" href="/page/{page + 1}/">下一頁</a>'
+        if page < PAGES
+        else ""
+    )
+    return f"<html><body>{articles}{next_link}</body></html>"
+
+
+# 建立本機 HTTP 替身：列表頁、文章頁，以及第一次回傳 503 的文章與 404 的文章
+# 每個請求延遲 delay 秒，並記錄同時處理中的最大請求數
+def stand_in(delay=0.02):
+    state = {"active": 0, "max_active": 0, "hits": {}}
+
+    async def handler(request):
+        path = request.url.path
+        state["hits"][path] = state["hits"].get(path, 0) + 1
+        state["active"] += 1
+        state["max_active"] = max(state["max_active"], state["active"])
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state["active"] -= 1
+
+        if path == "/" or path.startswith("/page/"):
+            page = 1 if path == "/" else int(path.strip("/").split("/")[1])
+            return httpx.Response(200, text=listing_html(page))
+        if path == "/news/1-0/" and state["hits"][path] == 1:
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        if path == "/news/1-1/":
+            return httpx.Response(404)
+        body = f'<div class="entry-content"><p>{path} 的內文</p></div>'
+        return httpx.Response(200, text=body)
+
+    return httpx.MockTransport(handler), state
+
+
+# 測試翻頁、去重、重試與每個主機的並行上限，且並行抓取明顯快於逐篇抓取
+def test_crawl_articles_paginates_concurrently():
+    transport, state = stand_in()
+    start = time.perf_counter()
+    articles = crawler.crawl_articles(
+        "http://technews.test/",
+        max_pages=10,
+        max_articles=1000,
+        per_host=16,
+        backoff=0,
+        transport=transport,
+    )
+    elapsed = time.perf_counter() - start
+
+    assert len(articles) == PAGES * PER_PAGE  # 超過第一頁的前 5 篇
+    assert articles[0] == "文章 1-0\n/news/1-0/ 的內文"  # 503 之後重試成功
+    assert articles[1] == "文章 1-1\n"  # 404 不重試，回傳空內文
+    assert state["hits"]["/news/1-0/"] == 2
+    assert state["hits"]["/news/1-1/"] == 1
+    assert state["max_active"] <= 16
+    # 逐篇抓取至少需要 123 * 0.02 秒
+    assert elapsed < (PAGES + PAGES * PER_PAGE) * 0.02 / 2
+
+
+# 測試文章數上限與已知連結的並行抓取
+def test_max_articles_and_fetch_articles():
+    transport, _ = stand_in(delay=0)
+    articles = crawler.crawl_articles(
+        "http://technews.test/", max_articles=5, transport=transport
+    )
+    assert [a.split("\n")[0] for a in articles] == [f"文章 1-{i}" for i in range(5)]
+
+    links = [("A", "http://technews.test/news/2-3/")]
+    assert crawler.fetch_articles(links, transport=transport) == [
+        "A\n/news/2-3/ 的內文"
+    ]
+
+
+# 測試單篇文章無法重試的錯誤（重新導向迴圈、錯誤的 charset）只記錄並略過該篇，不中斷整個爬取
+def test_bad_article_does_not_abort_crawl(caplog):
+    def handler(request):
+        path = request.url.path
+        if path == "/":
+            links = "".join(
+                f'<h1 class="entry-title"><a href="/news/{name}/">{name}</a></h1>'
+                for name in ("ok", "loop", "charset")
+            )
+            return httpx.Response(200, text=links)
+        if path == "/news/loop/":
+            return httpx.Response(302, headers={"Location": "/news/loop/"})
+        body = f'<div class="entry-content"><p>{path} 的內文</p></div>'.encode()
+        if path == "/news/charset/":
+            return httpx.Response(
+                200, content=body, headers={"Content-Type": "text/html; charset=bogus"}
+            )
+        return httpx.Response(200, content=body)
+
+    transport = httpx.MockTransport(handler)
+    articles = crawler.crawl_articles("http://technews.test/", transport=transport)
+    assert articles == ["ok\n/news/ok/ 的內文", "loop\n", "charset\n"]
+    assert "TooManyRedirects" in caplog.text and "LookupError" in caplog.text
@@ -0,0 +1,154 @@
+from html.parser import HTMLParser  # 用來建立區塊文字的比對基準
+import httpx  # 用來建立本機 HTTP 替身
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("bs4")
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import crawler  # noqa: E402  匯入使用擷取引擎的爬蟲
+import html_extract  # noqa: E402  匯入要測試的擷取引擎
+
+SELECTOR = "div.entry-content"
+
+# 涵蓋巢狀標籤、註解、腳本、實體字元、多個 class、重複區塊與找不到正文的頁面
+PAGES = [
+    '<html><body><div class="entry-content"><p>第一段 <b>粗體</b>&amp; 文字&nbsp;</p>'
+    "<!-- 註解 --><script>var x = 1;</script><style>.a{}</style>"
+    '<p>第二段<br>換行\n  文字</p> 尾巴 <div class="entry-content">巢狀</div></div>'
+    '<div class="entry-content">第二個</div></body></html>',
+    '<html><head><title>T</title></head><body><div class="post entry-content x">'
+    "<h2>標題</h2><ul><li>一</li><li>二</li></ul></div></body></html>",
+    '<html><body><div class="sidebar">側欄</div>'
+    + "<p>填充內容</p>" * 200
+    + '<div class="entry-content">後面的正文</div></body></html>',
+    "<html><body><div class='content'>沒有正文</div></body></html>",
+]
+
+
+# 原本以 BeautifulSoup html.parser 解析整份文件的結果，作為比對基準
+def reference(html):
+    element = BeautifulSoup(html, "html.parser").select_one(SELECTOR)
+    return element.get_text(strip=True) if element is not None else None
+
+
+# 以 html.parser 的標籤事件組成區塊文字，作為走訪文件樹的比對基準
+class ReferenceBlockParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.builder = html_extract.BlockBuilder()
+
+    def handle_starttag(self, tag, attrs):
+        self.builder.start(tag)
+
+    def handle_endtag(self, tag):
+        self.builder.end(tag)
+
+    def handle_data(self, data):
+        self.builder.data(data)
+
+
+# 原本以 BeautifulSoup html.parser 解析整份文件取出正文區塊的 HTML，再以 html.parser 轉成的區塊文字
+def reference_blocks(html):
+    element = BeautifulSoup(html, "html.parser").select_one(SELECTOR)
+    if element is None:
+        return None
+    parser = ReferenceBlockParser()
+    parser.feed(str(element))
+    parser.close()
+    return parser.builder.close()
+
+
+# 測試各後端與串流解析的結果都與 BeautifulSoup 相同
+@pytest.mark.parametrize("html", PAGES)
+def test_backends_match_beautifulsoup(html):
+    expected = reference(html)
+    for backend, available in (
+        ("selectolax", html_extract.LexborHTMLParser),
+        ("lxml", html_extract.etree),
+        ("bs4", True),
+    ):
+        if available:
+            assert html_extract.extract_text(html, SELECTOR, backend) == expected
+    if html_extract.etree is not None:
+        stream = html_extract.ContentStream(SELECTOR)
+        for start in range(0, len(html), 64):
+            stream.feed(html[start : start + 64].encode("utf-8"))
+        stream.close()
+        assert stream.text == expected
+
+
+# 測試各後端直接走訪文件樹的區塊文字，與序列化成 HTML 再重新解析的結果相同
+@pytest.mark.parametrize("html", PAGES)
+def test_extract_blocks(html):
+    expected = reference_blocks(html)
+    for backend, available in (
+        ("selectolax", html_extract.LexborHTMLParser),
+        ("lxml", html_extract.etree),
+        ("bs4", True),
+    ):
+        if available:
+            assert html_extract.extract_blocks(html, SELECTOR, backend) == expected
+    if html_extract.etree is not None:
+        stream = html_extract.ContentStream(SELECTOR)
+        for start in range(0, len(html), 64):
+            stream.feed(html[start : start + 64].encode("utf-8"))
+        stream.close()
+        assert stream.blocks == expected
+
+
+# 測試區塊文字保留段落、標題與清單
+def test_blocks_text():
+    assert crawler.parse_article_content(PAGES[0]) == (
+        "第一段 粗體& 文字\n第二段\n換行 文字\n尾巴\n巢狀"
+    )
+    assert crawler.parse_article_content(PAGES[1]) == "## 標題\n- 一\n- 二"
+    assert crawler.clean_content(None) == ""
+
+
+# 測試串流解析在正文區塊結束後即停止，不必讀完整份頁面
+def test_stream_stops_after_content_block():
+    pytest.importorskip("lxml")
+    html = (
+        '<html><body><div class="entry-content"><p>正文</p></div>'
+        + "<p>留言</p>" * 5000
+        + "</body></html>"
+    ).encode("utf-8")
+    chunks = [html[start : start + 1024] for start in range(0, len(html), 1024)]
+    stream = html_extract.ContentStream(SELECTOR)
+    fed = 0
+    for chunk in chunks:
+        fed += 1
+        if stream.feed(chunk):
+            break
+    stream.close()
+    assert stream.text == "正文"
+    assert fed < len(chunks) / 10
+
+
+# 測試爬蟲以串流與行程池解析的正文相同，且列表頁連結與下一頁都能解析
+def test_crawler_streaming_and_process_pool():
+    def handler(request):
+        path = request.url.path
+        if path == "/":
+            body = (
+                '<h1 class="entry-title"><a href="/a/">A</a></h1>'
+                '<h1 class="entry-title"><a>沒有網址</a></h1>'
+                '<a class="next page-numbers" href="/page/2/">下一頁</a>'
+            )
+        elif path == "/page/2/":
+            body = '<h1 class="entry-title"><a href="/b/">B</a></h1>'
+        else:
+            body = PAGES[0] if path == "/a/" else PAGES[1]
+        return httpx.Response(200, text=body)
+
+    transport = httpx.MockTransport(handler)
+    expected = [
+        f"A\n{crawler.clean_content(reference_blocks(PAGES[0]))}",
+        f"B\n{crawler.clean_content(reference_blocks(PAGES[1]))}",
+    ]
+    assert crawler.crawl_articles("http://t/", transport=transport) == expected
+    assert (
+        crawler.crawl_articles("http://t/", transport=transport, parse_workers=2)
+        == expected
+    )
@@ -3,8 +3,25 @@ from main import (
     app,
     SessionLocal,
     UserTable,
+    ImportJob,
+    run_import_job,
 )  # 匯入主程式中的 app、資料庫 session 與模型
+import main  # 用來在測試中切換模組層級的設定
 import os  # 用來檢查檔案是否存在
+import io  # 用來讀取匯出的二進位內容
+import gzip  # 用來解壓縮匯出的 CSV
+import pytest  # 用來略過缺少選用套件的測試
+import numpy as np  # 用來建立驗證函式的輸入
+import pandas as pd  # 用來建立驗證函式的輸入
+from response_cache import MemoryCacheBackend  # 用來測試快取後端
+from metrics import SamplingProfiler, RequestStats  # 用來測試取樣分析器
+import time  # 用來等待背景匯入工作完成
+import json  # 用來解析 NDJSON 串流回應
+import zipfile  # 用來建立多檔上傳的 zip
+import users_cli  # 用來測試命令列工具
+from sqlalchemy import event  # 用來計算送出的 SQL 陳述式數量
+from sqlalchemy.exc import OperationalError  # 用來觸發查詢失敗
+import re  # 用來解析 /metrics 的計數器
 
 client = TestClient(app)  # 建立測試用的 FastAPI client 實例
 
@@ -15,6 +32,26 @@ def clear_db():
     db.query(UserTable).delete()  # 刪除所有 UserTable 的資料
     db.commit()
     db.close()
+    main.response_cache.bump()  # 直接修改資料表後也要讓回應快取失效
+
+
+# 每個測試使用自己的暫存資料夾存放上傳檔與被拒絕資料報表，不留在工作目錄中
+@pytest.fixture(autouse=True)
+def spool_dir(tmp_path, monkeypatch):
+    path = tmp_path / "upload_spool"
+    monkeypatch.setattr(main, "UPLOAD_SPOOL_DIR", str(path))
+    return path
+
+
+# 等待背景匯入工作結束並回傳最終狀態
+def wait_for_job(job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
 
 
 # 測試建立使用者功能
@@ -109,3 +146,722 @@ def test_average_age_empty():
     assert response.json() == {
         "message": "No users to calculate average"
     }  # 檢查提示訊息
+
+
+# 測試 CSV 匯入會分批寫入並回報成功與被拒絕的筆數
+def test_upload_csv_counts_rejected_rows():
+    clear_db()
+    content = "Name,Age\nAlice,30\nBob,abc\n,40\nCarol,25.5\nDave,41\n"
+    response = client.post(
+        "/upload_csv", files={"file": ("users.csv", content, "text/csv")}
+    )
+    assert response.status_code == 200
+    data = wait_for_job(response.json()["job_id"])
+    assert data["status"] == "done"
+    assert data["rows_inserted"] == 2  # 只有 Alice 與 Dave 為有效資料
+    assert data["rows_rejected"] == 3
+    assert data["rows_processed"] == 5
+
+    names = [u["name"] for u in client.get("/users").json()["users"]]
+    assert sorted(names) == ["Alice", "Dave"]
+
+
+# 測試匯入工作可以從上次提交的進度續跑，不會重複寫入已匯入的資料
+def test_import_job_resume():
+    clear_db()
+    content = "Name,Age\nA1,10\nA2,20\nA3,30\n"
+    response = client.post(
+        "/upload_csv", files={"file": ("users.csv", content, "text/csv")}
+    )
+    job_id = response.json()["job_id"]
+    wait_for_job(job_id)
+
+    # 模擬服務在處理完第一列後中斷：刪除後兩列並將工作標記為 running
+    os.makedirs(main.UPLOAD_SPOOL_DIR, exist_ok=True)
+    spool_path = os.path.join(main.UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+    with open(spool_path, "w") as f:
+        f.write(content)
+    db = SessionLocal()
+    db.query(UserTable).filter(UserTable.name != "A1").delete()
+    job = db.get(ImportJob, job_id)
+    job.status, job.rows_inserted, job.spool_path = "running", 1, spool_path
+    db.commit()
+    db.close()
+
+    run_import_job(job_id)
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "done"
+    names = sorted(u["name"] for u in client.get("/users").json()["users"])
+    assert names == ["A1", "A2", "A3"]
+    assert not os.path.exists(spool_path)  # 完成後暫存檔應被刪除
+
+
+# 測試多檔上傳：多個 CSV 與 zip 內的 CSV 各自建立匯入工作，標題錯誤的檔案列在 errors 中
+def test_upload_csv_batch():
+    clear_db()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("inner/c.csv", "Name,Age\nC1,30\nC2,x\n")
+        zf.writestr("readme.txt", "ignored")
+    files = [
+        ("files", ("a.csv", "Name,Age\nA1,10\nA2,20\n", "text/csv")),
+        ("files", ("b.csv", "Name,Age\nB1,40\n", "text/csv")),
+        ("files", ("bad.csv", "Foo,Bar\n1,2\n", "text/csv")),
+        ("files", ("more.zip", archive.getvalue(), "application/zip")),
+    ]
+    response = client.post("/upload_csv/batch", files=files)
+    assert response.status_code == 200
+    data = response.json()
+    assert [job["filename"] for job in data["jobs"]] == [
+        "a.csv",
+        "b.csv",
+        "more.zip/inner/c.csv",
+    ]
+    assert [error["filename"] for error in data["errors"]] == ["bad.csv"]
+
+    jobs = [wait_for_job(job["job_id"]) for job in data["jobs"]]
+    assert [job["status"] for job in jobs] == ["done"] * 3
+    assert [job["rows_inserted"] for job in jobs] == [2, 1, 1]
+    assert jobs[2]["rows_rejected"] == 1
+    names = sorted(u["name"] for u in client.get("/users").json()["users"])
+    assert names == ["A1", "A2", "B1", "C1"]
+
+    response = client.post(
+        "/upload_csv/batch", files=[("files", ("bad.csv", "Foo\n1\n", "text/csv"))]
+    )
+    assert response.status_code == 400
+
+
+# 測試命令列的平行匯入：資料夾中的 CSV 由子行程解析後寫入
+def test_cli_ingest(tmp_path, capsys):
+    clear_db()
+    for i in range(3):
+        (tmp_path / f"part{i}.csv").write_text(
+            "Name,Age\n" + "".join(f"P{i}_{j},{j}\n" for j in range(5)) + "X,bad\n"
+        )
+    users_cli.run(["ingest", str(tmp_path), "--workers", "2"])
+    assert "共 3 個檔案，匯入 15 筆，拒絕 3 筆" in capsys.readouterr().out
+    assert len(client.get("/users").json()["users"]) == 15
+
+
+# 測試不同資料夾與 zip 中的同名 CSV 各自寫入自己的被拒絕報表
+def test_cli_ingest_rejected_reports_per_file(tmp_path, capsys):
+    clear_db()
+    paths = []
+    for folder in ("x", "y"):
+        (tmp_path / folder).mkdir()
+        path = tmp_path / folder / "users.csv"
+        path.write_text(f"Name,Age\n{folder}1,1\n{folder}_bad,oops\n")
+        paths.append(str(path))
+    with zipfile.ZipFile(tmp_path / "more.zip", "w") as zf:
+        zf.writestr("users.csv", "Name,Age\nz_bad,oops\n")
+    paths.append(str(tmp_path / "more.zip"))
+
+    reports = tmp_path / "reports"
+    users_cli.run(["ingest", *paths, "--rejected-dir", str(reports)])
+    assert "共 3 個檔案，匯入 2 筆，拒絕 3 筆" in capsys.readouterr().out
+    rejected = sorted(
+        pd.read_csv(path)["Name"].tolist()[0] for path in reports.iterdir()
+    )
+    assert rejected == ["x_bad", "y_bad", "z_bad"]
+
+
+# 測試平行匯入逐批交出結果：每份檔案依 chunk_size 分批寫入，無法解析的檔案單獨回報錯誤
+def test_ingest_csv_files_streams_chunks(tmp_path):
+    clear_db()
+    tasks = []
+    for i in range(2):
+        path = tmp_path / f"part{i}.csv"
+        path.write_text("Name,Age\n" + "".join(f"Q{i}_{j},{j}\n" for j in range(25)))
+        tasks.append((f"part{i}", str(path), 0, None))
+    (tmp_path / "bad.csv").write_text("Foo,Bar\n1,2\n")
+    tasks.append(("bad", str(tmp_path / "bad.csv"), 0, None))
+
+    chunks, errors = [], {}
+    totals = main.ingest_csv_files(
+        tasks,
+        workers=2,
+        chunk_size=4,
+        on_chunk=lambda conn, key, inserted, rejected, offset: chunks.append(
+            (key, inserted, offset)
+        ),
+        on_file=lambda key, error: errors.update({key: error}),
+    )
+    assert totals == {"part0": (25, 0), "part1": (25, 0), "bad": (0, 0)}
+    for i, key in enumerate(["part0", "part1"]):
+        assert [n for k, n, _ in chunks if k == key] == [4] * 6 + [1]
+        # 已讀取位元組數隨批次遞增，最後一批讀完整份檔案
+        offsets = [offset for k, _, offset in chunks if k == key]
+        assert offsets == sorted(offsets)
+        assert offsets[-1] == os.path.getsize(tasks[i][1])
+    assert errors["part0"] is None and errors["part1"] is None
+    assert "Name" in errors["bad"]
+    assert len(client.get("/users", params={"limit": 100}).json()["users"]) == 50
+
+
+# 測試 GET /users 的 keyset 分頁與名稱前綴篩選
+def test_get_users_pagination():
+    clear_db()
+    for i in range(5):
+        client.post("/user", json={"name": f"Page{i}", "age": 20 + i})
+    client.post("/user", json={"name": "Other", "age": 50})
+
+    first = client.get("/users", params={"limit": 2}).json()
+    assert [u["name"] for u in first["users"]] == ["Page0", "Page1"]
+    second = client.get(
+        "/users", params={"limit": 2, "after_id": first["next_after_id"]}
+    ).json()
+    assert [u["name"] for u in second["users"]] == ["Page2", "Page3"]
+
+    filtered = client.get("/users", params={"name": "Page"}).json()
+    assert len(filtered["users"]) == 5
+    assert filtered["next_after_id"] is None  # 最後一頁沒有下一頁游標
+
+
+# 測試 GET /users 的 NDJSON 串流模式
+def test_get_users_stream():
+    clear_db()
+    client.post("/user", json={"name": "S1", "age": 1})
+    client.post("/user", json={"name": "S2", "age": 2})
+    response = client.get("/users", params={"stream": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["name"] for line in lines] == ["S1", "S2"]
+
+
+# 測試平均年齡在 SQL 端依名稱第一個字分組計算
+def test_average_age_grouping():
+    clear_db()
+    for name, age in [("Amy", 20), ("Andy", 31), ("Bob", 40)]:
+        client.post("/user", json={"name": name, "age": age})
+    response = client.get("/average_age")
+    assert response.json() == {"average_age_by_group": {"A": 25.5, "B": 40.0}}
+
+
+# 測試啟用 age_stats 彙總表後，新增、刪除與 CSV 匯入都會增量更新統計
+def test_average_age_materialized(monkeypatch):
+    clear_db()
+    monkeypatch.setattr(main, "AGE_STATS_MATERIALIZED", True)
+    main.rebuild_age_stats()
+
+    client.post("/user", json={"name": "Amy", "age": 20})
+    client.post("/user", json={"name": "Bob", "age": 40})
+    client.post("/user", json={"name": "Bob", "age": 50})
+    client.delete("/user/Bob")
+    response = client.post(
+        "/upload_csv",
+        files={"file": ("users.csv", "Name,Age\nAndy,31\nCarl,60\n", "text/csv")},
+    )
+    wait_for_job(response.json()["job_id"])
+
+    response = client.get("/average_age")
+    assert response.json() == {"average_age_by_group": {"A": 25.5, "C": 60.0}}
+
+
+# 測試新連線會套用 performance 參數組合（WAL 與 synchronous=NORMAL）
+# 且取出連線時不會先送出 pre-ping 查詢
+def test_sqlite_performance_profile():
+    assert not main.engine.pool._pre_ping
+    with main.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA temp_store").scalar() == 2  # MEMORY
+
+
+# 測試 handler 發生例外時，依賴注入的 session 仍會被關閉並歸還連線
+def test_get_db_closes_session_on_error():
+    checked_out = main.engine.pool.checkedout()
+    gen = main.get_db()
+    db = next(gen)
+    db.query(UserTable).count()  # 讓 session 取得一條連線
+    assert main.engine.pool.checkedout() == checked_out + 1
+    try:
+        gen.throw(RuntimeError("boom"))
+    except RuntimeError:
+        pass
+    assert main.engine.pool.checkedout() == checked_out
+
+
+# 測試批次新增與批次刪除使用者，並回報逐筆結果
+def test_users_batch():
+    clear_db()
+    users = [
+        {"name": "B1", "age": 10},
+        {"name": "B2", "age": 20},
+        {"name": "B1", "age": 30},
+    ]
+    response = client.post("/users/batch", json=users)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["name"] for r in results] == ["B1", "B2", "B1"]
+    assert results[0]["id"] < results[1]["id"] < results[2]["id"]
+
+    response = client.request("DELETE", "/users/batch", json=["B1", "Missing"])
+    assert response.json()["results"] == [
+        {"name": "B1", "deleted": 2, "status": "deleted"},
+        {"name": "Missing", "deleted": 0, "status": "not_found"},
+    ]
+    assert [u["name"] for u in client.get("/users").json()["users"]] == ["B2"]
+
+
+# 計算 block() 執行期間對資料庫送出的 SQL 陳述式數量（executemany 算一個）
+def count_statements(block):
+    calls = []
+
+    def listener(*args):
+        calls.append(args)
+
+    event.listen(main.engine, "before_cursor_execute", listener)
+    try:
+        block()
+    finally:
+        event.remove(main.engine, "before_cursor_execute", listener)
+    return len(calls)
+
+
+# 測試批次新增只送出一個 INSERT（executemany）加上一次取回 id 的查詢，且 id 依輸入順序
+def test_users_batch_single_insert():
+    clear_db()
+    users = [{"name": f"S{i}", "age": i} for i in range(50)]
+    responses = []
+    statements = count_statements(
+        lambda: responses.append(client.post("/users/batch", json=users))
+    )
+    assert statements == 2
+    results = responses[0].json()["results"]
+    ids = [r["id"] for r in results]
+    assert ids == sorted(ids) and len(set(ids)) == 50
+    db = SessionLocal()
+    stored = dict(db.query(UserTable.id, UserTable.name).all())
+    db.close()
+    assert [stored[r["id"]] for r in results] == [u["name"] for u in users]
+
+
+# 測試批次請求超過上限時回傳 400
+def test_users_batch_limit(monkeypatch):
+    monkeypatch.setattr(main, "USERS_BATCH_MAX_DELETE", 2)
+    response = client.request("DELETE", "/users/batch", json=["a", "b", "c"])
+    assert response.status_code == 400
+
+
+# 測試上限筆數的批次刪除分段送出 IN (...)，每段的參數數量不超過 SQLite 的上限
+def test_users_batch_delete_chunks():
+    clear_db()
+    names = [f"D{i}" for i in range(main.USERS_BATCH_MAX_DELETE)]
+    client.post("/users/batch", json=[{"name": name, "age": 1} for name in names])
+    responses = []
+    statements = count_statements(
+        lambda: responses.append(client.request("DELETE", "/users/batch", json=names))
+    )
+    assert statements == 4  # 兩段，各一次分組查詢與一次 DELETE
+    results = responses[0].json()["results"]
+    assert [r["deleted"] for r in results] == [1] * len(names)
+    assert client.get("/users").json()["users"] == []
+
+
+# 測試 GET /users 的回應快取、ETag 與 304，以及寫入後快取失效
+def test_users_cache_and_etag():
+    clear_db()
+    client.post("/user", json={"name": "C1", "age": 1})
+    first = client.get("/users")
+    etag = first.headers["etag"]
+
+    # 相同版本下，帶 If-None-Match 應得到 304 且不需查詢資料庫
+    response = client.get("/users", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # 新增使用者後版本號改變，ETag 不再相符並回傳最新資料
+    client.post("/user", json={"name": "C2", "age": 2})
+    response = client.get("/users", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert [u["name"] for u in response.json()["users"]] == ["C1", "C2"]
+
+
+# 測試記憶體快取後端的 LRU 淘汰與 TTL 到期
+def test_memory_cache_backend_lru_and_ttl():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set("a", 1, ttl=60)
+    backend.set("b", 2, ttl=60)
+    backend.get("a")  # a 成為最近使用
+    backend.set("c", 3, ttl=60)  # 應淘汰 b
+    assert backend.get("b") is None
+    assert backend.get("a") == 1
+
+    backend.set("d", 4, ttl=-1)  # 已過期
+    assert backend.get("d") is None
+
+
+# 測試整欄驗證會標記各種錯誤原因，並可下載被拒絕資料的 CSV 報表
+def test_upload_csv_rejected_report():
+    clear_db()
+    content = (
+        "Name,Age\n"
+        "  Amy  ,20\n"  # 姓名前後空白會被去除
+        ",30\n"
+        "Bob,\n"
+        "Cat,abc\n"
+        "Dan,200\n"
+        "Amy,20\n"  # 與第一列重複
+        "Eve,-1\n"
+    )
+    response = client.post(
+        "/upload_csv", files={"file": ("users.csv", content, "text/csv")}
+    )
+    job = wait_for_job(response.json()["job_id"])
+    assert (job["rows_inserted"], job["rows_rejected"]) == (1, 6)
+    assert client.get("/users").json()["users"] == [{"name": "Amy", "age": 20}]
+
+    report = client.get(job["rejected_report"])
+    assert report.status_code == 200
+    lines = report.text.splitlines()
+    assert lines[0] == "row,Name,Age,reason"
+    reasons = [line.rsplit(",", 1)[1] for line in lines[1:]]
+    assert reasons == [
+        "missing_name",
+        "missing_age",
+        "age_not_integer",
+        "age_out_of_range",
+        "duplicate_in_file",
+        "age_out_of_range",
+    ]
+    assert lines[1].startswith("2,")  # 報表保留原始資料列編號
+
+
+# 測試被拒絕資料報表在保留期限內可下載，逾期或工作紀錄不存在時會被刪除
+def test_prune_rejected_reports(spool_dir):
+    clear_db()
+    response = client.post(
+        "/upload_csv", files={"file": ("users.csv", "Name,Age\nAmy,abc\n", "text/csv")}
+    )
+    job = wait_for_job(response.json()["job_id"])
+    orphan = spool_dir / "missing-job.rejected.csv"
+    orphan.write_text("row,Name,Age,reason\n")
+
+    assert main.prune_rejected_reports() == 1  # 只刪除沒有工作紀錄的報表
+    assert not orphan.exists()
+    assert client.get(job["rejected_report"]).status_code == 200
+
+    expired = time.time() + main.REJECTED_REPORT_RETENTION + 1
+    assert main.prune_rejected_reports(now=expired) == 1
+    assert list(spool_dir.iterdir()) == []
+    assert client.get(f"/jobs/{job['job_id']}").json()["rejected_report"] is None
+    assert client.get(f"/jobs/{job['job_id']}/rejected").status_code == 404
+
+
+# 測試跨批次的重複資料也會被偵測
+def test_validate_users_frame_dedup_across_chunks():
+    seen = main.SeenRows()
+    chunk = pd.DataFrame({"Name": ["A", "B"], "Age": ["1", "2"]}, dtype="string")
+    good, bad = main.validate_users_frame(chunk, seen, 1)
+    assert len(good) == 2 and bad.empty
+
+    good, bad = main.validate_users_frame(chunk.iloc[:1], seen, 3)
+    assert good.empty
+    assert bad["reason"].tolist() == ["duplicate_in_file"]
+    seen.close()
+
+
+# 測試續跑時略過的資料列仍參與去重：與續跑點之前資料重複的資料列會被拒絕，且資料列編號不變
+def test_iter_validated_chunks_dedup_across_resume():
+    data = b"Name,Age\nA,1\nB,2\nC,x\nA,1\nD,4\nB,2\n"
+    chunks = list(main.iter_validated_chunks(io.BytesIO(data), 2, skip_rows=3))
+    good = pd.concat([g for g, _ in chunks])
+    bad = pd.concat([b for _, b in chunks])
+    assert good["name"].tolist() == ["D"]
+    assert bad[["row", "reason"]].values.tolist() == [
+        [4, "duplicate_in_file"],
+        [6, "duplicate_in_file"],
+    ]
+
+
+# 測試名稱唯一模式：重試建立使用者與重新匯入同一份 CSV 都不會產生重複資料
+def test_unique_name_upsert(monkeypatch):
+    clear_db()
+    monkeypatch.setattr(main, "UNIQUE_USER_NAMES", True)
+    main.ensure_unique_name_index()
+    try:
+        response = client.post("/user", json={"name": "U1", "age": 1})
+        assert response.json()["message"] == "User added"
+        response = client.post("/user", json={"name": "U1", "age": 2})
+        assert response.json()["message"] == "User updated"
+
+        content = "Name,Age\nU1,3\nU2,4\n"
+        for _ in range(2):
+            response = client.post(
+                "/upload_csv", files={"file": ("users.csv", content, "text/csv")}
+            )
+            wait_for_job(response.json()["job_id"])
+
+        results = client.post(
+            "/users/batch", json=[{"name": "U2", "age": 5}, {"name": "U3", "age": 6}]
+        ).json()["results"]
+        assert [r["status"] for r in results] == ["updated", "created"]
+
+        users = client.get("/users").json()["users"]
+        assert users == [
+            {"name": "U1", "age": 3},
+            {"name": "U2", "age": 5},
+            {"name": "U3", "age": 6},
+        ]
+    finally:
+        with main.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX IF EXISTS ux_users_name")
+
+
+# 測試名稱唯一模式的批次寫入以單一 UPSERT（executemany）完成，不隨列數增加陳述式
+def test_upsert_users_single_statement(monkeypatch):
+    clear_db()
+    monkeypatch.setattr(main, "UNIQUE_USER_NAMES", True)
+    main.ensure_unique_name_index()
+    try:
+        client.post("/user", json={"name": "P0", "age": 1})
+        users = [{"name": f"P{i}", "age": i + 10} for i in range(600)]
+        responses = []
+        statements = count_statements(
+            lambda: responses.append(client.post("/users/batch", json=users))
+        )
+        # 查詢既有年齡 2 批、UPSERT 1 個、查詢 id 2 批
+        assert statements == 5
+        results = responses[0].json()["results"]
+        assert results[0]["status"] == "updated"
+        assert all(r["status"] == "created" for r in results[1:])
+        db = SessionLocal()
+        stored = dict(db.query(UserTable.id, UserTable.name).all())
+        db.close()
+        assert [stored[r["id"]] for r in results] == [u["name"] for u in users]
+    finally:
+        with main.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX IF EXISTS ux_users_name")
+
+
+# 測試一次性去重指令：每個名稱只保留最新一筆並建立唯一索引
+def test_compact_users():
+    clear_db()
+    client.post("/users/batch", json=[{"name": "D", "age": 1}, {"name": "D", "age": 2}])
+    client.post("/user", json={"name": "E", "age": 3})
+    try:
+        assert main.compact_users(vacuum=False) == 1
+        assert client.get("/users").json()["users"] == [
+            {"name": "D", "age": 2},
+            {"name": "E", "age": 3},
+        ]
+        with main.engine.connect() as conn:
+            indexes = conn.exec_driver_sql("PRAGMA index_list(users)").all()
+        assert any(row[1] == "ux_users_name" and row[2] == 1 for row in indexes)
+    finally:
+        with main.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX IF EXISTS ux_users_name")
+
+
+# 測試 GET /metrics 以 Prometheus 文字格式輸出延遲直方圖與資料庫統計
+def test_metrics_endpoint():
+    clear_db()
+
+    # 計數器在各測試間累計，因此比較請求前後的差值
+    def db_counters():
+        text = client.get("/metrics").text
+        return {
+            key: float(value)
+            for key, value in re.findall(
+                r'^(db_(?:queries|rows_written)_total\{route="[^"]+"\}) (\S+)$',
+                text,
+                re.M,
+            )
+        }
+
+    before = db_counters()
+    client.post("/user", json={"name": "M1", "age": 1})
+    client.delete("/user/M1")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    # 路由以樣板為標籤，而不是實際路徑
+    assert 'route="/user/{name}",status="200",le="+Inf"}' in text
+    after = db_counters()
+    assert {
+        key: after[key] - before.get(key, 0)
+        for key in after
+        if after[key] != before.get(key, 0)
+    } == {
+        'db_queries_total{route="/user"}': 1,
+        'db_rows_written_total{route="/user"}': 1,
+        'db_queries_total{route="/user/{name}"}': 1,
+        'db_rows_written_total{route="/user/{name}"}': 1,
+    }
+
+
+# 測試查詢失敗時會移除查詢開始時間，不會在連線上累積
+def test_metrics_query_error_pops_start():
+    with main.engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql("SELECT * FROM no_such_table")
+        assert conn.info["query_start"] == []
+        conn.exec_driver_sql("SELECT 1")
+        assert conn.info["query_start"] == []
+
+
+# 測試取樣分析器只輸出慢請求期間、處理該請求之執行緒的 folded stacks
+def test_sampling_profiler_dumps_slow_request(tmp_path):
+    profiler = SamplingProfiler(slow_ms=10, output_dir=str(tmp_path))
+    stats = RequestStats()
+    thread_id = next(iter(stats.threads))
+    profiler._samples.extend(
+        [
+            (1.0, thread_id, "main;handler;query"),
+            (1.01, thread_id, "main;handler;query"),
+            (1.02, thread_id + 1, "other;thread"),
+            (5.0, thread_id, "main;later"),
+        ]
+    )
+    assert profiler.request_finished("/users", 1.0, 1.001, stats) is None  # 不是慢請求
+    path = profiler.request_finished("/user/{name}", 0.9, 1.1, stats)
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "main;handler;query 2\n"
+
+
+# 測試欄式匯出：parquet、arrow 與 gzip 壓縮的 csv 都能還原出相同的資料
+def test_export_users_formats(monkeypatch):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    clear_db()
+    monkeypatch.setattr(main, "EXPORT_BATCH_ROWS", 2)  # 讓資料分成多個 batch
+    client.post(
+        "/users/batch",
+        json=[{"name": f"X{i}", "age": i} for i in range(5)],
+    )
+    expected = [f"X{i}" for i in range(5)]
+
+    response = client.get("/users/export", params={"format": "parquet"})
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column("name").to_pylist() == expected
+
+    response = client.get("/users/export", params={"format": "arrow"})
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column("age").to_pylist() == list(range(5))
+
+    response = client.get("/users/export", params={"format": "csv"})
+    assert 'filename="users.csv.gz"' in response.headers["content-disposition"]
+    frame = pd.read_csv(io.BytesIO(gzip.decompress(response.content)))
+    assert frame["name"].tolist() == expected
+
+    response = client.get(
+        "/users/export", params={"format": "csv", "compression": "lz4"}
+    )
+    assert response.status_code == 400
+
+
+# 測試分片模式：寫入依名稱路由，分頁、串流、平均年齡與匯入會合併所有分片，並可調整分片數量
+def test_sharded_users(monkeypatch, tmp_path):
+    shards = main.create_shard_set(3, f"sqlite:///{tmp_path}/s{{index}}of{{count}}.db")
+    monkeypatch.setattr(main, "shards", shards)
+    main.response_cache.bump()
+    try:
+        names = [f"{prefix}{i}" for prefix in "ABC" for i in range(10)]
+        response = client.post(
+            "/users/batch", json=[{"name": name, "age": 20} for name in names]
+        )
+        ids = [item["id"] for item in response.json()["results"]]
+        assert len(set(ids)) == 30
+        # 每個使用者只存在於所屬的分片
+        for name in names:
+            engine = shards.engine_for(name)
+            with engine.connect() as conn:
+                count = conn.exec_driver_sql(
+                    "SELECT COUNT(*) FROM users WHERE name = ?", (name,)
+                ).scalar()
+            assert count == 1
+        assert {len(shards.partition(names).get(s, [])) for s in range(3)} != {0}
+
+        # 以全域 id 游標分頁可以依序取回全部資料
+        seen, after_id = [], None
+        while True:
+            params = {"limit": 7, **({"after_id": after_id} if after_id else {})}
+            body = client.get("/users", params=params).json()
+            seen += [user["name"] for user in body["users"]]
+            after_id = body["next_after_id"]
+            if after_id is None:
+                break
+        assert sorted(seen) == sorted(names)
+
+        lines = client.get("/users", params={"stream": True}).text.splitlines()
+        streamed = [json.loads(line)["id"] for line in lines]
+        assert streamed == sorted(ids)
+        response = client.get("/users/export", params={"format": "csv"})
+        frame = pd.read_csv(io.BytesIO(gzip.decompress(response.content)))
+        assert frame["id"].tolist() == sorted(ids)
+
+        client.post("/user", json={"name": "A0", "age": 50})
+        client.delete("/user/B0")
+        groups = client.get("/average_age").json()["average_age_by_group"]
+        assert groups == {"A": 22.73, "B": 20.0, "C": 20.0}  # A0 新增第二筆
+
+        csv_data = "Name,Age\n" + "".join(f"D{i},{i}\n" for i in range(9))
+        assert main.import_csv_stream(io.BytesIO(csv_data.encode()), chunk_size=4) == (
+            9,
+            0,
+        )
+        assert client.get("/average_age").json()["average_age_by_group"]["D"] == 4.0
+
+        # 從 3 個分片搬移到 2 個分片，資料筆數與平均年齡不變
+        target = main.create_shard_set(
+            2, f"sqlite:///{tmp_path}/s{{index}}of{{count}}.db"
+        )
+        version = main.response_cache.version()
+        assert main.rebalance_users(shards.engines, target) == 39
+        assert main.response_cache.version() > version  # 搬移後快取失效
+        monkeypatch.setattr(main, "shards", target)
+        assert client.get("/average_age").json()["average_age_by_group"]["D"] == 4.0
+        assert len(client.get("/users", params={"limit": 100}).json()["users"]) == 39
+        target.dispose()
+    finally:
+        shards.dispose()
+        main.response_cache.bump()
+
+
+# 以模擬重新啟動的方式切換 USER_SHARDS，回傳新的分片集合（1 個分片時為 None）
+def restart_with_shards(monkeypatch, count):
+    if main.shards is not None:
+        main.shards.dispose()
+    monkeypatch.setattr(main, "USER_SHARDS", count)
+    monkeypatch.setattr(
+        main, "shards", main.create_shard_set(count) if count > 1 else None
+    )
+    main.response_cache.bump()
+
+
+# 測試命令列的 rebalance 可以從 1 個分片搬到 2 個分片，再搬回原本的資料庫
+def test_cli_rebalance_round_trip(monkeypatch, tmp_path, capsys):
+    clear_db()
+    monkeypatch.setattr(
+        main, "USER_SHARD_URL", f"sqlite:///{tmp_path}/s{{index}}of{{count}}.db"
+    )
+    users = [{"name": f"{prefix}{i}", "age": i} for prefix in "AB" for i in range(5)]
+    client.post("/users/batch", json=users)
+    expected = sorted((user["name"], user["age"]) for user in users)
+
+    def stored_users():
+        body = client.get("/users", params={"limit": 100}).json()
+        return sorted((user["name"], user["age"]) for user in body["users"])
+
+    try:
+        users_cli.run(["rebalance", "--to", "2"])
+        assert "已將 10 筆使用者搬移到 2 個分片" in capsys.readouterr().out
+        assert stored_users() == []  # 原本的 users 資料表已清空
+        restart_with_shards(monkeypatch, 2)
+        assert stored_users() == expected
+
+        users_cli.run(["rebalance", "--to", "1"])
+        assert "已將 10 筆使用者搬移到 1 個分片" in capsys.readouterr().out
+        restart_with_shards(monkeypatch, 1)
+        assert stored_users() == expected
+        groups = client.get("/average_age").json()["average_age_by_group"]
+        assert groups == {"A": 2.0, "B": 2.0}
+    finally:
+        if main.shards is not None:
+            main.shards.dispose()
+        main.response_cache.bump()
@@ -0,0 +1,85 @@
+from fastapi.testclient import TestClient  # 匯入 FastAPI 測試用的 HTTP 客戶端
+from main_async import app  # 匯入非同步版本的 app
+from test_main import clear_db  # 共用同步版本的清空資料庫工具
+from test_main import spool_dir  # noqa: F401  共用暫存資料夾的 autouse fixture
+import io  # 用來在記憶體中建立 zip 檔
+import json  # 用來解析 NDJSON 串流回應
+import zipfile  # 用來建立多檔上傳的 zip
+import time  # 用來等待背景匯入工作完成
+
+client = TestClient(app)  # 建立測試用的 FastAPI client 實例
+
+
+# 測試非同步版本的新增、查詢與刪除使用者
+def test_async_user_crud():
+    clear_db()
+    response = client.post("/user", json={"name": "Async", "age": 33})
+    assert response.status_code == 200
+    assert client.get("/users").json()["users"] == [{"name": "Async", "age": 33}]
+
+    response = client.delete("/user/Async")
+    assert response.json() == {"message": "Deleted 1 user(s) named Async"}
+
+
+# 測試非同步版本的 NDJSON 串流與平均年齡
+def test_async_stream_and_average():
+    clear_db()
+    client.post("/user", json={"name": "Amy", "age": 20})
+    client.post("/user", json={"name": "Andy", "age": 31})
+    response = client.get("/users", params={"stream": True})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["name"] for line in lines] == ["Amy", "Andy"]
+
+    response = client.get("/average_age")
+    assert response.json() == {"average_age_by_group": {"A": 25.5}}
+
+
+# 測試非同步版本的 CSV 上傳會建立背景匯入工作
+def test_async_upload_csv():
+    clear_db()
+    response = client.post(
+        "/upload_csv",
+        files={"file": ("users.csv", "Name,Age\nA,1\nB,x\n", "text/csv")},
+    )
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+    for _ in range(200):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert (job["rows_inserted"], job["rows_rejected"]) == (1, 1)
+
+
+# 測試非同步版本的多檔上傳：zip 解壓與建立工作在執行緒池中執行，壞掉的 zip 回傳 400
+def test_async_upload_csv_batch():
+    clear_db()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("c.csv", "Name,Age\nC1,30\n")
+    files = [
+        ("files", ("a.csv", "Name,Age\nA1,10\n", "text/csv")),
+        ("files", ("more.zip", archive.getvalue(), "application/zip")),
+    ]
+    response = client.post("/upload_csv/batch", files=files)
+    assert response.status_code == 200
+    jobs = response.json()["jobs"]
+    assert [job["filename"] for job in jobs] == ["a.csv", "more.zip/c.csv"]
+
+    response = client.post(
+        "/upload_csv/batch",
+        files=[("files", ("bad.zip", b"PK\x03\x04broken", "application/zip"))],
+    )
+    assert response.status_code == 400
+
+
+# 測試非同步版本的批次新增與批次刪除
+def test_async_users_batch():
+    clear_db()
+    users = [{"name": "AB1", "age": 10}, {"name": "AB2", "age": 20}]
+    response = client.post("/users/batch", json=users)
+    assert len(response.json()["results"]) == 2
+
+    response = client.request("DELETE", "/users/batch", json=["AB1"])
+    assert response.json()["message"] == "Deleted 1 user(s)"
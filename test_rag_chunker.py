@@ -0,0 +1,90 @@
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from langchain_core.documents import Document  # noqa: E402
+
+import rag_index  # noqa: E402  匯入並行切片
+from crawler import Article  # noqa: E402
+from rag_chunker import TokenChunker  # noqa: E402  匯入要測試的切片器
+
+# 以標題、清單與長段落組成的文章文字（與 crawler.clean_content 的輸出格式相同）
+TEXT = (
+    "晶片新聞\n## 製程進度\n"
+    + "".join(f"第{i}句說明二奈米製程的良率與產能。" for i in range(40))
+    + "\n- 美國廠\n- 日本廠\n## 市場反應\n分析師看好後續的訂單。\n"
+    + "long english paragraph " * 120
+)
+
+
+# 測試片段不超過 token 上限、以標題開始新的片段，且 offset 指向片段在文章中的位置
+def test_split_respects_tokens_and_structure():
+    chunker = TokenChunker(chunk_tokens=80, overlap_tokens=15)
+    chunks = chunker.split_with_offsets(TEXT)
+    assert all(chunker.count(chunk) <= 80 for _, chunk in chunks)
+    for offset, chunk in chunks:
+        if not TEXT.startswith(chunk, offset):
+            section, chunk = chunk.split("\n", 1)
+            assert section.startswith("## ")
+            assert TEXT.startswith(chunk, offset)
+    # 每個片段都帶有所屬的標題；很短的清單與下一節合併，長段落依長度在空白處切開
+    assert chunks[0][1].startswith("晶片新聞\n## 製程進度\n")
+    assert all(chunk.startswith("## ") for _, chunk in chunks[1:])
+    assert any("- 美國廠\n- 日本廠\n## 市場反應\n分析師" in c for _, c in chunks)
+    assert all(chunk.endswith("paragraph") for _, chunk in chunks[-3:])
+
+
+# 測試相鄰片段重疊結尾的句子，且重疊不超過 overlap_tokens
+def test_overlap_between_chunks():
+    chunker = TokenChunker(chunk_tokens=80, overlap_tokens=20)
+    first, second = chunker.split_with_offsets(TEXT)[:2]
+    overlap = TEXT[second[0] : first[0] + len(first[1])]
+    assert overlap == "第3句說明二奈米製程的良率與產能。"
+    assert chunker.count(overlap) <= 20
+    assert (
+        second[1]
+        == "## 製程進度\n"
+        + TEXT[second[0] :].split("\n")[0][: len(second[1]) - len("## 製程進度\n")]
+    )
+    no_overlap = TokenChunker(chunk_tokens=80, overlap_tokens=0).split_with_offsets(
+        TEXT
+    )
+    assert no_overlap[1][0] == first[0] + len(first[1])
+    with pytest.raises(ValueError):
+        TokenChunker(chunk_tokens=10, overlap_tokens=10)
+
+
+# 測試 split_documents 保留原本的 metadata 並加上 offset 與 chunk
+def test_split_documents_metadata():
+    chunker = TokenChunker(chunk_tokens=80, overlap_tokens=15)
+    docs = chunker.split_documents(
+        [Document(page_content=TEXT, metadata={"source": "https://t/a", "title": "T"})]
+    )
+    assert [doc.metadata["chunk"] for doc in docs] == list(range(len(docs)))
+    assert all(doc.metadata["source"] == "https://t/a" for doc in docs)
+    assert docs[0].metadata["offset"] == 0
+    assert [doc.metadata["offset"] for doc in docs] == sorted(
+        doc.metadata["offset"] for doc in docs
+    )
+    # 只有標題的文章仍產生一個片段
+    assert chunker.split_text("只有標題") == ["只有標題"]
+
+
+# 測試以行程池並行切片的結果與逐篇切片相同
+def test_split_articles_parallel():
+    chunker = TokenChunker(chunk_tokens=80, overlap_tokens=15)
+    items = [
+        (Article(f"https://t/{i}", f"標題{i}", TEXT), f"hash{i}")
+        for i in range(rag_index.PARALLEL_CHUNK_MIN)
+    ]
+    serial = rag_index.split_articles(items, chunker, workers=0)
+    parallel = rag_index.split_articles(items, chunker, workers=2)
+    assert [docs for docs, _ in parallel] == [docs for docs, _ in serial]
+    assert serial[3][0][0].metadata == {
+        "source": "https://t/3",
+        "hash": "hash3",
+        "title": "標題3",
+        "offset": 0,
+        "chunk": 0,
+    }
@@ -0,0 +1,75 @@
+import numpy as np  # 用來檢查向量長度
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("langchain_core")
+
+import rag_embeddings  # noqa: E402  匯入要測試的嵌入快取與本機模型
+from rag_embeddings import CachedEmbeddings, HashingEmbeddings  # noqa: E402
+
+
+# 記錄每一批送出文字的嵌入模型
+class RecordingEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__(dim=16)
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return super().embed_documents(texts)
+
+
+# 測試雜湊向量為固定、正規化的結果，且相近的文字比無關的文字更相似
+def test_hashing_embeddings():
+    embeddings = HashingEmbeddings(dim=256)
+    a = np.array(embeddings.embed_query("台積電先進製程"))
+    assert a.shape == (256,)
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert a.tolist() == embeddings.embed_documents(["台積電先進製程"])[0]
+    b = np.array(embeddings.embed_query("台積電製程進度"))
+    c = np.array(embeddings.embed_query("電動車電池回收"))
+    assert a @ b > a @ c
+
+
+# 測試相同文字只嵌入一次、未命中的文字依 batch_size 分批，且快取可跨實例保留
+def test_cached_embeddings_dedup_and_batches(tmp_path):
+    path = str(tmp_path / "cache.db")
+    inner = RecordingEmbeddings()
+    cached = CachedEmbeddings(inner, path, batch_size=2)
+    texts = ["a", "b", "a", "c", "d", "b"]
+    vectors = cached.embed_documents(texts)
+    assert inner.batches == [["a", "b"], ["c", "d"]]
+    assert vectors[0] == vectors[2] == inner.embed_query("a")
+    assert (cached.hits, cached.misses) == (2, 4)
+    cached.close()
+
+    inner = RecordingEmbeddings()
+    cached = CachedEmbeddings(inner, path, batch_size=2)
+    assert cached.embed_documents(["d", "e"])[0] == vectors[4]
+    assert inner.batches == [["e"]]
+
+
+# 測試超過筆數上限時淘汰最久未使用的項目
+def test_cached_embeddings_lru(tmp_path):
+    inner = RecordingEmbeddings()
+    cached = CachedEmbeddings(inner, str(tmp_path / "cache.db"), max_entries=2)
+    cached.embed_query("a")
+    cached.embed_query("b")
+    cached.embed_query("a")  # a 成為最近使用
+    cached.embed_query("c")  # 淘汰 b
+    inner.batches.clear()
+    cached.embed_documents(["a", "b", "c"])
+    assert inner.batches == [["b"]]
+
+
+# 測試依後端名稱建立嵌入模型，路徑為空字串時不使用快取
+def test_create_embeddings(tmp_path):
+    embeddings = rag_embeddings.create_embeddings(
+        "hashing", cache_path=str(tmp_path / "c.db"), dim=32
+    )
+    assert isinstance(embeddings, CachedEmbeddings)
+    assert embeddings.model == "hashing-32-1-2-3"
+    assert isinstance(
+        rag_embeddings.create_embeddings("hashing", cache_path=""), HashingEmbeddings
+    )
+    with pytest.raises(ValueError):
+        rag_embeddings.create_embeddings("unknown", cache_path="")
@@ -0,0 +1,157 @@
+import hashlib  # 用來產生固定的測試向量
+import os  # 用來檢查索引檔案
+import numpy as np  # 用來產生測試向量
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+text_splitters = pytest.importorskip("langchain_text_splitters")
+
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+import rag_index  # noqa: E402  匯入要測試的持久化向量庫
+from crawler import Article  # noqa: E402
+
+
+# 以文字雜湊產生固定向量的嵌入模型，並記錄被嵌入的文字
+class CountingEmbeddings(Embeddings):
+    model = "counting-test"
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded += texts
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [byte / 255 for byte in digest[:8]]
+
+
+# 測試冷啟動建立索引，之後只嵌入新增或變更的文章，並移除已不存在的文章
+def test_sync_vector_db_incremental(tmp_path):
+    splitter = text_splitters.CharacterTextSplitter(chunk_size=500, chunk_overlap=0)
+    index_dir = str(tmp_path)
+    articles = [Article(f"https://t/{i}", f"標題{i}", f"內文{i}") for i in range(3)]
+
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(articles, embeddings, splitter, index_dir)
+    assert len(embeddings.embedded) == 3
+    assert os.path.exists(os.path.join(index_dir, rag_index.MANIFEST_FILE))
+
+    # 熱啟動：沒有任何變更時只載入索引，不呼叫嵌入模型
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(articles, embeddings, splitter, index_dir)
+    assert embeddings.embedded == []
+    assert vectordb.index.ntotal == 3
+
+    # 文章 1 內容變更、文章 2 被移除、文章 3 為新文章；文章 0 抓取失敗時沿用舊版本
+    updated = [
+        Article("https://t/0", "標題0", ""),
+        Article("https://t/1", "標題1", "新的內文"),
+        Article("https://t/3", "標題3", "內文3"),
+    ]
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(updated, embeddings, splitter, index_dir)
+    assert sorted(embeddings.embedded) == ["標題1\n新的內文", "標題3\n內文3"]
+    sources = sorted(
+        vectordb.docstore.search(doc_id).metadata["source"]
+        for doc_id in vectordb.index_to_docstore_id.values()
+    )
+    assert sources == ["https://t/0", "https://t/1", "https://t/3"]
+
+    manifest = rag_index.load_manifest(index_dir)
+    assert sorted(manifest["articles"]) == sources
+    assert manifest["embedding_model"] == "counting-test"
+
+    # 切片器設定變更時重新切片並嵌入所有文章，片段帶有標題
+    splitter = text_splitters.RecursiveCharacterTextSplitter(chunk_size=500)
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(updated, embeddings, splitter, index_dir)
+    assert sorted(embeddings.embedded) == ["標題1\n新的內文", "標題3\n內文3"]
+    assert vectordb.index.ntotal == 3
+    assert rag_index.load_manifest(index_dir)["splitter"] == (
+        "RecursiveCharacterTextSplitter"
+    )
+    titles = {
+        doc.metadata["source"]: doc.metadata["title"]
+        for doc in vectordb.docstore._dict.values()
+    }
+    assert titles["https://t/3"] == "標題3"
+
+
+# 確認每個位置的向量都對應到 docstore 中正確的片段：以片段文字的向量搜尋，最近的必須是自己
+def assert_consistent(vectordb, embeddings):
+    for position, doc_id in vectordb.index_to_docstore_id.items():
+        text = vectordb.docstore.search(doc_id).page_content
+        _, found = vectordb.index.search(np.array([embeddings.embed_query(text)]), 1)
+        assert found[0][0] == position
+
+
+# 測試各索引類型的召回率，以及向量不足以訓練時改用 flat
+def test_create_index_types():
+    rng = np.random.default_rng(0)
+    vectors = rng.random((10_000, 16), dtype="float32")
+    queries = vectors[:50] + 0.01
+    flat = rag_index.create_index(vectors, rag_index.index_settings("flat"))
+    flat.add(vectors)
+    _, truth = flat.search(queries, 10)
+
+    for index_type in ("ivf", "hnsw", "ivfpq"):
+        # 減少 PQ 子向量數以縮短訓練時間
+        settings = {**rag_index.index_settings(index_type), "pq_m": 4}
+        index = rag_index.create_index(vectors, settings)
+        assert rag_index.index_kind(index) == index_type
+        index.add(vectors)
+        _, found = index.search(queries, 10)
+        recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(found, truth)])
+        assert recall > 0.5, index_type
+
+    small = rag_index.create_index(vectors[:100], rag_index.index_settings("ivfpq"))
+    assert rag_index.index_kind(small) == "flat"
+    with pytest.raises(ValueError):
+        rag_index.index_settings("lsh")
+
+
+# 測試 HNSW / IVF 向量庫的增量同步、切換索引類型與記憶體映射載入，都不需重新嵌入既有片段
+def test_sync_vector_db_ann(tmp_path):
+    splitter = text_splitters.CharacterTextSplitter(chunk_size=500, chunk_overlap=0)
+    index_dir = str(tmp_path)
+    articles = [Article(f"https://t/{i}", f"標題{i}", f"內文{i}") for i in range(700)]
+
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(
+        articles, embeddings, splitter, index_dir, index_type="hnsw"
+    )
+    assert rag_index.index_kind(vectordb.index) == "hnsw"
+    assert rag_index.load_manifest(index_dir)["index"]["type"] == "hnsw"
+
+    # HNSW 不支援刪除：以原索引的向量重建，只嵌入變更的文章
+    articles[1] = Article("https://t/1", "標題1", "新的內文")
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(
+        articles[1:], embeddings, splitter, index_dir, index_type="hnsw"
+    )
+    assert embeddings.embedded == ["標題1\n新的內文"]
+    assert vectordb.index.ntotal == 699
+    assert_consistent(vectordb, embeddings)
+
+    # 改用 IVF：重新訓練，向量取自原索引
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(
+        articles[2:], embeddings, splitter, index_dir, index_type="ivf"
+    )
+    assert embeddings.embedded == []
+    assert rag_index.index_kind(vectordb.index) == "ivf"
+    assert vectordb.index.ntotal == 698
+    assert_consistent(vectordb, embeddings)
+
+    # 沒有變更時以記憶體映射載入
+    embeddings = CountingEmbeddings()
+    vectordb = rag_index.sync_vector_db(
+        articles[2:], embeddings, splitter, index_dir, index_type="ivf", mmap=True
+    )
+    assert embeddings.embedded == []
+    assert rag_index.index_kind(vectordb.index) == "ivf"
+    assert vectordb.index.ntotal == 698
@@ -0,0 +1,105 @@
+import pytest  # 用來略過缺少選用套件的測試
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_community.vectorstores import FAISS  # noqa: E402
+
+import rag_qa  # noqa: E402  匯入要測試的答案快取與批次問答
+from rag_embeddings import HashingEmbeddings  # noqa: E402
+
+
+# 代替 LLM 的文件合併鏈：記錄每次呼叫的問題與片段，回答內容包含第一個片段
+class FakeCombineChain:
+    output_key = "output_text"
+
+    def __init__(self):
+        self.calls = []
+
+    def invoke(self, inputs):
+        self.calls.append((inputs["question"], inputs["input_documents"]))
+        return {"output_text": f"答：{inputs['input_documents'][0].page_content}"}
+
+    async def ainvoke(self, inputs):
+        return self.invoke(inputs)
+
+
+class FakeQA:
+    def __init__(self):
+        self.combine_documents_chain = FakeCombineChain()
+
+
+@pytest.fixture
+def vectordb():
+    docs = [
+        Document(page_content="台積電 2 奈米製程量產"),
+        Document(page_content="電動車電池回收技術"),
+        Document(page_content="生成式 AI 晶片需求"),
+    ]
+    return FAISS.from_documents(docs, HashingEmbeddings(dim=256))
+
+
+# 測試問題正規化：全半形、大小寫、空白與結尾標點
+def test_normalize_question():
+    assert rag_qa.normalize_question("  ＡＩ  晶片 需求？ ") == "ai 晶片 需求"
+
+
+# 測試完全相同、語意相近與索引版本變更後的快取行為
+def test_answer_question_cache_tiers(tmp_path, vectordb):
+    path = str(tmp_path / "answers.db")
+    qa = FakeQA()
+    cache = rag_qa.AnswerCache("v1", path, threshold=0.75)
+
+    answer, source = rag_qa.answer_question(qa, vectordb, cache, "電動車電池回收？")
+    assert (answer, source) == ("答：電動車電池回收技術", "llm")
+    assert rag_qa.answer_question(qa, vectordb, cache, "電動車電池回收")[1] == "exact"
+    assert rag_qa.answer_question(qa, vectordb, cache, "電動車的電池回收")[1] == (
+        "semantic"
+    )
+    assert len(qa.combine_documents_chain.calls) == 1
+    assert rag_qa.answer_question(qa, vectordb, cache, "AI 晶片")[1] == "llm"
+    cache.close()
+
+    # 快取可跨實例保留；索引版本不同時舊答案失效
+    assert rag_qa.AnswerCache("v1", path).lookup_exact("電動車電池回收") is not None
+    assert rag_qa.AnswerCache("v2", path).lookup_exact("電動車電池回收") is None
+
+
+# 測試批次模式：依輸入順序回傳、重複問題只問一次、快取命中的問題不呼叫 LLM
+def test_answer_batch(tmp_path, vectordb):
+    qa = FakeQA()
+    cache = rag_qa.AnswerCache("v1", str(tmp_path / "answers.db"))
+    cache.store("AI 晶片", vectordb.embeddings.embed_query("AI 晶片"), "快取的答案")
+
+    questions = ["台積電製程", "AI 晶片？", "電動車電池", "台積電製程"]
+    results = rag_qa.answer_batch(qa, vectordb, cache, questions)
+    assert results == [
+        ("答：台積電 2 奈米製程量產", "llm"),
+        ("快取的答案", "exact"),
+        ("答：電動車電池回收技術", "llm"),
+        ("答：台積電 2 奈米製程量產", "llm"),
+    ]
+    assert sorted(q for q, _ in qa.combine_documents_chain.calls) == [
+        "台積電製程",
+        "電動車電池",
+    ]
+    # 每個問題都取得 RETRIEVAL_K 個片段（向量庫只有 3 個）
+    assert all(len(docs) == 3 for _, docs in qa.combine_documents_chain.calls)
+
+
+# 測試檢索時同一篇文章最多保留 max_per_source 個片段，並由其他文章補足 k 個
+def test_retrieve_batch_dedupes_sources():
+    docs = [
+        Document(page_content=f"台積電製程 第{i}段", metadata={"source": "a"})
+        for i in range(4)
+    ] + [
+        Document(page_content="台積電 法說會", metadata={"source": "b"}),
+        Document(page_content="電動車電池", metadata={"source": "c"}),
+    ]
+    vectordb = FAISS.from_documents(docs, HashingEmbeddings(dim=256))
+    (vector,) = [vectordb.embeddings.embed_query("台積電製程")]
+    (hits,) = rag_qa.retrieve_batch(vectordb, [vector], k=3)
+    assert sorted(doc.metadata["source"] for doc in hits) == ["a", "b", "c"]
+    (hits,) = rag_qa.retrieve_batch(vectordb, [vector], k=3, max_per_source=0)
+    assert [doc.metadata["source"] for doc in hits] == ["a", "a", "a"]
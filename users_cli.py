@@ -0,0 +1,134 @@
+# users 資料庫的維護指令
+# 用法：
+#   python users_cli.py dedup              每個名稱只保留最新一筆，建立唯一索引並 VACUUM
+#   python users_cli.py dedup --no-vacuum  不執行 VACUUM（大型資料庫可另外排程）
+#   python users_cli.py rebalance --to 4   將目前 USER_SHARDS 的資料重新分配到 4 個分片
+#   python users_cli.py ingest exports/ more.zip a.csv --workers 8
+#                                          以多個子行程平行解析 CSV，單一寫入者匯入
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+import zipfile
+
+import main
+from sharding import ShardSet
+
+
+# 去重與壓縮既有資料庫，完成後即可設定 UNIQUE_USER_NAMES=1 啟用名稱唯一模式
+def dedup(args):
+    deleted = main.compact_users(vacuum=not args.no_vacuum)
+    print(f"已刪除 {deleted} 筆重複的使用者資料，並建立 users.name 唯一索引")
+
+
+# 調整分片數量：將目前的使用者資料搬移到新的分片檔案（分片數為 1 時即 DATABASE_URL）
+def rebalance(args):
+    if args.to < 1:
+        raise SystemExit("分片數量至少為 1")
+    if args.to == main.USER_SHARDS:
+        raise SystemExit(f"目前已是 {args.to} 個分片")
+    source = main.user_engines()
+    target = main.create_shard_set(args.to) if args.to > 1 else ShardSet([main.engine])
+    try:
+        moved = main.rebalance_users(source, target)
+    finally:
+        if args.to > 1:
+            target.dispose()
+    print(
+        f"已將 {moved} 筆使用者搬移到 {args.to} 個分片，原本的 users 資料表已清空；"
+        f"請設定 USER_SHARDS={args.to} 後重新啟動服務，之後可刪除舊的分片檔案"
+    )
+
+
+# 將命令列路徑展開成 (顯示名稱, CSV 路徑)：目錄取其中的 .csv 與 .zip，zip 內的 CSV 解壓縮到 tmpdir
+def collect_csv_paths(paths, tmpdir):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from collect_csv_paths(
+                [
+                    os.path.join(path, name)
+                    for name in sorted(os.listdir(path))
+                    if name.lower().endswith((".csv", ".zip"))
+                ],
+                tmpdir,
+            )
+        elif zipfile.is_zipfile(path):
+            target = tempfile.mkdtemp(dir=tmpdir)
+            with zipfile.ZipFile(path) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or not member.filename.lower().endswith(".csv"):
+                        continue
+                    yield f"{path}/{member.filename}", archive.extract(member, target)
+        else:
+            yield path, path
+
+
+# 由匯入檔案的名稱（命令列路徑或「zip 路徑/成員名稱」）產生被拒絕報表的檔名
+# 不同資料夾或 zip 中的同名檔案各自有報表：路徑轉成檔名後再加上完整名稱的雜湊值
+def rejected_report_name(name):
+    readable = re.sub(r"[^\w.-]+", "_", name).strip("_")[-100:]
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return f"{readable}-{digest}.rejected.csv"
+
+
+# 平行匯入多份 CSV：子行程負責解析與驗證，本行程是唯一的資料庫寫入者
+def ingest(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tasks = []
+        for name, path in collect_csv_paths(args.paths, tmpdir):
+            try:
+                with open(path, "rb") as f:
+                    main.check_csv_columns(f)
+            except Exception as e:
+                print(f"略過 {name}：{getattr(e, 'detail', e)}")
+                continue
+            rejected_path = None
+            if args.rejected_dir:
+                os.makedirs(args.rejected_dir, exist_ok=True)
+                rejected_path = os.path.join(
+                    args.rejected_dir, rejected_report_name(name)
+                )
+            tasks.append((name, path, 0, rejected_path))
+
+        def on_file(name, error):
+            if error is not None:
+                print(f"{name}：匯入失敗 {error}")
+
+        totals = main.ingest_csv_files(tasks, workers=args.workers, on_file=on_file)
+    for name, (inserted, rejected) in totals.items():
+        print(f"{name}：匯入 {inserted} 筆，拒絕 {rejected} 筆")
+    inserted = sum(inserted for inserted, _ in totals.values())
+    rejected = sum(rejected for _, rejected in totals.values())
+    print(f"共 {len(totals)} 個檔案，匯入 {inserted} 筆，拒絕 {rejected} 筆")
+
+
+# 解析命令列參數並執行對應的子指令
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="users 資料庫維護工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dedup_parser = subparsers.add_parser("dedup", help="去除重複名稱並建立唯一索引")
+    dedup_parser.add_argument(
+        "--no-vacuum", action="store_true", help="完成後不執行 VACUUM"
+    )
+    dedup_parser.set_defaults(func=dedup)
+
+    rebalance_parser = subparsers.add_parser("rebalance", help="調整 users 的分片數量")
+    rebalance_parser.add_argument("--to", type=int, required=True, help="新的分片數量")
+    rebalance_parser.set_defaults(func=rebalance)
+
+    ingest_parser = subparsers.add_parser("ingest", help="平行匯入多份 CSV")
+    ingest_parser.add_argument("paths", nargs="+", help="CSV 檔案、zip 或資料夾")
+    ingest_parser.add_argument(
+        "--workers", type=int, default=None, help="解析用的子行程數量"
+    )
+    ingest_parser.add_argument("--rejected-dir", help="被拒絕資料報表的輸出資料夾")
+    ingest_parser.set_defaults(func=ingest)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    run()